@@ -0,0 +1,129 @@
+from collections import namedtuple
+
+import numpy as np
+import tensorflow as tf
+
+from libspn_keras.backprop_mode import BackpropMode
+from libspn_keras.layers import DenseSum, DenseProduct, ReduceProduct, Conv2DProduct, Conv2DSum, Local2DSum, \
+    RootSum, NormalLeaf, LaplaceLeaf, CauchyLeaf, IndicatorLeaf, CategoricalLeaf, BernoulliLeaf
+from libspn_keras.math.logconv import logconv1x1_2d
+from libspn_keras.math.logmatmul import logmatmul
+
+ALL_BACKPROP_MODES = [
+    BackpropMode.GRADIENT, BackpropMode.EM, BackpropMode.HARD_EM, BackpropMode.HARD_EM_UNWEIGHTED
+]
+# Leaves receive the same statistics from sums with any of the EM-based backprop modes
+LEAF_BACKPROP_MODES = [BackpropMode.GRADIENT, BackpropMode.EM]
+
+# Number of values of the variables of categorical leaves
+NUM_CATEGORICAL_VALUES = 4
+
+BenchmarkCase = namedtuple("BenchmarkCase", ["name", "backprop_modes", "build"])
+BenchmarkCase.__doc__ = """
+A benchmark of a single layer or op.
+
+Args:
+    name: Name of the benchmark
+    backprop_modes: ``BackpropMode`` s to run the benchmark for, or ``[None]`` if the benchmark does
+        not depend on a backprop mode
+    build: Function that takes the number of samples, scopes and nodes and the backprop mode and
+        returns a tuple of a function that evaluates the layer or op for an input, the input and
+        the variables that are trained with the EM statistics or gradients
+"""
+
+
+def _log_probabilities(shape):
+    return tf.math.log(tf.random.uniform(shape, minval=1e-3))
+
+
+def _dense_input(num_batch, num_scopes, num_nodes):
+    return _log_probabilities([num_batch, num_scopes, 1, num_nodes])
+
+
+def _spatial_input(num_batch, num_scopes, num_nodes):
+    # Scopes are laid out on a square grid of pixels
+    side = int(np.sqrt(num_scopes))
+    return _log_probabilities([num_batch, side, side, num_nodes])
+
+
+def _layer(make_layer, make_input):
+    def build(num_batch, num_scopes, num_nodes, backprop_mode):
+        layer = make_layer(num_nodes, backprop_mode)
+        x = make_input(num_batch, num_scopes, num_nodes)
+        layer(x)
+        return layer, x, layer.trainable_variables
+    return build
+
+
+def _leaf(make_leaf, make_values):
+    def make_layer(num_nodes, backprop_mode):
+        return make_leaf(num_nodes, backprop_mode)
+
+    def make_input(num_batch, num_scopes, num_nodes):
+        return make_values([num_batch, num_scopes, 1, 1])
+
+    return _layer(make_layer, make_input)
+
+
+def _location_scale_leaf(leaf_class):
+    return _leaf(
+        lambda num_nodes, backprop_mode: leaf_class(
+            num_components=num_nodes, use_accumulators=backprop_mode != BackpropMode.GRADIENT),
+        lambda shape: tf.random.normal(shape))
+
+
+def _logmatmul(num_batch, num_scopes, num_nodes, backprop_mode):
+    x = tf.transpose(_dense_input(num_batch, num_scopes, num_nodes), (1, 2, 0, 3))
+    log_weights = tf.Variable(tf.nn.log_softmax(tf.random.normal([num_scopes, 1, num_nodes, num_nodes]), axis=2))
+    return lambda x: logmatmul(x, tf.convert_to_tensor(log_weights)), x, [log_weights]
+
+
+def _logconv1x1_2d(num_batch, num_scopes, num_nodes, backprop_mode):
+    x = _spatial_input(num_batch, num_scopes, num_nodes)
+    log_weights = tf.Variable(tf.nn.log_softmax(tf.random.normal([1, 1, num_nodes, num_nodes]), axis=2))
+    return lambda x: logconv1x1_2d(x, tf.convert_to_tensor(log_weights)), x, [log_weights]
+
+
+CASES = [
+    BenchmarkCase("DenseSum", ALL_BACKPROP_MODES, _layer(
+        lambda num_nodes, backprop_mode: DenseSum(num_sums=num_nodes, backprop_mode=backprop_mode),
+        _dense_input)),
+    BenchmarkCase("DenseProduct", [None], _layer(
+        lambda num_nodes, backprop_mode: DenseProduct(num_factors=2), _dense_input)),
+    BenchmarkCase("ReduceProduct", [None], _layer(
+        lambda num_nodes, backprop_mode: ReduceProduct(num_factors=2), _dense_input)),
+    BenchmarkCase("Conv2DProduct/onehot", [None], _layer(
+        lambda num_nodes, backprop_mode: Conv2DProduct(
+            strides=[2, 2], dilations=[1, 1], kernel_size=[2, 2], num_channels=num_nodes ** 2),
+        _spatial_input)),
+    BenchmarkCase("Conv2DProduct/depthwise", [None], _layer(
+        lambda num_nodes, backprop_mode: Conv2DProduct(
+            strides=[2, 2], dilations=[1, 1], kernel_size=[2, 2], depthwise=True),
+        _spatial_input)),
+    BenchmarkCase("Conv2DSum", ALL_BACKPROP_MODES, _layer(
+        lambda num_nodes, backprop_mode: Conv2DSum(num_sums=num_nodes, backprop_mode=backprop_mode),
+        _spatial_input)),
+    BenchmarkCase("Local2DSum", ALL_BACKPROP_MODES, _layer(
+        lambda num_nodes, backprop_mode: Local2DSum(num_sums=num_nodes, backprop_mode=backprop_mode),
+        _spatial_input)),
+    BenchmarkCase("RootSum", ALL_BACKPROP_MODES, _layer(
+        lambda num_nodes, backprop_mode: RootSum(return_weighted_child_logits=False, backprop_mode=backprop_mode),
+        lambda num_batch, num_scopes, num_nodes: _dense_input(num_batch, 1, num_scopes * num_nodes))),
+    BenchmarkCase("NormalLeaf", LEAF_BACKPROP_MODES, _location_scale_leaf(NormalLeaf)),
+    BenchmarkCase("LaplaceLeaf", LEAF_BACKPROP_MODES, _location_scale_leaf(LaplaceLeaf)),
+    BenchmarkCase("CauchyLeaf", LEAF_BACKPROP_MODES, _location_scale_leaf(CauchyLeaf)),
+    BenchmarkCase("BernoulliLeaf", LEAF_BACKPROP_MODES, _leaf(
+        lambda num_nodes, backprop_mode: BernoulliLeaf(
+            num_components=num_nodes, use_accumulators=backprop_mode != BackpropMode.GRADIENT,
+            backprop_mode=backprop_mode),
+        lambda shape: tf.cast(tf.random.uniform(shape) > 0.5, tf.float32))),
+    BenchmarkCase("CategoricalLeaf", ALL_BACKPROP_MODES, _leaf(
+        lambda num_nodes, backprop_mode: CategoricalLeaf(
+            num_components=num_nodes, num_values=NUM_CATEGORICAL_VALUES, backprop_mode=backprop_mode),
+        lambda shape: tf.random.uniform(shape, maxval=NUM_CATEGORICAL_VALUES, dtype=tf.int32))),
+    BenchmarkCase("IndicatorLeaf", [None], _leaf(
+        lambda num_nodes, backprop_mode: IndicatorLeaf(num_components=num_nodes),
+        lambda shape: tf.random.uniform(shape, maxval=2, dtype=tf.int32))),
+    BenchmarkCase("logmatmul", [None], _logmatmul),
+    BenchmarkCase("logconv1x1_2d", [None], _logconv1x1_2d),
+]
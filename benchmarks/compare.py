@@ -0,0 +1,87 @@
+"""
+Compares two JSON results of ``benchmarks.run``, e.g. of two commits, and prints the ratio of the
+throughputs and of the peak memory of every benchmark that appears in both:
+
+    python -m benchmarks.compare baseline.json results.json
+
+Throughput ratios above 1 and memory ratios below 1 are improvements. Benchmarks of which a ratio
+crosses ``--threshold`` are marked.
+"""
+import argparse
+import json
+
+PASSES = ["forward", "backward", "em_step"]
+
+
+def _key(result):
+    return result["name"], result["backprop_mode"], result["num_batch"], result["num_scopes"], result["num_nodes"]
+
+
+def _ratio(new, old):
+    if new is None or old is None or old == 0:
+        return None
+    return new / old
+
+
+def compare(baseline, results, threshold=0.1):
+    """
+    Compares the results of two runs.
+
+    Args:
+        baseline: Report of ``benchmarks.run`` to compare against
+        results: Report of ``benchmarks.run`` to compare
+        threshold: Relative change above which a benchmark is marked as a regression or an
+            improvement
+
+    Returns:
+        A list of rows of the benchmark key, the ratios of the throughputs of every pass, the
+        ratio of the peak memory and a mark that is ``"regression"``, ``"improvement"`` or ``""``.
+    """
+    baseline_by_key = {_key(result): result for result in baseline["results"] if "error" not in result}
+    rows = []
+    for result in results["results"]:
+        old = baseline_by_key.get(_key(result))
+        if old is None or "error" in result:
+            continue
+        throughput_ratios = [
+            _ratio((result[p] or {}).get("samples_per_second"), (old[p] or {}).get("samples_per_second"))
+            for p in PASSES
+        ]
+        memory_ratio = _ratio(result["peak_memory"], old["peak_memory"])
+        # Memory grows when the ratio exceeds 1, unlike throughput
+        changes = [r - 1 for r in throughput_ratios if r is not None] + \
+            ([1 - memory_ratio] if memory_ratio is not None else [])
+        mark = ""
+        if any(change < -threshold for change in changes):
+            mark = "regression"
+        elif any(change > threshold for change in changes):
+            mark = "improvement"
+        rows.append((_key(result), throughput_ratios, memory_ratio, mark))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline", help="JSON results to compare against")
+    parser.add_argument("results", help="JSON results to compare")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change to mark")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.results) as f:
+        results = json.load(f)
+
+    header = ["Benchmark", "Mode", "Batch", "Scopes", "Nodes"] + PASSES + ["Memory", ""]
+    table = [header]
+    for key, throughput_ratios, memory_ratio, mark in compare(baseline, results, threshold=args.threshold):
+        table.append([str(value) for value in key] + [
+            "-" if ratio is None else "{:.2f}x".format(ratio) for ratio in throughput_ratios + [memory_ratio]
+        ] + [mark])
+    widths = [max(len(row[i]) for row in table) for i in range(len(header))]
+    for row in table:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Deterministic synthetic datasets of controllable size for benchmarking the training of SPNs without
+downloading data. Every generator draws its samples from a mixture of ``num_clusters`` random
+prototypes, so that a model with enough capacity can fit considerably more than the independent
+marginals, and returns the same samples for the same arguments and ``seed``.
+"""
+import numpy as np
+
+
+def binary(num_samples, num_vars, num_clusters=4, noise=0.1, seed=0):
+    """
+    Generates binary tabular data.
+
+    Args:
+        num_samples: Number of samples
+        num_vars: Number of variables of each sample
+        num_clusters: Number of prototypes of which each sample is a noisy copy
+        noise: Probability with which each variable is flipped from the value of its prototype
+        seed: Seed of the generator
+
+    Returns:
+        An ``int32`` array of zeros and ones of shape ``[num_samples, num_vars]``.
+    """
+    rng = np.random.RandomState(seed)
+    prototypes = rng.randint(2, size=(num_clusters, num_vars))
+    clusters = rng.randint(num_clusters, size=num_samples)
+    flips = rng.uniform(size=(num_samples, num_vars)) < noise
+    return np.logical_xor(prototypes[clusters], flips).astype(np.int32)
+
+
+def categorical(num_samples, num_vars, num_values=4, num_clusters=4, concentration=0.5, seed=0):
+    """
+    Generates categorical tabular data.
+
+    Args:
+        num_samples: Number of samples
+        num_vars: Number of variables of each sample
+        num_values: Number of values of each variable
+        num_clusters: Number of clusters, each of which has its own categorical distribution per
+            variable
+        concentration: Concentration of the Dirichlet prior of the distributions of the clusters.
+            Smaller values give more peaked distributions and thus more structured data.
+        seed: Seed of the generator
+
+    Returns:
+        An ``int32`` array of values in ``[0, num_values)`` of shape ``[num_samples, num_vars]``.
+    """
+    rng = np.random.RandomState(seed)
+    probs = rng.dirichlet([concentration] * num_values, size=(num_clusters, num_vars))
+    clusters = rng.randint(num_clusters, size=num_samples)
+    # Inverse transform sampling of all variables at once
+    cdf = np.cumsum(probs[clusters], axis=-1)
+    values = (rng.uniform(size=(num_samples, num_vars, 1)) > cdf).sum(axis=-1)
+    return np.minimum(values, num_values - 1).astype(np.int32)
+
+
+def continuous(num_samples, num_vars, num_clusters=4, scale=0.5, seed=0):
+    """
+    Generates continuous tabular data from a mixture of Gaussians with diagonal covariances.
+
+    Args:
+        num_samples: Number of samples
+        num_vars: Number of variables of each sample
+        num_clusters: Number of components of the mixture
+        scale: Standard deviation of each variable within a component. The locations of the
+            components are drawn from a standard normal distribution.
+        seed: Seed of the generator
+
+    Returns:
+        A ``float32`` array of shape ``[num_samples, num_vars]``.
+    """
+    rng = np.random.RandomState(seed)
+    locations = rng.normal(size=(num_clusters, num_vars))
+    clusters = rng.randint(num_clusters, size=num_samples)
+    return (locations[clusters] + scale * rng.normal(size=(num_samples, num_vars))).astype(np.float32)
+
+
+def images(num_samples, height, width, num_channels=1, num_clusters=4, noise=0.1, seed=0):
+    """
+    Generates images that are noisy copies of smooth random prototypes, so that neighbouring pixels
+    are correlated.
+
+    Args:
+        num_samples: Number of images
+        height: Height of each image
+        width: Width of each image
+        num_channels: Number of channels of each image
+        num_clusters: Number of prototypes
+        noise: Standard deviation of the pixel noise that is added to the prototypes
+        seed: Seed of the generator
+
+    Returns:
+        A ``float32`` array of values in ``[0, 1]`` of shape
+        ``[num_samples, height, width, num_channels]``.
+    """
+    rng = np.random.RandomState(seed)
+    # Prototypes are sums of a few random sinusoids, which vary smoothly over the pixels
+    rows = np.arange(height).reshape(1, height, 1, 1, 1)
+    cols = np.arange(width).reshape(1, 1, width, 1, 1)
+    num_waves = 3
+    frequencies = rng.uniform(0.0, np.pi / 2, size=(2, num_clusters, 1, 1, num_channels, num_waves))
+    phases = rng.uniform(0.0, 2 * np.pi, size=(num_clusters, 1, 1, num_channels, num_waves))
+    prototypes = 0.5 + 0.5 * np.mean(np.sin(frequencies[0] * rows + frequencies[1] * cols + phases), axis=-1)
+    clusters = rng.randint(num_clusters, size=num_samples)
+    x = prototypes[clusters] + noise * rng.normal(size=(num_samples, height, width, num_channels))
+    return np.clip(x, 0.0, 1.0).astype(np.float32)
+
+
+def sequences(num_sequences, num_vars, min_len, max_len, num_values=2, num_states=4, concentration=0.5, seed=0):
+    """
+    Generates variable-length sequences of categorical variables from a hidden Markov model.
+
+    Args:
+        num_sequences: Number of sequences
+        num_vars: Number of variables at each timestep
+        min_len: Minimum length of a sequence
+        max_len: Maximum length of a sequence. Lengths are drawn uniformly from
+            ``[min_len, max_len]``.
+        num_values: Number of values of each variable
+        num_states: Number of hidden states
+        concentration: Concentration of the Dirichlet priors of the transition and emission
+            distributions. Smaller values give more predictable sequences.
+        seed: Seed of the generator
+
+    Returns:
+        A list of ``int32`` arrays of shape ``[sequence_len, num_vars]``, e.g. for
+        ``libspn_keras.utils.bucket_sequences_by_length``.
+    """
+    rng = np.random.RandomState(seed)
+    initial = rng.dirichlet([1.0] * num_states)
+    transitions = rng.dirichlet([concentration] * num_states, size=num_states)
+    emissions = rng.dirichlet([concentration] * num_values, size=(num_states, num_vars))
+    sequence_lens = rng.randint(min_len, max_len + 1, size=num_sequences)
+
+    states = rng.choice(num_states, size=num_sequences, p=initial)
+    steps = []
+    for t in range(max_len):
+        if t > 0:
+            cdf = np.cumsum(transitions[states], axis=-1)
+            states = np.minimum((rng.uniform(size=(num_sequences, 1)) > cdf).sum(axis=-1), num_states - 1)
+        cdf = np.cumsum(emissions[states], axis=-1)
+        values = (rng.uniform(size=(num_sequences, num_vars, 1)) > cdf).sum(axis=-1)
+        steps.append(np.minimum(values, num_values - 1).astype(np.int32))
+    steps = np.stack(steps, axis=1)
+    return [steps[i, :sequence_len] for i, sequence_len in enumerate(sequence_lens)]
+
+
+def pre_pad(sequences):
+    """
+    Pads sequences at the start to the length of the longest one, as expected by
+    ``DynamicSumProductNetwork``.
+
+    Args:
+        sequences: List of arrays of shape ``[sequence_len, num_vars]``
+
+    Returns:
+        A tuple of an array of shape ``[num_sequences, max_sequence_len, num_vars]`` and an
+        ``int32`` array of the length of each sequence.
+    """
+    sequence_lens = np.asarray([len(sequence) for sequence in sequences], dtype=np.int32)
+    max_len = sequence_lens.max()
+    x = np.zeros((len(sequences), max_len, sequences[0].shape[1]), dtype=sequences[0].dtype)
+    for i, sequence in enumerate(sequences):
+        x[i, max_len - len(sequence):] = sequence
+    return x, sequence_lens
@@ -0,0 +1,86 @@
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from libspn_keras.backprop_mode import BackpropMode
+from libspn_keras.utils.batch_size import measure_peak_memory
+
+
+def benchmark(fn, x, variables, backprop_mode, num_batch, num_repeats):
+    """
+    Measures the throughput of the forward pass, the backward pass and an EM step of a layer or op
+    and the peak memory of its backward pass.
+
+    Args:
+        fn: Function that evaluates the layer or op for an input
+        x: Input
+        variables: Variables that are trained with the gradients or EM statistics
+        backprop_mode: ``BackpropMode`` of the layer or ``None``. An EM step is only measured for
+            the EM-based backprop modes, in which the statistics are added to the accumulators.
+        num_batch: Number of samples in ``x``
+        num_repeats: Number of times each pass is timed, of which the median is reported
+
+    Returns:
+        A dict of the median times in seconds and the throughputs in samples per second of the
+        ``forward``, ``backward`` (which includes the forward pass) and ``em_step`` passes and the
+        ``peak_memory`` in bytes of the backward pass. Passes that do not apply are ``None``, as is
+        ``peak_memory`` if it cannot be measured on this platform.
+    """
+    differentiable_input = x.dtype.is_floating
+
+    @tf.function
+    def forward(x):
+        return fn(x)
+
+    @tf.function
+    def backward(x):
+        with tf.GradientTape() as tape:
+            if differentiable_input:
+                tape.watch(x)
+            out = fn(x)
+        return tape.gradient(
+            out, ([x] if differentiable_input else []) + variables, output_gradients=tf.ones_like(out),
+            unconnected_gradients=tf.UnconnectedGradients.ZERO)
+
+    @tf.function
+    def em_step(x):
+        with tf.GradientTape() as tape:
+            out = fn(x)
+        grads = tape.gradient(
+            out, variables, output_gradients=tf.ones_like(out), unconnected_gradients=tf.UnconnectedGradients.ZERO)
+        for v, g in zip(variables, grads):
+            v.assign_add(g)
+        return out
+
+    result = dict(forward=_throughput(forward, x, num_batch, num_repeats), backward=None, em_step=None,
+                  peak_memory=None)
+    if differentiable_input or variables:
+        result["backward"] = _throughput(backward, x, num_batch, num_repeats)
+        result["peak_memory"] = _peak_memory(lambda: backward(x))
+    if variables and backprop_mode not in [None, BackpropMode.GRADIENT]:
+        initial_values = [v.numpy() for v in variables]
+        result["em_step"] = _throughput(em_step, x, num_batch, num_repeats)
+        for v, value in zip(variables, initial_values):
+            v.assign(value)
+    return result
+
+
+def _throughput(fn, x, num_batch, num_repeats):
+    # The first call traces the function
+    tf.nest.map_structure(lambda t: t.numpy(), fn(x))
+    times = []
+    for _ in range(num_repeats):
+        start = time.perf_counter()
+        tf.nest.map_structure(lambda t: t.numpy(), fn(x))
+        times.append(time.perf_counter() - start)
+    median_time = float(np.median(times))
+    return dict(seconds=median_time, samples_per_second=num_batch / median_time)
+
+
+def _peak_memory(fn):
+    try:
+        return measure_peak_memory(fn)
+    except NotImplementedError:
+        # Peak host memory is only measured on Linux
+        return None
@@ -0,0 +1,97 @@
+"""
+Benchmarks the throughput of the forward pass, the backward pass and an EM step and the peak memory
+of the backward pass of libspn_keras layers and ops for every applicable backprop mode over a grid
+of batch sizes, numbers of scopes and numbers of nodes, and writes the results as JSON. Results of
+different commits can be compared with ``benchmarks.compare``. Run from the root of the repository:
+
+    python -m benchmarks.run --grid default --output results.json
+"""
+import argparse
+import datetime
+import itertools
+import json
+import subprocess
+import sys
+
+import tensorflow as tf
+
+from benchmarks.cases import CASES
+from benchmarks.measure import benchmark
+
+GRIDS = dict(
+    small=dict(num_batch=[32], num_scopes=[16], num_nodes=[8]),
+    default=dict(num_batch=[32, 256], num_scopes=[16, 64], num_nodes=[8, 32]),
+    large=dict(num_batch=[256, 1024], num_scopes=[64, 256], num_nodes=[16, 64]),
+)
+
+
+def run(grid, case_names=None, backprop_modes=None, num_repeats=10):
+    """
+    Runs the benchmarks for every configuration of a grid.
+
+    Args:
+        grid: Dict with lists of ``num_batch``, ``num_scopes`` (which must be squares, so that scopes
+            can be laid out as pixels for spatial layers) and ``num_nodes``
+        case_names: If not ``None``, only the benchmarks of which the name contains one of these
+            strings are run
+        backprop_modes: If not ``None``, only these backprop modes are run for benchmarks that
+            depend on a backprop mode
+        num_repeats: Number of times each pass is timed, of which the median is reported
+
+    Returns:
+        A list of dicts with the configuration and the measurements of every benchmark. Benchmarks
+        that fail, e.g. because they run out of memory, hold the error instead.
+    """
+    results = []
+    for case in CASES:
+        if case_names is not None and not any(name in case.name for name in case_names):
+            continue
+        modes = [
+            mode for mode in case.backprop_modes if mode is None or backprop_modes is None or mode in backprop_modes]
+        for backprop_mode, num_batch, num_scopes, num_nodes in itertools.product(
+                modes, grid["num_batch"], grid["num_scopes"], grid["num_nodes"]):
+            config = dict(name=case.name, backprop_mode=backprop_mode, num_batch=num_batch, num_scopes=num_scopes,
+                          num_nodes=num_nodes)
+            print("Running {}".format(config), file=sys.stderr)
+            try:
+                fn, x, variables = case.build(num_batch, num_scopes, num_nodes, backprop_mode)
+                config.update(benchmark(fn, x, variables, backprop_mode, num_batch, num_repeats))
+            except (tf.errors.ResourceExhaustedError, tf.errors.InvalidArgumentError, ValueError) as e:
+                config["error"] = "{}: {}".format(type(e).__name__, str(e).splitlines()[0])
+            results.append(config)
+    return results
+
+
+def metadata(grid_name):
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return dict(
+        commit=commit, tensorflow_version=tf.__version__, grid=grid_name,
+        devices=[device.name for device in tf.config.list_logical_devices()],
+        timestamp=datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--grid", choices=list(GRIDS), default="default", help="Grid of sizes to sweep")
+    parser.add_argument("--cases", nargs="+", help="Only run benchmarks of which the name contains one of these")
+    parser.add_argument("--backprop-modes", nargs="+", help="Only run these backprop modes, e.g. gradient hard_em")
+    parser.add_argument("--repeats", type=int, default=10, help="Number of timed repeats of each pass")
+    parser.add_argument("--output", help="Path of the JSON file to write. Prints to stdout if not given.")
+    args = parser.parse_args(argv)
+
+    results = run(GRIDS[args.grid], case_names=args.cases, backprop_modes=args.backprop_modes,
+                  num_repeats=args.repeats)
+    report = dict(metadata=metadata(args.grid), results=results)
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+"""
+End-to-end training benchmarks on the synthetic datasets of ``benchmarks.datasets``. Trains dense
+SPNs built with ``region_graph_to_dense_spn``, spatial DGC-SPNs and ``DynamicSumProductNetwork`` s
+with ``keras.Model.fit`` and with ``GenerativeLearningEM`` one epoch at a time, evaluates the mean
+log-likelihood of held-out data after every epoch and reports the wall-clock training time it
+took to reach a target log-likelihood. Run from the root of the repository:
+
+    python -m benchmarks.training --size default --cases dense/binary --target -9.7 --output training.json
+
+Training stops after ``--epochs`` epochs or as soon as the target is reached. Evaluation is not
+included in the reported times, but the tracing of the training step in the first epoch is.
+"""
+import argparse
+import json
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+from benchmarks import datasets
+from benchmarks.run import metadata
+from libspn_keras.backprop_mode import BackpropMode
+from libspn_keras.layers import CategoricalLeaf, Conv2DProduct, Local2DSum, NormalLeaf, RootSum, \
+    SpatialToRegions, DenseSum
+from libspn_keras.losses import NegativeLogLikelihood
+from libspn_keras.models import DynamicSumProductNetwork, SequentialSumProductNetwork
+from libspn_keras.optimizers import OnlineExpectationMaximization
+from libspn_keras.region import RegionNode, RegionVariable, region_graph_to_dense_spn
+from libspn_keras.utils import GenerativeLearningEM, bucket_sequences_by_length
+
+SIZES = dict(
+    small=dict(num_samples=512, num_vars=8, num_values=4, image_size=4, min_len=2, max_len=6, num_nodes=4),
+    default=dict(num_samples=4096, num_vars=16, num_values=4, image_size=8, min_len=4, max_len=16, num_nodes=8),
+    large=dict(num_samples=32768, num_vars=64, num_values=8, image_size=16, min_len=8, max_len=64, num_nodes=16),
+)
+
+TRAINERS = ["fit", "em"]
+
+# Fraction of the generated samples that is held out for evaluation
+EVAL_FRACTION = 0.2
+
+TrainingCase = namedtuple("TrainingCase", ["name", "make_data", "build", "with_sequence_lens"])
+TrainingCase.__doc__ = """
+An end-to-end training benchmark of a model on a synthetic dataset.
+
+Args:
+    name: Name of the benchmark
+    make_data: Function that takes the number of samples, a size dict of ``SIZES`` and a seed and
+        returns the samples, which are an array or a list of sequences
+    build: Function that takes a size dict of ``SIZES``, the backprop mode and a seed and returns an
+        unsupervised SPN
+    with_sequence_lens: Whether the model is a ``DynamicSumProductNetwork`` that is trained on
+        sequences
+"""
+
+
+def _accumulator_initializer(backprop_mode, seed):
+    # Random accumulators break the symmetry between the sums of a layer, which would otherwise
+    # stay identical when trained with hard EM
+    if backprop_mode == BackpropMode.GRADIENT:
+        return keras.initializers.TruncatedNormal(mean=1.0, stddev=0.5, seed=seed)
+    return keras.initializers.RandomUniform(minval=0.5, maxval=1.5, seed=seed)
+
+
+def _sum_kwargs(backprop_mode, seed):
+    return dict(
+        logspace_accumulators=backprop_mode == BackpropMode.GRADIENT, backprop_mode=backprop_mode,
+        accumulator_initializer=_accumulator_initializer(backprop_mode, seed))
+
+
+def random_region_graph(num_vars, seed=0):
+    """
+    Builds a region graph that recursively splits a random permutation of the variables in halves,
+    as in a random tensorized SPN with a single decomposition.
+
+    Args:
+        num_vars: Number of variables
+        seed: Seed of the permutation
+
+    Returns:
+        The root ``RegionNode``.
+    """
+    variables = [RegionVariable(i) for i in np.random.RandomState(seed).permutation(num_vars)]
+
+    def split(region):
+        if len(region) == 1:
+            return region[0]
+        return RegionNode([split(region[:len(region) // 2]), split(region[len(region) // 2:])])
+
+    return split(variables)
+
+
+def _leaf(data_kind, size, backprop_mode, seed):
+    if data_kind == "continuous":
+        return NormalLeaf(
+            num_components=size["num_nodes"], use_accumulators=backprop_mode != BackpropMode.GRADIENT,
+            location_initializer=keras.initializers.TruncatedNormal(stddev=1.0, seed=seed))
+    num_values = 2 if data_kind == "binary" else size["num_values"]
+    return CategoricalLeaf(
+        num_components=size["num_nodes"], num_values=num_values, backprop_mode=backprop_mode,
+        accumulator_initializer=_accumulator_initializer(backprop_mode, seed))
+
+
+def _dense_stack(data_kind, num_vars, size, backprop_mode, seed, with_root=True):
+    num_sums = iter(lambda: size["num_nodes"], None)
+    return region_graph_to_dense_spn(
+        random_region_graph(num_vars, seed=seed), _leaf(data_kind, size, backprop_mode, seed),
+        num_sums_iterable=num_sums, with_root=with_root, return_weighted_child_logits=False,
+        **_sum_kwargs(backprop_mode, seed))
+
+
+def _dense(data_kind):
+    def build(size, backprop_mode, seed):
+        return SequentialSumProductNetwork(
+            _dense_stack(data_kind, size["num_vars"], size, backprop_mode, seed).layers, unsupervised=True)
+    return build
+
+
+def _spatial(size, backprop_mode, seed):
+    # Non-overlapping products halve the image until a single cell covers all pixels
+    image_size, num_nodes = size["image_size"], size["num_nodes"]
+    layers = [NormalLeaf(
+        input_shape=(image_size, image_size, 1), num_components=num_nodes,
+        use_accumulators=backprop_mode != BackpropMode.GRADIENT,
+        location_initializer=keras.initializers.RandomUniform(minval=0.0, maxval=1.0, seed=seed),
+        scale_initializer=keras.initializers.Constant(0.25))]
+    while image_size > 1:
+        layers.append(Conv2DProduct(depthwise=True, strides=[2, 2], dilations=[1, 1], kernel_size=[2, 2]))
+        image_size //= 2
+        if image_size > 1:
+            layers.append(Local2DSum(num_sums=num_nodes, **_sum_kwargs(backprop_mode, seed)))
+    layers += [
+        SpatialToRegions(),
+        RootSum(return_weighted_child_logits=False, **_sum_kwargs(backprop_mode, seed))
+    ]
+    return SequentialSumProductNetwork(layers, unsupervised=True)
+
+
+def _dynamic(size, backprop_mode, seed):
+    template = _dense_stack("categorical", size["num_vars"], size, backprop_mode, seed, with_root=False)
+    num_template_nodes = template.output_shape[-1]
+    num_interface_nodes = size["num_nodes"]
+    sum_kwargs = _sum_kwargs(backprop_mode, seed)
+    return DynamicSumProductNetwork(
+        template_network=template,
+        interface_network_t0=keras.Sequential(
+            [DenseSum(num_sums=num_interface_nodes, input_shape=[1, 1, num_template_nodes], **sum_kwargs)]),
+        interface_network_t_minus_1=keras.Sequential(
+            [DenseSum(num_sums=num_interface_nodes, input_shape=[1, 1, num_interface_nodes ** 2], **sum_kwargs)]),
+        top_network=keras.Sequential([RootSum(
+            input_shape=[1, 1, num_interface_nodes ** 2], return_weighted_child_logits=False, **sum_kwargs)])
+    )
+
+
+CASES = [
+    TrainingCase("dense/binary", lambda n, size, seed: datasets.binary(
+        n, size["num_vars"], seed=seed), _dense("binary"), False),
+    TrainingCase("dense/categorical", lambda n, size, seed: datasets.categorical(
+        n, size["num_vars"], num_values=size["num_values"], seed=seed), _dense("categorical"), False),
+    TrainingCase("dense/continuous", lambda n, size, seed: datasets.continuous(
+        n, size["num_vars"], seed=seed), _dense("continuous"), False),
+    TrainingCase("spatial/images", lambda n, size, seed: datasets.images(
+        n, size["image_size"], size["image_size"], seed=seed), _spatial, False),
+    TrainingCase("dynamic/sequences", lambda n, size, seed: datasets.sequences(
+        n, size["num_vars"], size["min_len"], size["max_len"], num_values=size["num_values"], seed=seed),
+        _dynamic, True),
+]
+
+
+def _batches(case, data, batch_size, shuffle, seed):
+    if case.with_sequence_lens:
+        return bucket_sequences_by_length(data, batch_size, shuffle=shuffle, seed=seed)
+    dataset = tf.data.Dataset.from_tensor_slices((data,))
+    if shuffle:
+        dataset = dataset.shuffle(len(data), seed=seed, reshuffle_each_iteration=True)
+    return dataset.batch(batch_size)
+
+
+def _mean_log_likelihood(model, case, eval_batches):
+    log_likelihood, num_samples = 0.0, 0
+    for batch in eval_batches:
+        out = model(list(batch) if case.with_sequence_lens else batch[0])
+        log_likelihood += float(tf.reduce_sum(out))
+        num_samples += int(tf.shape(batch[0])[0])
+    return log_likelihood / num_samples
+
+
+def train(case, size, trainer, backprop_mode, batch_size=64, epochs=10, target=None, learning_rate=1e-2, seed=0):
+    """
+    Trains a model on a synthetic dataset and records the mean log-likelihood of held-out data
+    after every epoch.
+
+    Args:
+        case: ``TrainingCase`` to train
+        size: Dict of sizes of the data and the model, as in ``SIZES``
+        trainer: ``'fit'`` to train with ``keras.Model.fit``, which uses Adam for
+            ``BackpropMode.GRADIENT`` and ``OnlineExpectationMaximization`` otherwise, or ``'em'``
+            to train with ``GenerativeLearningEM``, which requires an EM-based backprop mode
+        backprop_mode: ``BackpropMode`` of the sums and leaves
+        batch_size: Number of samples per batch
+        epochs: Maximum number of epochs
+        target: If not ``None``, training stops as soon as the mean held-out log-likelihood reaches
+            this value
+        learning_rate: Learning rate of Adam
+        seed: Seed of the data, the structure and the initial parameters of the model
+
+    Returns:
+        A dict with the configuration, the ``history`` of dicts of the ``epoch``, the cumulative
+        training ``seconds`` and the held-out ``log_likelihood`` starting before training, and the
+        ``time_to_target`` in seconds, which is ``None`` if the target was not reached.
+    """
+    if trainer == "em" and backprop_mode == BackpropMode.GRADIENT:
+        raise ValueError("GenerativeLearningEM requires an EM-based backprop mode")
+
+    num_samples = size["num_samples"]
+    num_eval = int(num_samples * EVAL_FRACTION)
+    data = case.make_data(num_samples + num_eval, size, seed)
+    train_batches = _batches(case, data[:num_samples], batch_size, shuffle=True, seed=seed)
+    eval_batches = _batches(case, data[num_samples:], batch_size, shuffle=False, seed=seed)
+
+    tf.random.set_seed(seed)
+    model = case.build(size, backprop_mode, seed)
+    if trainer == "em":
+        em = GenerativeLearningEM(model, with_sequence_lens=case.with_sequence_lens)
+
+        def train_epoch():
+            em.fit(train_batches, epochs=1)
+    else:
+        optimizer = keras.optimizers.Adam(learning_rate) if backprop_mode == BackpropMode.GRADIENT \
+            else OnlineExpectationMaximization()
+        model.compile(optimizer=optimizer, loss=NegativeLogLikelihood())
+
+        def train_epoch():
+            model.fit(train_batches, epochs=1, verbose=0)
+
+    seconds = 0.0
+    history = [dict(epoch=0, seconds=seconds, log_likelihood=_mean_log_likelihood(model, case, eval_batches))]
+    time_to_target = None
+    for epoch in range(1, epochs + 1):
+        start = time.perf_counter()
+        train_epoch()
+        seconds += time.perf_counter() - start
+        log_likelihood = _mean_log_likelihood(model, case, eval_batches)
+        history.append(dict(epoch=epoch, seconds=seconds, log_likelihood=log_likelihood))
+        if target is not None and log_likelihood >= target:
+            time_to_target = seconds
+            break
+
+    return dict(
+        name=case.name, trainer=trainer, backprop_mode=backprop_mode, batch_size=batch_size, target=target,
+        history=history, final_log_likelihood=history[-1]["log_likelihood"], seconds=seconds,
+        samples_per_second=num_samples * (len(history) - 1) / seconds, time_to_target=time_to_target, **size
+    )
+
+
+def run(size, case_names=None, trainers=None, backprop_modes=None, **kwargs):
+    """
+    Runs the training benchmarks for every combination of case, trainer and backprop mode.
+
+    Args:
+        size: Dict of sizes of the data and the models, as in ``SIZES``
+        case_names: If not ``None``, only the benchmarks of which the name contains one of these
+            strings are run
+        trainers: Trainers to run, by default all of ``TRAINERS``
+        backprop_modes: Backprop modes to run, by default ``BackpropMode.GRADIENT`` and
+            ``BackpropMode.EM``. Combinations of the ``'em'`` trainer and
+            ``BackpropMode.GRADIENT`` are skipped.
+        **kwargs: Keyword arguments of ``train``
+
+    Returns:
+        A list of the results of ``train``. Benchmarks that fail hold the error instead of the
+        measurements.
+    """
+    trainers = trainers or TRAINERS
+    backprop_modes = backprop_modes or [BackpropMode.GRADIENT, BackpropMode.EM]
+    results = []
+    for case in CASES:
+        if case_names is not None and not any(name in case.name for name in case_names):
+            continue
+        for trainer in trainers:
+            for backprop_mode in backprop_modes:
+                if trainer == "em" and backprop_mode == BackpropMode.GRADIENT:
+                    continue
+                print("Training {} with {} and {}".format(case.name, trainer, backprop_mode), file=sys.stderr)
+                try:
+                    results.append(train(case, size, trainer, backprop_mode, **kwargs))
+                except (tf.errors.ResourceExhaustedError, tf.errors.InvalidArgumentError, ValueError) as e:
+                    results.append(dict(
+                        name=case.name, trainer=trainer, backprop_mode=backprop_mode,
+                        error="{}: {}".format(type(e).__name__, str(e).splitlines()[0])))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", choices=list(SIZES), default="default", help="Size of the data and the models")
+    parser.add_argument("--num-samples", type=int, help="Number of training samples, overrides the size")
+    parser.add_argument("--cases", nargs="+", help="Only run benchmarks of which the name contains one of these")
+    parser.add_argument("--trainers", nargs="+", choices=TRAINERS, help="Trainers to run")
+    parser.add_argument("--backprop-modes", nargs="+", help="Backprop modes to run, e.g. gradient em hard_em")
+    parser.add_argument("--batch-size", type=int, default=64, help="Number of samples per batch")
+    parser.add_argument("--epochs", type=int, default=10, help="Maximum number of epochs")
+    parser.add_argument("--target", type=float, help="Mean held-out log-likelihood at which training stops")
+    parser.add_argument("--learning-rate", type=float, default=1e-2, help="Learning rate of Adam")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the data and the models")
+    parser.add_argument("--output", help="Path of the JSON file to write. Prints to stdout if not given.")
+    args = parser.parse_args(argv)
+
+    size = dict(SIZES[args.size])
+    if args.num_samples is not None:
+        size["num_samples"] = args.num_samples
+    results = run(
+        size, case_names=args.cases, trainers=args.trainers, backprop_modes=args.backprop_modes,
+        batch_size=args.batch_size, epochs=args.epochs, target=args.target, learning_rate=args.learning_rate,
+        seed=args.seed)
+    report = dict(metadata=dict(metadata(args.size), size=size), results=results)
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,12 @@ from libspn_keras.region import RegionNode
 from libspn_keras.region import RegionVariable
 from libspn_keras.region import region_graph_to_dense_spn
 from libspn_keras.visualize import visualize_dense_spn
+from libspn_keras.mpe import most_probable_explanation
+from libspn_keras.mpe import temporal_most_probable_explanation
+from libspn_keras.sampling import sample
+from libspn_keras.incremental import IncrementalEvaluator
+from libspn_keras.streaming import StreamingFilter
+from libspn_keras.profiling import LayerProfiler, profile_layers
 from libspn_keras import utils
 from libspn_keras import models
 
@@ -26,6 +32,13 @@ __all__ = [
     'RegionVariable',
     'region_graph_to_dense_spn',
     'visualize_dense_spn',
+    'most_probable_explanation',
+    'temporal_most_probable_explanation',
+    'sample',
+    'IncrementalEvaluator',
+    'StreamingFilter',
+    'LayerProfiler',
+    'profile_layers',
     'utils',
     'initializers',
     'GenerativeLearningEM',
@@ -0,0 +1,234 @@
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+from libspn_keras import topdown
+from libspn_keras.layers import DenseProduct, DenseSum, ReduceProduct, PermuteAndPadScopes, \
+    Undecompose, LogDropout, FlatToRegions
+from libspn_keras.math.logmatmul import logmatmul
+
+
+class IncrementalEvaluator:
+    """
+    Evaluates an SPN and caches the activations of its layers, so that the SPN can be
+    re-evaluated after a few variables have changed by recomputing only the scopes that contain
+    those variables. This is useful for interactive completion and for coordinate-wise searches
+    over inputs. A re-evaluation costs O(depth x changed scopes) rather than O(model).
+
+    Activations are cached per layer in variables of shape ``[num_scopes, num_decomps, batch,
+    num_nodes]`` with a variable batch size, so that the affected (scope, decomposition) entries can be gathered, recomputed
+    and scattered back in place. Layers that cannot be evaluated per entry, such as ``RootSum``,
+    are recomputed from their cached input.
+
+    Supports sequential SPNs that consist of a ``FlatToRegions`` layer, a leaf layer and
+    ``PermuteAndPadScopes``, ``DenseProduct``, ``ReduceProduct``, ``DenseSum``, ``Undecompose``,
+    ``LogDropout`` and ``RootSum`` layers, such as the ones built by ``region_graph_to_dense_spn``.
+    Other layers above the leaf are recomputed in full.
+
+    Args:
+        model: A ``keras.Sequential`` SPN
+
+    Raises:
+        NotImplementedError: If the leaf is preceded by layers other than ``FlatToRegions``, such
+            as ``NormalizeStandardScore``, which mix variables.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._pre_leaf_layers, self._leaf, self._post_leaf_layers = topdown.split_at_leaf(model)
+        self._pre_leaf_layers = [
+            layer for layer in self._pre_leaf_layers if not isinstance(layer, keras.layers.InputLayer)]
+        if not all(isinstance(layer, FlatToRegions) for layer in self._pre_leaf_layers):
+            raise NotImplementedError(
+                "Incremental evaluation requires the leaf to be preceded by FlatToRegions only")
+        self._caches = None
+        self._entry_shapes = None
+        self._output = None
+
+    def __call__(self, x):
+        """
+        Evaluates the SPN in full and caches the activations.
+
+        Args:
+            x: Input of the model
+
+        Returns:
+            The output of the model
+        """
+        out = self._leaf_input(x)
+        outputs = []
+        for layer in [self._leaf] + self._post_leaf_layers:
+            out = layer(out)
+            outputs.append(out)
+
+        self._entry_shapes = [out.shape[1:3] if len(out.shape) == 4 else [1, 1] for out in outputs]
+        if self._caches is None:
+            self._caches = [
+                tf.Variable(
+                    _scopes_first(out), shape=[out.shape[1], out.shape[2], None, out.shape[3]],
+                    trainable=False)
+                if len(out.shape) == 4 else None for out in outputs
+            ]
+        else:
+            for cache, out in zip(self._caches, outputs):
+                if cache is not None:
+                    cache.assign(_scopes_first(out))
+        self._output = outputs[-1]
+        return self._output
+
+    def update(self, x, changed_vars):
+        """
+        Re-evaluates the SPN after some variables have changed with respect to the previous call.
+
+        Args:
+            x: New input of the model, which is only read for the changed variables
+            changed_vars: Indices of the variables that changed, as a list or NumPy array, so that
+                the affected entries are known when building the computation
+
+        Returns:
+            The output of the model
+        """
+        if self._caches is None:
+            raise ValueError("The SPN must be evaluated in full before it can be updated")
+        changed_vars = np.unique(np.asarray(changed_vars, dtype=np.int32))
+
+        # Boolean mask of shape [num_scopes, num_decomps] of entries that need to be recomputed
+        affected = np.zeros(self._entry_shapes[0], dtype=bool)
+        affected[changed_vars] = True
+        indices = np.argwhere(affected).astype(np.int32)
+        self._caches[0].scatter_nd_update(
+            indices, self._evaluate_leaf_entries(self._leaf_input(x), indices))
+
+        for i, layer in enumerate(self._post_leaf_layers, start=1):
+            if self._caches[i] is None or not _has_entry_rule(layer):
+                out = layer(_batch_first(self._caches[i - 1]))
+                if self._caches[i] is None:
+                    self._output = out
+                else:
+                    self._caches[i].assign(_scopes_first(out))
+                affected = np.ones(self._entry_shapes[i], dtype=bool)
+                continue
+            affected = _affected_outputs(layer, affected)
+            indices = np.argwhere(affected).astype(np.int32)
+            if len(indices) > 0:
+                self._caches[i].scatter_nd_update(
+                    indices, _evaluate_entries(layer, self._caches[i - 1], indices))
+            if i == len(self._post_leaf_layers):
+                self._output = _batch_first(self._caches[i])
+        return self._output
+
+    def _leaf_input(self, x):
+        out = tf.convert_to_tensor(x)
+        for layer in self._pre_leaf_layers:
+            out = layer(out)
+        return out
+
+    def _evaluate_leaf_entries(self, leaf_input, indices):
+        if not self._leaf._can_evaluate_observed() or getattr(self._leaf, "bit_packed", False):
+            return tf.gather_nd(_scopes_first(self._leaf(leaf_input)), indices)
+        # [num_entries, batch, multivariate_size] -> [num_entries, batch, num_components]
+        x = tf.gather_nd(_scopes_first(leaf_input), indices)
+        num_batch = tf.shape(x)[1]
+        scope_decomp_indices = tf.reshape(
+            tf.tile(tf.expand_dims(indices, axis=1), [1, num_batch, 1]), [-1, 2])
+        out = self._leaf._evaluate_observed(tf.reshape(x, [-1, x.shape[-1]]), scope_decomp_indices)
+        return tf.reshape(out, [len(indices), num_batch, self._leaf.num_components])
+
+
+def _scopes_first(x):
+    return tf.transpose(x, (1, 2, 0, 3))
+
+
+def _batch_first(x):
+    return tf.transpose(x, (2, 0, 1, 3))
+
+
+def _has_entry_rule(layer):
+    return isinstance(
+        layer, (DenseProduct, ReduceProduct, DenseSum, PermuteAndPadScopes, Undecompose, LogDropout))
+
+
+def _permutations(layer):
+    # Permutations are fixed once built and are read outside of any graph, since the affected
+    # entries are determined when building the computation
+    with tf.init_scope():
+        return np.asarray(tf.convert_to_tensor(layer.permutations))
+
+
+def _affected_outputs(layer, affected):
+    """
+    Finds the output entries of a layer that depend on the affected input entries.
+
+    Args:
+        layer: A layer for which ``_has_entry_rule`` holds
+        affected: Boolean NumPy array of shape ``[num_scopes_in, num_decomps_in]``
+
+    Returns:
+        Boolean NumPy array of shape ``[num_scopes_out, num_decomps_out]``
+    """
+    num_scopes_in, num_decomps_in = affected.shape
+    if isinstance(layer, (DenseProduct, ReduceProduct)):
+        # Input scope s_out * num_factors + f is factor f of output scope s_out
+        return affected.reshape(-1, layer.num_factors, num_decomps_in).any(axis=1)
+    if isinstance(layer, PermuteAndPadScopes):
+        permutations = _permutations(layer)
+        padded_affected = np.concatenate([np.zeros([1, num_decomps_in], dtype=bool), affected])
+        return padded_affected[permutations + 1, np.arange(num_decomps_in)[:, np.newaxis]].T
+    if isinstance(layer, Undecompose):
+        return affected.reshape(num_scopes_in, layer.num_decomps, -1).any(axis=2)
+    return affected
+
+
+def _evaluate_entries(layer, x, indices):
+    """
+    Evaluates a layer for a subset of its output entries.
+
+    Args:
+        layer: A layer for which ``_has_entry_rule`` holds
+        x: Input of ``layer`` of shape ``[num_scopes_in, num_decomps_in, batch, num_nodes_in]``
+        indices: NumPy array of shape ``[num_entries, 2]`` holding the scope and decomposition
+            of each output entry to evaluate
+
+    Returns:
+        A ``Tensor`` of shape ``[num_entries, batch, num_nodes_out]``
+    """
+    scopes, decomps = indices[:, 0], indices[:, 1]
+    if isinstance(layer, (DenseProduct, ReduceProduct)):
+        num_factors = layer.num_factors
+        # [num_entries, num_factors, batch, num_nodes_in]
+        factor_indices = np.stack([
+            scopes[:, np.newaxis] * num_factors + np.arange(num_factors),
+            np.tile(decomps[:, np.newaxis], [1, num_factors])
+        ], axis=-1)
+        factors = tf.gather_nd(x, factor_indices)
+        if isinstance(layer, ReduceProduct):
+            return tf.reduce_sum(factors, axis=1)
+        num_nodes_in = factors.shape[-1]
+        # Factor 0 varies slowest along the products, as in DenseProduct
+        outer_sum = 0.0
+        for f in range(num_factors):
+            outer_sum += tf.reshape(factors[:, f], [len(indices), -1] + [
+                num_nodes_in if j == f else 1 for j in range(num_factors)])
+        return tf.reshape(outer_sum, [len(indices), -1, num_nodes_in ** num_factors])
+    if isinstance(layer, DenseSum):
+        # Only the weights of the evaluated entries are normalized, in the same way as
+        # ``topdown.normalized_log_weights``. [num_entries, num_nodes_in, num_sums]
+        accumulators = tf.gather_nd(layer._accumulators, indices)
+        if not layer.logspace_accumulators:
+            accumulators = tf.math.log(accumulators)
+        return logmatmul(tf.gather_nd(x, indices), tf.nn.log_softmax(accumulators, axis=1))
+    if isinstance(layer, PermuteAndPadScopes):
+        scopes_in = _permutations(layer)[decomps, scopes]
+        # Padded scopes are constant, but are never affected either
+        return tf.gather_nd(x, np.stack([scopes_in, decomps], axis=1))
+    if isinstance(layer, Undecompose):
+        num_joined = x.shape[1] // layer.num_decomps
+        joined_indices = np.stack([
+            np.tile(scopes[:, np.newaxis], [1, num_joined]),
+            decomps[:, np.newaxis] * num_joined + np.arange(num_joined)
+        ], axis=-1)
+        joined = tf.gather_nd(x, joined_indices)
+        # [num_entries, num_joined, batch, num_nodes_in] -> [num_entries, batch, num_joined * num_nodes_in]
+        joined = tf.transpose(joined, (0, 2, 1, 3))
+        return tf.reshape(joined, [len(indices), tf.shape(joined)[1], -1])
+    return tf.gather_nd(x, indices)
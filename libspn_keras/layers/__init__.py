@@ -2,6 +2,8 @@ from libspn_keras.layers.conv2d_product import Conv2DProduct
 from libspn_keras.layers.dense_product import DenseProduct
 from libspn_keras.layers.dense_sum import DenseSum
 from libspn_keras.layers.indicator_leaf import IndicatorLeaf
+from libspn_keras.layers.categorical_leaf import CategoricalLeaf
+from libspn_keras.layers.bernoulli_leaf import BernoulliLeaf
 from libspn_keras.layers.location_scale_leaf import (
     NormalLeaf, LaplaceLeaf, CauchyLeaf, LocationScaleLeafBase
 )
@@ -15,6 +17,7 @@ from libspn_keras.layers.base_leaf import BaseLeaf
 from libspn_keras.layers.permute_and_pad_scopes import PermuteAndPadScopes
 from libspn_keras.layers.reduce_product import ReduceProduct
 from libspn_keras.layers.temporal_dense_product import TemporalDenseProduct
+from libspn_keras.layers.temporal_dense_product_sum import TemporalDenseProductSum
 from libspn_keras.layers.flat_to_regions import FlatToRegions
 from libspn_keras.layers.permute_and_pad_scopes_random import PermuteAndPadScopesRandom
 from libspn_keras.layers.conv2d_sum import Conv2DSum
@@ -24,6 +27,8 @@ __all__ = [
     'DenseProduct',
     'DenseSum',
     'IndicatorLeaf',
+    'CategoricalLeaf',
+    'BernoulliLeaf',
     'NormalLeaf',
     'LaplaceLeaf',
     'CauchyLeaf',
@@ -40,5 +45,6 @@ __all__ = [
     'ReduceProduct',
     'PermuteAndPadScopesRandom',
     'TemporalDenseProduct',
+    'TemporalDenseProductSum',
     'Conv2DSum'
 ]
\ No newline at end of file
@@ -5,18 +5,22 @@ import tensorflow as tf
 class BaseLeaf(keras.layers.Layer):
 
     def __init__(
-        self, num_components, dtype=tf.float32, use_cdf=False, multivariate=False, **kwargs
+        self, num_components, dtype=tf.float32, use_cdf=False, multivariate=False,
+        num_quantized_levels=None, sparse_evaluation_threshold=0.25, **kwargs
     ):
         super(BaseLeaf, self).__init__(dtype=dtype, **kwargs)
         self.num_components = num_components
         self.use_cdf = use_cdf
         self.multivariate = multivariate
-        self._num_scopes = self._num_decomps = None
+        self.num_quantized_levels = num_quantized_levels
+        self.sparse_evaluation_threshold = sparse_evaluation_threshold
+        self._num_scopes = self._num_decomps = self._distribution_shape = None
 
     def build(self, input_shape):
         _, *scope_dims, multivariate_size = input_shape
         distribution_shape = [1] + scope_dims + [self.num_components, multivariate_size]
         self._num_scopes, self._num_decomps = scope_dims
+        self._distribution_shape = distribution_shape
         self._build_distribution(distribution_shape)
         super(BaseLeaf, self).build(input_shape)
 
@@ -26,12 +30,169 @@ class BaseLeaf(keras.layers.Layer):
     def _get_distribution(self):
         raise NotImplementedError("Implement distribution in descendant class")
 
-    def call(self, x):
+    def call(self, x, marginalize_mask=None):
+        """
+        Computes the log probabilities of the components of each variable.
+
+        Args:
+            x: Input ``Tensor`` of shape ``[batch, num_scopes, num_decomps, multivariate_size]``
+            marginalize_mask: Optional boolean ``Tensor`` of shape ``[batch, num_scopes]``,
+                ``[batch, num_scopes, num_decomps]`` or ``[batch, num_scopes, num_decomps, 1]``.
+                Entries that are ``True`` are marginalized out, i.e. their components have a log
+                probability of 0. If the fraction of entries that are observed is below
+                ``sparse_evaluation_threshold``, only the observed entries are evaluated and
+                scattered into the output.
+
+        Returns:
+            A ``Tensor`` of shape ``[batch, num_scopes, num_decomps, num_components]``
+        """
+        if marginalize_mask is None:
+            return self._evaluate(x)
+
+        marginalize_mask = self._broadcast_marginalize_mask(marginalize_mask, x)
+
+        def dense_fn():
+            log_prob = self._evaluate(x)
+            return tf.where(tf.expand_dims(marginalize_mask, axis=-1), tf.zeros_like(log_prob), log_prob)
+
+        if not self._can_evaluate_observed():
+            return dense_fn()
+
+        observed = tf.logical_not(marginalize_mask)
+        fraction_observed = tf.reduce_mean(tf.cast(observed, tf.float32))
+        return tf.cond(
+            fraction_observed < self.sparse_evaluation_threshold,
+            lambda: self._call_sparse(x, observed),
+            dense_fn
+        )
+
+    def _broadcast_marginalize_mask(self, marginalize_mask, x):
+        marginalize_mask = tf.convert_to_tensor(marginalize_mask, dtype=tf.bool)
+        if len(marginalize_mask.shape) == 4:
+            marginalize_mask = tf.squeeze(marginalize_mask, axis=-1)
+        elif len(marginalize_mask.shape) == 2:
+            marginalize_mask = tf.expand_dims(marginalize_mask, axis=-1)
+        return tf.broadcast_to(marginalize_mask, tf.shape(x)[:3])
+
+    def _call_sparse(self, x, observed):
+        # [num_observed, 3] indices of observed (sample, scope, decomp) triplets
+        indices = tf.cast(tf.where(observed), tf.int32)
+        log_prob = self._evaluate_observed(tf.gather_nd(x, indices), indices[:, 1:])
+        out_shape = [tf.shape(x)[0], self._num_scopes, self._num_decomps, self.num_components]
+        return tf.scatter_nd(indices, log_prob, out_shape)
+
+    def _can_evaluate_observed(self):
+        return self.num_quantized_levels is not None
+
+    def _evaluate_observed(self, x, scope_decomp_indices):
+        """
+        Computes the log probabilities of the components for a flat list of observed entries.
+
+        Args:
+            x: ``Tensor`` of shape ``[num_observed, multivariate_size]`` holding the observed
+                values
+            scope_decomp_indices: int32 ``Tensor`` of shape ``[num_observed, 2]`` holding the
+                scope and decomposition index of each observed entry
+
+        Returns:
+            A ``Tensor`` of shape ``[num_observed, num_components]``
+        """
+        log_prob_table = tf.reshape(self._log_prob_table(), [-1, self.num_components])
+        indices = self._level_indices(x, self.num_quantized_levels) + \
+            self._observed_block_offsets(scope_decomp_indices, self.num_quantized_levels)
+        return tf.reduce_sum(tf.gather(log_prob_table, indices), axis=1)
+
+    def _evaluate(self, x):
+        if self.num_quantized_levels is not None:
+            return self._call_quantized(x)
         x = tf.expand_dims(x, axis=-2)
         distribution = self._get_distribution()
         log_prob = distribution.log_cdf(x) if self.use_cdf else distribution.log_prob(x)
         return tf.reduce_sum(log_prob, axis=-1)
 
+    def _call_quantized(self, x):
+        # [scopes * decomps * multivariate_size * num_levels, num_components]
+        log_prob_table = tf.reshape(self._log_prob_table(), [-1, self.num_components])
+        indices = self._level_indices(x, self.num_quantized_levels) + self._block_offsets(self.num_quantized_levels)
+        # [batch, scopes, decomps, multivariate_size, num_components]
+        log_prob = tf.gather(log_prob_table, indices)
+        return tf.reduce_sum(log_prob, axis=3)
+
+    def _level_indices(self, x, num_levels):
+        """
+        Converts integer inputs to int32 indices of rows within the block of a variable. Inputs
+        outside of ``[0, num_levels)`` would silently index the block of another variable, so they
+        are rejected.
+
+        Args:
+            x: Integer valued input ``Tensor``
+            num_levels: Number of levels (or values) each variable can take
+
+        Returns:
+            An int32 ``Tensor`` of the same shape as ``x``
+
+        Raises:
+            tf.errors.InvalidArgumentError: If any of the inputs is outside of ``[0, num_levels)``.
+        """
+        indices = tf.cast(x, tf.int32)
+        with tf.control_dependencies([
+            tf.debugging.assert_non_negative(indices, message="Inputs of {} must be non-negative".format(self.name)),
+            tf.debugging.assert_less(
+                indices, num_levels, message="Inputs of {} must be less than {}".format(self.name, num_levels))
+        ]):
+            return tf.identity(indices)
+
+    def _block_offsets(self, block_size):
+        """
+        Offsets for integer inputs so that each variable indexes its own block of ``block_size``
+        rows in a table that is flattened from ``[num_scopes, num_decomps, multivariate_size,
+        block_size, num_components]`` to ``[-1, num_components]``.
+
+        Args:
+            block_size: Number of rows per variable
+
+        Returns:
+            An int32 ``Tensor`` of shape ``[num_scopes, num_decomps, multivariate_size]``
+        """
+        _, num_scopes, num_decomps, _, multivariate_size = self._distribution_shape
+        block_shape = [num_scopes, num_decomps, multivariate_size]
+        return tf.reshape(tf.range(num_scopes * num_decomps * multivariate_size) * block_size, block_shape)
+
+    def _observed_block_offsets(self, scope_decomp_indices, block_size):
+        """
+        Same as ``_block_offsets``, but for a flat list of observed entries.
+
+        Args:
+            scope_decomp_indices: int32 ``Tensor`` of shape ``[num_observed, 2]`` holding the
+                scope and decomposition index of each observed entry
+            block_size: Number of rows per variable
+
+        Returns:
+            An int32 ``Tensor`` of shape ``[num_observed, multivariate_size]``
+        """
+        _, _, num_decomps, _, multivariate_size = self._distribution_shape
+        scope_decomp = scope_decomp_indices[:, :1] * num_decomps + scope_decomp_indices[:, 1:]
+        return (scope_decomp * multivariate_size + tf.range(multivariate_size)) * block_size
+
+    def _log_prob_table(self):
+        """
+        Evaluates the leaf distribution at each of the quantized input levels. Since the
+        table is computed from the current parameters, gradients (and EM statistics) of the
+        table entries propagate to the leaf parameters as they would for the original inputs.
+
+        Returns:
+            A ``Tensor`` of shape ``[num_scopes, num_decomps, multivariate_size, num_levels,
+            num_components]`` holding the log probability of each level for each component.
+        """
+        levels = tf.reshape(
+            tf.range(self.num_quantized_levels, dtype=self.dtype), [-1, 1, 1, 1, 1])
+        distribution = self._get_distribution()
+        log_prob = distribution.log_cdf(levels) if self.use_cdf \
+            else distribution.log_prob(levels)
+        log_prob = tf.broadcast_to(
+            log_prob, [self.num_quantized_levels] + self._distribution_shape[1:])
+        return tf.transpose(log_prob, (1, 2, 4, 0, 3))
+
     def compute_output_shape(self, input_shape):
         *outer_dims, _ = input_shape
         out_shape = outer_dims + [self.num_components]
@@ -40,10 +201,61 @@ class BaseLeaf(keras.layers.Layer):
     def get_config(self):
         config = dict(
             num_components=self.num_components,
-            use_cdf=self.use_cdf
+            use_cdf=self.use_cdf,
+            num_quantized_levels=self.num_quantized_levels,
+            sparse_evaluation_threshold=self.sparse_evaluation_threshold
         )
         base_config = super(BaseLeaf, self).get_config()
         return dict(list(base_config.items()) + list(config.items()))
 
+    def _is_tabulated(self):
+        """ Whether the leaf is evaluated through a lookup in ``_log_prob_table`` """
+        return self.num_quantized_levels is not None
+
     def get_modes(self):
-        raise NotImplementedError("A {} does not implement distribution modes.".format(self.__class__.__name__))
+        """
+        Computes the mode of each component.
+
+        Returns:
+            A ``Tensor`` of shape ``[1, num_scopes, num_decomps, num_components, multivariate_size]``
+        """
+        if not self._is_tabulated():
+            raise NotImplementedError(
+                "A {} does not implement distribution modes.".format(self.__class__.__name__))
+        # [scopes, decomps, multivariate_size, num_components]
+        modes = tf.cast(tf.argmax(self._log_prob_table(), axis=3), self.dtype)
+        return tf.expand_dims(tf.transpose(modes, (0, 1, 3, 2)), axis=0)
+
+    def sample_components(self, indices):
+        """
+        Draws a sample from each of the given components.
+
+        Args:
+            indices: int32 ``Tensor`` of shape ``[..., 3]`` holding the scope, decomposition and
+                component index of each component to sample from
+
+        Returns:
+            A ``Tensor`` of shape ``indices.shape[:-1] + [multivariate_size]``
+        """
+        if not self._is_tabulated():
+            return self._get_distribution().gather(indices).sample()
+        # [scopes, decomps, num_components, multivariate_size, num_levels]
+        log_prob_table = tf.transpose(self._log_prob_table(), (0, 1, 4, 2, 3))
+        logits = tf.gather_nd(log_prob_table, indices)
+        num_levels = log_prob_table.shape[-1]
+        samples = tf.random.categorical(tf.reshape(logits, [-1, num_levels]), 1, dtype=tf.int32)
+        return tf.cast(tf.reshape(samples, tf.shape(logits)[:-1]), self.dtype)
+
+    def get_mode_log_probs(self):
+        """
+        Computes the log probability of each component at its mode. This is the contribution
+        of a variable that is maximized out rather than summed out.
+
+        Returns:
+            A ``Tensor`` of shape ``[1, num_scopes, num_decomps, num_components]``
+        """
+        if self._is_tabulated():
+            max_log_prob = tf.reduce_max(self._log_prob_table(), axis=3)
+            return tf.expand_dims(tf.reduce_sum(max_log_prob, axis=2), axis=0)
+        log_prob = self._get_distribution().log_prob(self.get_modes())
+        return tf.reduce_sum(log_prob, axis=-1)
@@ -0,0 +1,148 @@
+from libspn_keras.backprop_mode import BackpropMode
+from libspn_keras.layers.base_leaf import BaseLeaf
+from libspn_keras.math.soft_em_grads import gather_log_probs_from_accumulators_with_em_grad
+from tensorflow import initializers
+import tensorflow as tf
+
+
+class BernoulliLeaf(BaseLeaf):
+    """
+    Computes the log probability of multiple Bernoulli components per binary variable. Inputs can
+    optionally be bit-packed along the scope axis (e.g. by ``np.packbits(x, axis=1)``), in which case
+    they are unpacked on device so that binary data only costs a single bit per variable in the
+    input pipeline.
+
+    Args:
+        num_components: Number of components per variable
+        bit_packed: If ``True``, inputs are expected to be ``uint8`` with 8 binary variables packed
+            per byte along the scope axis, most significant bit first.
+        num_vars: Number of variables after unpacking. Only used when ``bit_packed`` is ``True``.
+            Defaults to 8 times the number of bytes, which only differs from the number of
+            variables when the packed axis was padded.
+        logits_initializer: Initializer for the logits of the probability of a 1.
+        logits_trainable: Boolean that indicates whether logits (or accumulators) are trainable
+        accumulator_initializer: Initializer for the total count of the accumulators, which is
+            split over zeros and ones according to the initial logits. Only used when
+            ``use_accumulators`` is ``True``.
+        use_accumulators: If ``True``, the probabilities are computed from linear accumulators
+            holding the counts of zeros and ones.
+        backprop_mode: Backpropagation mode can be BackpropMode.GRADIENT, BackpropMode.HARD_EM,
+            BackpropMode.HARD_EM_UNWEIGHTED or BackpropMode.EM. For the EM modes, the gradients of
+            the accumulators are the (soft or hard) counts of zeros and ones, which requires
+            ``use_accumulators``.
+        **kwargs: kwargs to pass on to the keras.Layer super class
+    """
+
+    def __init__(
+        self, num_components, bit_packed=False, num_vars=None, logits_initializer=None,
+        logits_trainable=True, accumulator_initializer=None, use_accumulators=False,
+        backprop_mode=BackpropMode.GRADIENT, **kwargs
+    ):
+        super(BernoulliLeaf, self).__init__(num_components=num_components, **kwargs)
+        self.bit_packed = bit_packed
+        self.num_vars = num_vars
+        self.logits_initializer = logits_initializer or initializers.TruncatedNormal(stddev=1.0)
+        self.logits_trainable = logits_trainable
+        self.accumulator_initializer = accumulator_initializer or initializers.Ones()
+        self.use_accumulators = use_accumulators
+        self.backprop_mode = backprop_mode
+
+        if backprop_mode != BackpropMode.GRADIENT and not use_accumulators:
+            raise ValueError("EM backprop modes are only supported with accumulators")
+
+    def build(self, input_shape):
+        super(BernoulliLeaf, self).build(self._unpacked_shape(input_shape))
+
+    def _unpacked_shape(self, input_shape):
+        if not self.bit_packed:
+            return input_shape
+        num_batch, num_bytes, *rest = input_shape
+        return [num_batch, self.num_vars or num_bytes * 8] + rest
+
+    def _build_distribution(self, shape):
+        _, num_scopes, num_decomps, num_components, multivariate_size = shape
+        if self.use_accumulators:
+            # Counts of zeros and ones per variable and component
+            self.accumulators = self.add_weight(
+                name="accumulators",
+                shape=[num_scopes, num_decomps, multivariate_size, 2, num_components],
+                initializer=_CountsInitializer(self.accumulator_initializer, self.logits_initializer),
+                trainable=self.logits_trainable)
+        else:
+            self.logits = self.add_weight(
+                name="logits", shape=[num_scopes, num_decomps, multivariate_size, 1, num_components],
+                initializer=self.logits_initializer, trainable=self.logits_trainable)
+
+    def call(self, x, marginalize_mask=None):
+        if self.bit_packed:
+            x = self._unpack_bits(x)
+        return super(BernoulliLeaf, self).call(x, marginalize_mask=marginalize_mask)
+
+    def _evaluate(self, x):
+        indices = self._level_indices(x, 2) + self._block_offsets(2)
+        # [batch, scopes, decomps, multivariate_size, num_components] -> sum over variables
+        return tf.reduce_sum(self._gather_log_probs(indices), axis=3)
+
+    def _can_evaluate_observed(self):
+        return True
+
+    def _evaluate_observed(self, x, scope_decomp_indices):
+        indices = self._level_indices(x, 2) + self._observed_block_offsets(scope_decomp_indices, 2)
+        return tf.reduce_sum(self._gather_log_probs(indices), axis=1)
+
+    def _gather_log_probs(self, indices):
+        if self.use_accumulators and self.backprop_mode != BackpropMode.GRADIENT:
+            return gather_log_probs_from_accumulators_with_em_grad(self.accumulators, indices, axis=3)
+        return tf.gather(tf.reshape(self._log_prob_table(), [-1, self.num_components]), indices)
+
+    def _is_tabulated(self):
+        return True
+
+    def _log_prob_table(self):
+        if self.use_accumulators:
+            return tf.nn.log_softmax(tf.math.log(self.accumulators), axis=3)
+        # Rows of the flattened table alternate between the log probability of a 0 and a 1
+        return tf.concat([tf.math.log_sigmoid(-self.logits), tf.math.log_sigmoid(self.logits)], axis=3)
+
+    def _unpack_bits(self, x):
+        # [1, 1, 8, 1, 1] shifts so that the most significant bit comes first as in np.packbits.
+        # Bytes are widened only after they have been transferred, since not all devices have
+        # shift kernels for uint8
+        shifts = tf.reshape(tf.range(7, -1, -1), [1, 1, 8, 1, 1])
+        bits = tf.bitwise.bitwise_and(
+            tf.bitwise.right_shift(tf.expand_dims(tf.cast(x, tf.int32), axis=2), shifts), 1)
+        _, num_bytes, num_decomps, multivariate_size = x.shape
+        bits = tf.reshape(bits, [-1, num_bytes * 8, num_decomps, multivariate_size])
+        return bits[:, :self._num_scopes]
+
+    def compute_output_shape(self, input_shape):
+        return super(BernoulliLeaf, self).compute_output_shape(self._unpacked_shape(input_shape))
+
+    def get_config(self):
+        config = dict(
+            bit_packed=self.bit_packed,
+            num_vars=self.num_vars,
+            logits_initializer=initializers.serialize(self.logits_initializer),
+            logits_trainable=self.logits_trainable,
+            accumulator_initializer=initializers.serialize(self.accumulator_initializer),
+            use_accumulators=self.use_accumulators,
+            backprop_mode=self.backprop_mode,
+        )
+        base_config = super(BernoulliLeaf, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
+
+
+class _CountsInitializer(initializers.Initializer):
+    """
+    Initializes the counts of zeros and ones by splitting the total counts of
+    ``count_initializer`` according to the probabilities given by ``logits_initializer``.
+    """
+
+    def __init__(self, count_initializer, logits_initializer):
+        self.count_initializer = count_initializer
+        self.logits_initializer = logits_initializer
+
+    def __call__(self, shape, dtype=None):
+        logits = self.logits_initializer(shape=list(shape[:3]) + [1] + list(shape[4:]), dtype=dtype)
+        return self.count_initializer(shape=shape, dtype=dtype) * \
+            tf.concat([tf.sigmoid(-logits), tf.sigmoid(logits)], axis=3)
@@ -0,0 +1,116 @@
+from libspn_keras.backprop_mode import BackpropMode, infer_logspace_accumulators
+from libspn_keras.constraints.greater_equal_epsilon import GreaterEqualEpsilon
+from libspn_keras.layers.base_leaf import BaseLeaf
+from libspn_keras.logspace import logspace_wrapper_initializer
+from libspn_keras.math.soft_em_grads import gather_log_probs_from_accumulators_with_em_grad
+from tensorflow.keras import initializers
+from tensorflow.keras import regularizers
+from tensorflow.keras import constraints
+import tensorflow as tf
+
+
+class CategoricalLeaf(BaseLeaf):
+    """
+    Categorical leaf distribution that takes integer inputs and holds a learnable table of
+    probabilities per variable and component. Rather than expanding each variable to a
+    ``num_values``-wide indicator representation that has to be mixed by a ``DenseSum`` layer, the
+    components are evaluated by gathering the log probabilities of the observed values from the
+    table.
+
+    Args:
+        num_components: Number of components per variable
+        num_values: Number of values each variable can take. Inputs must be in
+            ``[0, num_values)``
+        logspace_accumulators: If ``True``, accumulators will be represented in log-space which
+            is typically used with ``BackpropMode.GRADIENT``. If ``False``, accumulators will be
+            represented in linear space. Probabilities are computed by normalizing the accumulators
+            over the values, so that each component is a normalized distribution. If ``None``
+            (default) it will be set to ``True`` for ``BackpropMode.GRADIENT`` and ``False``
+            otherwise.
+        accumulator_initializer: Initializer for accumulator. Will automatically be converted
+            to log-space values if ``logspace_accumulators`` is enabled. Defaults to a uniform
+            random initializer so that components can break symmetry.
+        backprop_mode: Backpropagation mode can be BackpropMode.GRADIENT, BackpropMode.HARD_EM,
+            BackpropMode.HARD_EM_UNWEIGHTED or BackpropMode.EM. For the EM modes, the
+            gradients of the accumulators are the (soft or hard) counts of each value.
+        accumulator_regularizer: Regularizer for accumulator (experimental)
+        linear_accumulator_constraint: Constraint for accumulator defaults to constraint that
+            ensures small positive constant at minimum. Will be ignored if logspace_accumulators
+            is set to True.
+        **kwargs: kwargs to pass on to the ``BaseLeaf`` super class
+    """
+
+    def __init__(
+        self, num_components, num_values, logspace_accumulators=None,
+        accumulator_initializer=None, backprop_mode=BackpropMode.GRADIENT,
+        accumulator_regularizer=None, linear_accumulator_constraint=None, **kwargs
+    ):
+        super(CategoricalLeaf, self).__init__(num_components, **kwargs)
+        self.num_values = num_values
+        self.logspace_accumulators = infer_logspace_accumulators(backprop_mode) \
+            if logspace_accumulators is None else logspace_accumulators
+        self.accumulator_initializer = \
+            accumulator_initializer or initializers.RandomUniform(minval=0.5, maxval=1.5)
+        self.backprop_mode = backprop_mode
+        self.accumulator_regularizer = accumulator_regularizer
+        self.linear_accumulator_constraint = \
+            linear_accumulator_constraint or GreaterEqualEpsilon(1e-10)
+        self._accumulators = None
+
+        if backprop_mode != BackpropMode.GRADIENT and logspace_accumulators:
+            raise ValueError("Logspace accumulators are only supported for gradient backprop mode")
+
+    def _build_distribution(self, shape):
+        _, num_scopes, num_decomps, num_components, multivariate_size = shape
+        accumulators_shape = \
+            [num_scopes, num_decomps, multivariate_size, self.num_values, num_components]
+
+        initializer = self.accumulator_initializer
+        accumulator_constraint = self.linear_accumulator_constraint
+        if self.logspace_accumulators:
+            initializer = logspace_wrapper_initializer(self.accumulator_initializer)
+            accumulator_constraint = None
+
+        self._accumulators = self.add_weight(
+            name='categorical_accumulators', shape=accumulators_shape, initializer=initializer,
+            regularizer=self.accumulator_regularizer, constraint=accumulator_constraint
+        )
+
+    def _evaluate(self, x):
+        indices = self._level_indices(x, self.num_values) + self._block_offsets(self.num_values)
+        # [batch, scopes, decomps, multivariate_size, num_components] -> sum over variables
+        return tf.reduce_sum(self._gather_log_probs(indices), axis=3)
+
+    def _can_evaluate_observed(self):
+        return True
+
+    def _evaluate_observed(self, x, scope_decomp_indices):
+        indices = self._level_indices(x, self.num_values) + \
+            self._observed_block_offsets(scope_decomp_indices, self.num_values)
+        return tf.reduce_sum(self._gather_log_probs(indices), axis=1)
+
+    def _gather_log_probs(self, indices):
+        if not self.logspace_accumulators and self.backprop_mode != BackpropMode.GRADIENT:
+            return gather_log_probs_from_accumulators_with_em_grad(
+                self._accumulators, indices, axis=3)
+        return tf.gather(tf.reshape(self._log_prob_table(), [-1, self.num_components]), indices)
+
+    def _is_tabulated(self):
+        return True
+
+    def _log_prob_table(self):
+        if self.logspace_accumulators:
+            return tf.nn.log_softmax(self._accumulators, axis=3)
+        return tf.nn.log_softmax(tf.math.log(self._accumulators), axis=3)
+
+    def get_config(self):
+        config = dict(
+            num_values=self.num_values,
+            accumulator_initializer=initializers.serialize(self.accumulator_initializer),
+            logspace_accumulators=self.logspace_accumulators,
+            backprop_mode=self.backprop_mode,
+            accumulator_regularizer=regularizers.serialize(self.accumulator_regularizer),
+            linear_accumulator_constraint=constraints.serialize(self.linear_accumulator_constraint)
+        )
+        base_config = super(CategoricalLeaf, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
@@ -72,14 +72,29 @@ class DenseSum(keras.layers.Layer):
         super(DenseSum, self).build(input_shape)
 
     def call(self, x):
-        log_weights_unnormalized = self._accumulators
+        return self.call_with_accumulators(x, self._accumulators)
+
+    def call_with_accumulators(self, x, accumulators):
+        """
+        Computes the sums of a subset of scopes, so that the sums can be evaluated in chunks of
+        scopes.
+
+        Args:
+            x: Input of shape [num_batch, num_scopes_subset, num_decomps, num_nodes]
+            accumulators: The accumulators of the corresponding subset of scopes, e.g. a slice
+                of the layer's accumulators along the first axis
+
+        Returns:
+            The output of the sums of shape [num_batch, num_scopes_subset, num_decomps, num_sums]
+        """
+        log_weights_unnormalized = accumulators
 
         x = tf.transpose(x, (1, 2, 0, 3))
 
         if not self.logspace_accumulators and \
                 self.backprop_mode in [BackpropMode.HARD_EM, BackpropMode.HARD_EM_UNWEIGHTED]:
             out = logmatmul_hard_em_through_grads_from_accumulators(
-                x, self._accumulators,
+                x, accumulators,
                 unweighted=self.backprop_mode == BackpropMode.HARD_EM_UNWEIGHTED
             )
             out = tf.transpose(out, (2, 0, 1, 3))
@@ -87,7 +102,7 @@ class DenseSum(keras.layers.Layer):
 
         if not self.logspace_accumulators and self.backprop_mode == BackpropMode.EM:
             log_weights_normalized = log_softmax_from_accumulators_with_em_grad(
-                self._accumulators, axis=2)
+                accumulators, axis=2)
         elif not self.logspace_accumulators:
             log_weights_normalized = tf.nn.log_softmax(tf.math.log(log_weights_unnormalized), axis=2)
         else:
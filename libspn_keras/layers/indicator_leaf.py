@@ -25,6 +25,20 @@ class IndicatorLeaf(BaseLeaf):
     def _get_distribution(self):
         return self._indicator
 
+    def get_modes(self):
+        # The mode of each indicator is the value it indicates
+        modes = tf.reshape(tf.range(self.num_components, dtype=self.dtype), [1, 1, 1, -1, 1])
+        return tf.broadcast_to(modes, self._distribution_shape)
+
+    def sample_components(self, indices):
+        # Each indicator only has mass at the value it indicates
+        samples = tf.broadcast_to(
+            indices[..., 2:], tf.concat([tf.shape(indices)[:-1], self._distribution_shape[-1:]], axis=0))
+        return tf.cast(samples, self.dtype)
+
+    def get_mode_log_probs(self):
+        return tf.zeros(self._distribution_shape[:-1])
+
 
 class _Indicator(distributions.Distribution):
 
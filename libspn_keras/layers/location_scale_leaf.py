@@ -1,10 +1,12 @@
 import abc
 
 from libspn_keras.layers.base_leaf import BaseLeaf
-import tensorflow_probability as tfp
 from tensorflow import initializers
 import tensorflow as tf
 
+from libspn_keras.math.location_scale import LocationScaleKernel, normal_log_prob, normal_log_cdf, \
+    normal_sample, cauchy_log_prob, cauchy_log_cdf, cauchy_sample, laplace_log_prob, laplace_log_cdf, \
+    laplace_sample
 from libspn_keras.math.soft_em_grads import LocationScaleEMGradWrapper, LocationEMGradWrapper
 
 
@@ -17,6 +19,9 @@ class LocationScaleLeafBase(BaseLeaf):
         location_initializer: Initializer for location variable
         location_trainable: Boolean that indicates whether location is trainable
         scale_initializer: Initializer for scale variable
+        num_quantized_levels: If not ``None``, inputs are expected to be integers in
+            ``[0, num_quantized_levels)``, e.g. 256 for 8-bit pixels. The log probabilities of
+            all levels are tabulated once per call and inputs are evaluated by a lookup.
         **kwargs: kwargs to pass on to the keras.Layer super class
     """
     def __init__(
@@ -42,18 +47,19 @@ class LocationScaleLeafBase(BaseLeaf):
             self._get_distribution = self._get_distribution_from_vars
 
     def _get_distribution_from_vars(self):
-        return self._build_distribution_from_loc_and_scale(loc=self.loc, scale=self.scale)
+        return self._build_distribution_from_loc_and_log_scale(
+            loc=self.loc, log_scale=tf.math.log(self.scale))
 
     def _get_distribution_from_accumulators(self):
         loc = self.first_order_moment_num_accum / self.first_order_moment_denom_accum
         if self.scale_trainable:
-            scale = tf.sqrt(self.second_order_moment_num_accum / self.second_order_moment_denom_accum - tf.square(loc))
-            dist = self._build_distribution_from_loc_and_scale(loc=loc, scale=scale)
+            variance = self.second_order_moment_num_accum / self.second_order_moment_denom_accum - tf.square(loc)
+            dist = self._build_distribution_from_loc_and_log_scale(loc=loc, log_scale=0.5 * tf.math.log(variance))
             return LocationScaleEMGradWrapper(
                 dist, self.first_order_moment_denom_accum, self.first_order_moment_num_accum,
                 self.second_order_moment_denom_accum, self.second_order_moment_num_accum)
         else:
-            dist = self._build_distribution_from_loc_and_scale(loc=loc, scale=self.scale)
+            dist = self._build_distribution_from_loc_and_log_scale(loc=loc, log_scale=tf.math.log(self.scale))
             return LocationEMGradWrapper(dist, self.first_order_moment_denom_accum, self.first_order_moment_num_accum)
 
     def _create_loc_scale_accumulators(self, shape):
@@ -83,7 +89,7 @@ class LocationScaleLeafBase(BaseLeaf):
             )
 
     @abc.abstractmethod
-    def _build_distribution_from_loc_and_scale(self, loc, scale):
+    def _build_distribution_from_loc_and_log_scale(self, loc, log_scale):
         """ Implement in descendant classes"""
 
     def _create_loc_scale_vars(self, shape):
@@ -106,8 +112,27 @@ class LocationScaleLeafBase(BaseLeaf):
         return dict(list(base_config.items()) + list(config.items()))
 
     def get_modes(self):
+        if self._is_tabulated():
+            return super(LocationScaleLeafBase, self).get_modes()
         return self._get_distribution().mode()
 
+    def _can_evaluate_observed(self):
+        return True
+
+    def _evaluate_observed(self, x, scope_decomp_indices):
+        if self.num_quantized_levels is not None:
+            return super(LocationScaleLeafBase, self)._evaluate_observed(x, scope_decomp_indices)
+        # [num_observed, 1, multivariate_size] to broadcast against the components
+        x = tf.expand_dims(x, axis=1)
+        distribution = self._get_distribution()
+        if self.use_cdf:
+            log_prob = distribution.gather(scope_decomp_indices).log_cdf(x)
+        elif self.use_accumulators:
+            log_prob = distribution.log_prob_observed(x, scope_decomp_indices)
+        else:
+            log_prob = distribution.gather(scope_decomp_indices).log_prob(x)
+        return tf.reduce_sum(log_prob, axis=-1)
+
 
 class NormalLeaf(LocationScaleLeafBase):
     """
@@ -120,11 +145,16 @@ class NormalLeaf(LocationScaleLeafBase):
         location_trainable: Boolean that indicates whether location is trainable
         scale_initializer: Initializer for scale variable
         scale_trainable: Boolean that indicates whether scale is trainable
+        num_quantized_levels: If not ``None``, inputs are expected to be integers in
+            ``[0, num_quantized_levels)``, e.g. 256 for 8-bit pixels. The log probabilities of
+            all levels are tabulated once per call and inputs are evaluated by a lookup.
         **kwargs: kwargs to pass on to the keras.Layer super class
     """
 
-    def _build_distribution_from_loc_and_scale(self, loc, scale):
-        return tfp.distributions.Normal(loc=loc, scale=scale)
+    def _build_distribution_from_loc_and_log_scale(self, loc, log_scale):
+        return LocationScaleKernel(
+            loc=loc, log_scale=log_scale, log_prob_fn=normal_log_prob, log_cdf_fn=normal_log_cdf,
+            sample_fn=normal_sample)
 
 
 class CauchyLeaf(LocationScaleLeafBase):
@@ -137,6 +167,9 @@ class CauchyLeaf(LocationScaleLeafBase):
         location_initializer: Initializer for location variable
         location_trainable: Boolean that indicates whether location is trainable
         scale_initializer: Initializer for scale variable
+        num_quantized_levels: If not ``None``, inputs are expected to be integers in
+            ``[0, num_quantized_levels)``, e.g. 256 for 8-bit pixels. The log probabilities of
+            all levels are tabulated once per call and inputs are evaluated by a lookup.
         **kwargs: kwargs to pass on to the keras.Layer super class
     """
     def __init__(self, num_components, location_initializer=None, location_trainable=True, scale_initializer=None,
@@ -151,8 +184,10 @@ class CauchyLeaf(LocationScaleLeafBase):
             use_accumulators=use_accumulators,
             **kwargs)
 
-    def _build_distribution_from_loc_and_scale(self, loc, scale):
-        return tfp.distributions.Cauchy(loc=loc, scale=scale)
+    def _build_distribution_from_loc_and_log_scale(self, loc, log_scale):
+        return LocationScaleKernel(
+            loc=loc, log_scale=log_scale, log_prob_fn=cauchy_log_prob, log_cdf_fn=cauchy_log_cdf,
+            sample_fn=cauchy_sample)
 
 
 class LaplaceLeaf(LocationScaleLeafBase):
@@ -165,6 +200,9 @@ class LaplaceLeaf(LocationScaleLeafBase):
         location_initializer: Initializer for location variable
         location_trainable: Boolean that indicates whether location is trainable
         scale_initializer: Initializer for scale variable
+        num_quantized_levels: If not ``None``, inputs are expected to be integers in
+            ``[0, num_quantized_levels)``, e.g. 256 for 8-bit pixels. The log probabilities of
+            all levels are tabulated once per call and inputs are evaluated by a lookup.
         **kwargs: kwargs to pass on to the keras.Layer super class
     """
     def __init__(self, num_components, location_initializer=None, location_trainable=True, scale_initializer=None,
@@ -179,6 +217,8 @@ class LaplaceLeaf(LocationScaleLeafBase):
             use_accumulators=use_accumulators,
             **kwargs)
 
-    def _build_distribution_from_loc_and_scale(self, loc, scale):
-        return tfp.distributions.Laplace(loc=loc, scale=scale)
+    def _build_distribution_from_loc_and_log_scale(self, loc, log_scale):
+        return LocationScaleKernel(
+            loc=loc, log_scale=log_scale, log_prob_fn=laplace_log_prob, log_cdf_fn=laplace_log_cdf,
+            sample_fn=laplace_sample)
 
@@ -0,0 +1,81 @@
+import tensorflow as tf
+from tensorflow import keras
+
+from libspn_keras.backprop_mode import BackpropMode
+from libspn_keras.layers.dense_sum import DenseSum
+from libspn_keras.layers.root_sum import RootSum
+from libspn_keras.layers.temporal_dense_product import TemporalDenseProduct
+from libspn_keras.math.logmatmul import logmatmul_outer
+from libspn_keras.math.soft_em_grads import log_softmax_from_accumulators_with_em_grad
+
+
+class TemporalDenseProductSum(keras.layers.Layer):
+    """
+    Computes the output of a sum layer applied to the 'temporal' dense products of an interface
+    stack at :math:`t - 1` and a template SPN at :math:`t`, without materializing the products.
+    This is equivalent to applying ``sum_layer`` to the output of ``TemporalDenseProduct``, but
+    the weighted sums are contracted over the two inputs one after the other, so that only
+    ``min(num_nodes_a, num_nodes_b) * num_sums`` intermediate values are computed per sample
+    rather than ``num_nodes_a * num_nodes_b``.
+
+    The gradients of ``BackpropMode.HARD_EM`` and ``BackpropMode.HARD_EM_UNWEIGHTED`` select the
+    maximum weighted product of every sum, so for sum layers with these backprop modes the
+    products are computed explicitly with ``TemporalDenseProduct`` before ``sum_layer`` is
+    applied, which gives the same output and gradients without saving memory.
+
+    Args:
+        sum_layer: A ``DenseSum`` over a single scope and decomposition or a ``RootSum`` with
+            ``return_weighted_child_logits=False``, of which the accumulators are used. The
+            layer is expected to take the output of a ``TemporalDenseProduct`` as input.
+        **kwargs: kwargs to pass on to the keras.Layer super class.
+
+    Raises:
+        ValueError: If ``sum_layer`` is not a ``DenseSum`` or a ``RootSum`` that computes the
+            weighted sum of its input.
+    """
+
+    def __init__(self, sum_layer, **kwargs):
+        if not isinstance(sum_layer, (DenseSum, RootSum)) or \
+                isinstance(sum_layer, RootSum) and sum_layer.return_weighted_child_logits:
+            raise ValueError("Can only fuse DenseSum layers and RootSum layers that return the weighted sum")
+        self.sum_layer = sum_layer
+        self._explicit_product = TemporalDenseProduct() \
+            if sum_layer.backprop_mode in [BackpropMode.HARD_EM, BackpropMode.HARD_EM_UNWEIGHTED] else None
+        super(TemporalDenseProductSum, self).__init__(**kwargs)
+
+    def build(self, input_shape):
+        a_shape, b_shape = input_shape
+        if not self.sum_layer.built:
+            self.sum_layer.build([a_shape[0], 1, 1, a_shape[-1] * b_shape[-1]])
+        super(TemporalDenseProductSum, self).build(input_shape)
+
+    def call(self, x):
+        if self._explicit_product is not None:
+            return self.sum_layer(self._explicit_product(x))
+        a, b = x
+        num_nodes_a, num_nodes_b = a.shape[-1], b.shape[-1]
+        out = logmatmul_outer(
+            tf.reshape(a, [-1, num_nodes_a]), tf.reshape(b, [-1, num_nodes_b]),
+            self._normalized_log_weights())
+        if isinstance(self.sum_layer, RootSum):
+            return out
+        return tf.reshape(out, [-1, 1, 1, self.sum_layer.num_sums])
+
+    def _normalized_log_weights(self):
+        # Normalizes the accumulators in the same way as the sum layer, so that EM statistics are
+        # passed on to its accumulators
+        if isinstance(self.sum_layer, RootSum):
+            accumulators = tf.expand_dims(self.sum_layer.accumulators, axis=1)
+        else:
+            accumulators = self.sum_layer._accumulators[0, 0]
+        if self.sum_layer.backprop_mode == BackpropMode.EM:
+            return log_softmax_from_accumulators_with_em_grad(accumulators, axis=0)
+        if not self.sum_layer.logspace_accumulators:
+            accumulators = tf.math.log(accumulators)
+        return tf.nn.log_softmax(accumulators, axis=0)
+
+    def compute_output_shape(self, input_shape):
+        a_shape, _ = input_shape
+        if isinstance(self.sum_layer, RootSum):
+            return a_shape[0], 1
+        return a_shape[0], 1, 1, self.sum_layer.num_sums
@@ -0,0 +1,205 @@
+import numpy as np
+import tensorflow as tf
+from tensorflow_probability import distributions
+
+_HALF_LOG_TWO_PI = 0.5 * np.log(2.0 * np.pi)
+_LOG_TWO = np.log(2.0)
+_LOG_PI = np.log(np.pi)
+
+
+def normal_log_prob(x, loc, log_scale):
+    """
+    Log density of a normal distribution.
+
+    Args:
+        x: Values at which to evaluate the density
+        loc: Location (mean) of the distribution
+        log_scale: Log of the scale (standard deviation) of the distribution
+
+    Returns:
+        A ``Tensor`` holding the log density of ``x``
+    """
+    z = (x - loc) * tf.exp(-log_scale)
+    return -0.5 * tf.square(z) - log_scale - _HALF_LOG_TWO_PI
+
+
+def normal_log_cdf(x, loc, log_scale):
+    """
+    Log cumulative distribution function of a normal distribution.
+
+    Args:
+        x: Values at which to evaluate the CDF
+        loc: Location (mean) of the distribution
+        log_scale: Log of the scale (standard deviation) of the distribution
+
+    Returns:
+        A ``Tensor`` holding the log CDF of ``x``
+    """
+    z = (x - loc) * tf.exp(-log_scale)
+    # The log CDF of a standard normal is accurate far into the lower tail, unlike log(ndtr(z))
+    standard_normal = distributions.Normal(tf.zeros([], dtype=z.dtype), tf.ones([], dtype=z.dtype))
+    return standard_normal.log_cdf(z)
+
+
+def normal_sample(loc, log_scale):
+    """
+    Draws samples from a normal distribution.
+
+    Args:
+        loc: Location (mean) of the distribution
+        log_scale: Log of the scale (standard deviation) of the distribution
+
+    Returns:
+        A ``Tensor`` of the same shape as ``loc`` holding one sample per element
+    """
+    return loc + tf.exp(log_scale) * tf.random.normal(tf.shape(loc), dtype=loc.dtype)
+
+
+def laplace_log_prob(x, loc, log_scale):
+    """
+    Log density of a Laplace distribution.
+
+    Args:
+        x: Values at which to evaluate the density
+        loc: Location of the distribution
+        log_scale: Log of the scale of the distribution
+
+    Returns:
+        A ``Tensor`` holding the log density of ``x``
+    """
+    return -tf.abs(x - loc) * tf.exp(-log_scale) - log_scale - _LOG_TWO
+
+
+def laplace_log_cdf(x, loc, log_scale):
+    """
+    Log cumulative distribution function of a Laplace distribution.
+
+    Args:
+        x: Values at which to evaluate the CDF
+        loc: Location of the distribution
+        log_scale: Log of the scale of the distribution
+
+    Returns:
+        A ``Tensor`` holding the log CDF of ``x``
+    """
+    z = (x - loc) * tf.exp(-log_scale)
+    # Lower tail is 0.5 * exp(z), upper tail is 1 - 0.5 * exp(-z)
+    return tf.where(z < 0, z - _LOG_TWO, tf.math.log1p(-0.5 * tf.exp(-tf.abs(z))))
+
+
+def laplace_sample(loc, log_scale):
+    """
+    Draws samples from a Laplace distribution by inverting its CDF.
+
+    Args:
+        loc: Location of the distribution
+        log_scale: Log of the scale of the distribution
+
+    Returns:
+        A ``Tensor`` of the same shape as ``loc`` holding one sample per element
+    """
+    # Uniform in the open interval (-0.5, 0.5), so that the log below stays finite
+    u = tf.random.uniform(tf.shape(loc), minval=-0.5, maxval=0.5, dtype=loc.dtype)
+    u = tf.clip_by_value(u, -0.5 + np.finfo(loc.dtype.as_numpy_dtype).eps, 0.5)
+    return loc - tf.exp(log_scale) * tf.sign(u) * tf.math.log1p(-2.0 * tf.abs(u))
+
+
+def cauchy_log_prob(x, loc, log_scale):
+    """
+    Log density of a Cauchy distribution.
+
+    Args:
+        x: Values at which to evaluate the density
+        loc: Location of the distribution
+        log_scale: Log of the scale of the distribution
+
+    Returns:
+        A ``Tensor`` holding the log density of ``x``
+    """
+    z = (x - loc) * tf.exp(-log_scale)
+    return -tf.math.log1p(tf.square(z)) - log_scale - _LOG_PI
+
+
+def cauchy_log_cdf(x, loc, log_scale):
+    """
+    Log cumulative distribution function of a Cauchy distribution.
+
+    Args:
+        x: Values at which to evaluate the CDF
+        loc: Location of the distribution
+        log_scale: Log of the scale of the distribution
+
+    Returns:
+        A ``Tensor`` holding the log CDF of ``x``
+    """
+    z = (x - loc) * tf.exp(-log_scale)
+    return tf.math.log1p(2.0 / np.pi * tf.atan(z)) - _LOG_TWO
+
+
+def cauchy_sample(loc, log_scale):
+    """
+    Draws samples from a Cauchy distribution by inverting its CDF.
+
+    Args:
+        loc: Location of the distribution
+        log_scale: Log of the scale of the distribution
+
+    Returns:
+        A ``Tensor`` of the same shape as ``loc`` holding one sample per element
+    """
+    u = tf.random.uniform(tf.shape(loc), dtype=loc.dtype)
+    return loc + tf.exp(log_scale) * tf.tan(np.pi * (u - 0.5))
+
+
+class LocationScaleKernel:
+    """
+    Light-weight stand-in for a ``tfp.distributions`` location-scale distribution. It only
+    holds the parameters and evaluates closed-form kernels, so that leaves can be evaluated
+    without constructing (and validating) a ``tfp`` distribution on every call.
+
+    Args:
+        loc: Location of the distribution
+        log_scale: Log of the scale of the distribution
+        log_prob_fn: Function computing the log density from ``(x, loc, log_scale)``
+        log_cdf_fn: Function computing the log CDF from ``(x, loc, log_scale)``
+        sample_fn: Function drawing a sample per element of ``(loc, log_scale)``
+    """
+
+    def __init__(self, loc, log_scale, log_prob_fn, log_cdf_fn, sample_fn=None):
+        self.loc = loc
+        self.log_scale = log_scale
+        self._log_prob_fn = log_prob_fn
+        self._log_cdf_fn = log_cdf_fn
+        self._sample_fn = sample_fn
+
+    def log_prob(self, x):
+        return self._log_prob_fn(x, self.loc, self.log_scale)
+
+    def log_cdf(self, x):
+        return self._log_cdf_fn(x, self.loc, self.log_scale)
+
+    def mode(self):
+        return self.loc
+
+    def sample(self):
+        return self._sample_fn(self.loc, self.log_scale)
+
+    def gather(self, indices):
+        """
+        Gathers the parameters at the given (scope, decomposition) or (scope, decomposition,
+        component) indices.
+
+        Args:
+            indices: int32 ``Tensor`` of which the last axis has size 2 or 3 and indexes the
+                parameters of shape ``[1, num_scopes, num_decomps, num_components,
+                multivariate_size]`` after the leading axis
+
+        Returns:
+            A ``LocationScaleKernel`` with parameters of shape ``indices.shape[:-1] +
+            [num_components, multivariate_size]`` or ``indices.shape[:-1] + [multivariate_size]``
+        """
+        return LocationScaleKernel(
+            loc=tf.gather_nd(self.loc[0], indices),
+            log_scale=tf.gather_nd(self.log_scale[0], indices),
+            log_prob_fn=self._log_prob_fn, log_cdf_fn=self._log_cdf_fn, sample_fn=self._sample_fn
+        )
@@ -22,3 +22,31 @@ def logmatmul(log_a, log_b):
 
     # Compute logsumexp using matrix multiplication
     return tf.math.log(tf.matmul(tf.exp(log_a - max_a), tf.exp(log_b - max_b))) + max_a + max_b
+
+
+def logmatmul_outer(log_a, log_b, log_w):
+    """
+    Multiplies the outer product of two vectors with a matrix in log-space without materializing
+    the outer product. The larger of the two vectors is contracted first, so that the largest
+    intermediate result is of shape [batch, min(num_a, num_b) * num_out] rather than
+    [batch, num_a * num_b].
+
+    Args:
+        log_a: log(a) of shape [batch, num_a]
+        log_b: log(b) of shape [batch, num_b]
+        log_w: log(w) of shape [num_a * num_b, num_out], in which row a * num_b + b corresponds to
+            the product of a and b
+
+    Returns:
+        A matrix log(c) of shape [batch, num_out] where log(c) = log(outer(a, b) @ w)
+    """
+    num_a, num_b, num_out = log_a.shape[-1], log_b.shape[-1], log_w.shape[-1]
+    log_w = tf.reshape(log_w, [num_a, num_b, num_out])
+    if num_a > num_b:
+        log_a, log_b, num_a, num_b = log_b, log_a, num_b, num_a
+        log_w = tf.transpose(log_w, (1, 0, 2))
+    # [batch, num_b] @ [num_b, num_a * num_out] -> [batch, num_a, num_out]
+    log_w = tf.reshape(tf.transpose(log_w, (1, 0, 2)), [num_b, num_a * num_out])
+    log_a_w = tf.reshape(logmatmul(log_b, log_w), [-1, num_a, num_out])
+    # [batch, 1, num_a] @ [batch, num_a, num_out] -> [batch, num_out]
+    return tf.squeeze(logmatmul(tf.expand_dims(log_a, axis=1), log_a_w), axis=1)
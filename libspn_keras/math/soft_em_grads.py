@@ -50,7 +50,8 @@ class LocationScaleEMGradWrapper:
     def log_prob(self, x):
 
         @tf.custom_gradient
-        def _inner(first_order_moment_denom_accum, first_order_moment_num_accum, second_order_moment_denom_accum, second_order_moment_num_accum):
+        def _inner(first_order_moment_denom_accum, first_order_moment_num_accum, second_order_moment_denom_accum,
+                   second_order_moment_num_accum):
 
             def grad(dy):
                 denom_grad = tf.reduce_sum(dy, axis=0, keepdims=True)
@@ -63,7 +64,30 @@ class LocationScaleEMGradWrapper:
 
             return out, grad
 
-        return _inner(self.first_order_moment_denom_accum, self.first_order_moment_num_accum, self.second_order_moment_denom_accum, self.second_order_moment_num_accum)
+        return _inner(self.first_order_moment_denom_accum, self.first_order_moment_num_accum,
+                      self.second_order_moment_denom_accum, self.second_order_moment_num_accum)
+
+    def log_prob_observed(self, x, scope_decomp_indices):
+
+        @tf.custom_gradient
+        def _inner(first_order_moment_denom_accum, first_order_moment_num_accum, second_order_moment_denom_accum,
+                   second_order_moment_num_accum):
+
+            def grad(dy):
+                denom_grad = _scatter_to_accumulator(dy, scope_decomp_indices, first_order_moment_denom_accum)
+                first_order_moment_num_grad = _scatter_to_accumulator(
+                    x * dy, scope_decomp_indices, first_order_moment_num_accum)
+                second_order_moment_num_grad = _scatter_to_accumulator(
+                    tf.square(x) * dy, scope_decomp_indices, second_order_moment_num_accum)
+
+                return denom_grad, first_order_moment_num_grad, denom_grad, second_order_moment_num_grad
+
+            out = self.location_scale_distribution.gather(scope_decomp_indices).log_prob(x)
+
+            return out, grad
+
+        return _inner(self.first_order_moment_denom_accum, self.first_order_moment_num_accum,
+                      self.second_order_moment_denom_accum, self.second_order_moment_num_accum)
 
 
 class LocationEMGradWrapper:
@@ -101,3 +125,62 @@ class LocationEMGradWrapper:
 
         return _inner(self.first_order_moment_denom_accum, self.first_order_moment_num_accum)
 
+    def log_prob_observed(self, x, scope_decomp_indices):
+
+        @tf.custom_gradient
+        def _inner(first_order_moment_denom_accum, first_order_moment_num_accum):
+
+            def grad(dy):
+                denom_grad = _scatter_to_accumulator(dy, scope_decomp_indices, first_order_moment_denom_accum)
+                first_order_moment_num_grad = _scatter_to_accumulator(
+                    x * dy, scope_decomp_indices, first_order_moment_num_accum)
+
+                return denom_grad, first_order_moment_num_grad
+
+            out = self.location_scale_distribution.gather(scope_decomp_indices).log_prob(x)
+
+            return out, grad
+
+        return _inner(self.first_order_moment_denom_accum, self.first_order_moment_num_accum)
+
+
+def _scatter_to_accumulator(statistics, scope_decomp_indices, accumulator):
+    # Sums the statistics of a flat list of observed entries into an accumulator of shape
+    # [1, num_scopes, num_decomps, num_components, multivariate_size]
+    return tf.expand_dims(tf.scatter_nd(scope_decomp_indices, statistics, tf.shape(accumulator)[1:]), axis=0)
+
+
+def gather_log_probs_from_accumulators_with_em_grad(accumulator, indices, axis):
+    """
+    Gathers log probabilities from normalized accumulators and implements a custom gradient
+    that passes on the counts of the gathered entries to the accumulator. The counts are
+    accumulated with ``unsorted_segment_sum`` so that no dense one-hot representation of the
+    indices is needed.
+
+    Args:
+        accumulator: A ``Tensor`` holding the accumulator in linear space. Its last axis
+            corresponds to the gathered rows, i.e. it is of shape ``[..., num_values, num_rows]``
+        indices: A ``Tensor`` of int32 indices into the flattened leading dimensions of
+            ``accumulator``
+        axis: Axis to normalize the accumulator over
+
+    Returns:
+        A ``Tensor`` of shape ``indices.shape + [num_rows]`` holding the gathered normalized
+        log probabilities
+    """
+
+    @tf.custom_gradient
+    def _inner(accumulator):
+        num_rows = tf.shape(accumulator)[-1]
+        log_probs = tf.reshape(tf.nn.log_softmax(tf.math.log(accumulator), axis=axis), [-1, num_rows])
+
+        def grad(dy):
+            counts = tf.math.unsorted_segment_sum(
+                tf.reshape(dy, [-1, num_rows]), tf.reshape(indices, [-1]),
+                num_segments=tf.shape(log_probs)[0]
+            )
+            return tf.reshape(counts, tf.shape(accumulator))
+
+        return tf.gather(log_probs, indices), grad
+
+    return _inner(accumulator)
@@ -2,13 +2,23 @@ from tensorflow import keras
 from tensorflow.python.keras.engine import data_adapter
 
 from libspn_keras.layers.temporal_dense_product import TemporalDenseProduct
+from libspn_keras.layers.temporal_dense_product_sum import TemporalDenseProductSum
+from libspn_keras.mpe import temporal_most_probable_explanation
+from libspn_keras.queries import smoothed_marginals
 import tensorflow as tf
 
 
 class DynamicSumProductNetwork(keras.Model):
     """
     SPN that re-uses its nodes at each time step. The input is expected to be pre-padded sequences with a full tensor
-    shape of [num_batch, max_sequence_len, num_variables]
+    shape of [num_batch, max_sequence_len, num_variables] together with the sequence lengths, or a ``tf.RaggedTensor``
+    of shape [num_batch, (sequence_len), num_variables]. Only the timesteps of the longest sequence in a batch are
+    evaluated, so batching sequences of similar lengths (e.g. with
+    ``libspn_keras.utils.bucket_sequences_by_length``) avoids evaluating padded timesteps.
+
+    The template network and the interface network for t = t0 do not depend on previous timesteps, so they are
+    evaluated for all timesteps at once with the time axis folded into the batch axis. Only the interface network for
+    t = t0 - 1 is evaluated one timestep at a time.
 
     Args:
         template_network: Template network that is applied to the leaves and ends with nodes that cover all variables
@@ -22,10 +32,16 @@ class DynamicSumProductNetwork(keras.Model):
         return_last_step (bool): Whether to return only the roots at the last step with shape [num_batch, root_num_out]
             or whether to [num_batch, max_sequence_len, root_num_out]
         unsupervised (bool):
+        fuse_temporal_sums (bool): If ``True``, the first layers of ``interface_network_t_minus_1`` and
+            ``top_network`` are evaluated together with the temporal products by ``TemporalDenseProductSum`` layers,
+            so that the products of all pairs of interface nodes are not materialized at every timestep. These layers
+            must be ``DenseSum`` or ``RootSum`` layers. Layers that use hard EM still evaluate the products
+            explicitly. Queries that need the temporal products themselves, such as ``most_probable_explanation``
+            and ``smoothed_marginals``, still evaluate them explicitly.
     """
 
     def __init__(self, template_network, interface_network_t0, interface_network_t_minus_1, top_network,
-                 return_last_step=True, unsupervised=True, **kwargs):
+                 return_last_step=True, unsupervised=True, fuse_temporal_sums=False, **kwargs):
         super(DynamicSumProductNetwork, self).__init__(**kwargs)
         self.template_network = template_network
         self.unsupervised = unsupervised
@@ -34,11 +50,19 @@ class DynamicSumProductNetwork(keras.Model):
         self.interface_network_t_minus_1 = interface_network_t_minus_1
         self.return_last_step = return_last_step
         self.temporal_product = TemporalDenseProduct()
+        self.fuse_temporal_sums = fuse_temporal_sums
+        if fuse_temporal_sums:
+            self._fused_interface_sum = TemporalDenseProductSum(interface_network_t_minus_1.layers[0])
+            self._fused_top_sum = TemporalDenseProductSum(top_network.layers[0])
+
+    @staticmethod
+    def _model_inputs(x, sequence_lens):
+        return x if isinstance(x, tf.RaggedTensor) else [x, sequence_lens]
 
     def _train_step_unsupervised(self, data):
         x, sequence_lens, sample_weight = data_adapter.unpack_x_y_sample_weight(data)
         with tf.GradientTape() as tape:
-            out = self([x, sequence_lens], training=True)
+            out = self(self._model_inputs(x, sequence_lens), training=True)
             dummy_target = tf.stop_gradient(out)
             loss = self.compiled_loss(dummy_target, out, sample_weight, regularization_losses=self.losses)
 
@@ -51,7 +75,7 @@ class DynamicSumProductNetwork(keras.Model):
 
     def _test_step_unsupervised(self, data):
         x, sequence_lens, sample_weight = data_adapter.unpack_x_y_sample_weight(data)
-        out = self([x, sequence_lens], training=False)
+        out = self(self._model_inputs(x, sequence_lens), training=False)
         # Updates stateful loss metrics.
         dummy_target = tf.stop_gradient(out)
         self.compiled_loss(dummy_target, out, sample_weight, regularization_losses=self.losses)
@@ -61,38 +85,235 @@ class DynamicSumProductNetwork(keras.Model):
 
     @tf.function
     def call(self, input_data):
-        input_data, sequence_lens = input_data[0], input_data[1]
+        if self.fuse_temporal_sums:
+            step_masks, output, num_padded_steps = self._evaluate_fused(input_data)
+        else:
+            step_masks, _, interface_template_prods, num_padded_steps = self.evaluate_interfaces(input_data)
+            output = self._apply_to_all_steps(self.top_network, interface_template_prods)
+        num_steps = tf.shape(step_masks)[0]
+        output = tf.transpose(output * tf.expand_dims(step_masks, axis=2), [1, 0, 2])
+        if self.return_last_step:
+            return output[:, -1, :]
+        return tf.pad(output, [[0, 0], [num_padded_steps - num_steps, 0], [0, 0]])
+
+    def evaluate_interfaces(self, input_data):
+        """
+        Evaluates the network up to the temporal products of all timesteps. Leading timesteps that
+        are padding for all sequences are skipped.
+
+        Args:
+            input_data: Pre-padded sequences and their lengths or a ``tf.RaggedTensor``, as for
+                ``call``
+
+        Returns:
+            A tuple of the float mask of timesteps within the sequences of shape
+            ``[num_steps, num_batch]``, the output of the interface network for t = t0 of shape
+            ``[num_steps, num_batch, 1, 1, num_nodes_t0]``, the output of the temporal products of
+            shape ``[num_steps, num_batch, 1, 1, num_nodes_t_minus_1 * num_nodes_t0]`` and the
+            number of timesteps of the input including the skipped ones.
+        """
+        input_steps, step_masks, num_padded_steps = self.time_major_steps(input_data)
+        interface_t0, interface_template_prods = self.evaluate_steps(
+            input_steps, step_masks, self.initial_interface_state(tf.shape(step_masks)[1]))
+        return step_masks, interface_t0, interface_template_prods, num_padded_steps
+
+    def time_major_steps(self, input_data):
+        """
+        Converts the input of the network to a time-major tensor without the leading timesteps that
+        are padding for all sequences.
+
+        Args:
+            input_data: Pre-padded sequences and their lengths or a ``tf.RaggedTensor``, as for
+                ``call``
+
+        Returns:
+            A tuple of the timesteps of shape ``[num_steps, num_batch, num_variables]``, the float
+            mask of timesteps within the sequences of shape ``[num_steps, num_batch]`` and the
+            number of timesteps of the input including the skipped ones.
+        """
+        if isinstance(input_data, tf.RaggedTensor):
+            input_data, sequence_lens = _pre_pad(input_data), input_data.row_lengths()
+            num_padded_steps = tf.shape(input_data)[1]
+        else:
+            input_data, sequence_lens = input_data[0], input_data[1]
+            num_padded_steps = tf.shape(input_data)[1]
+            input_data = input_data[:, num_padded_steps - tf.reduce_max(tf.cast(sequence_lens, tf.int32)):]
         input_data = tf.transpose(input_data, [1, 0, 2])
-        outputs = tf.TensorArray(tf.float32, input_data.shape[0])
-
-        interface_network_t_minus_1_shape = tf.concat(
-            [[tf.shape(input_data)[1]], [1, 1, self.interface_network_t0.output_shape[-1]]], axis=0
-        )
-        interface_t_minus_1 = tf.zeros(interface_network_t_minus_1_shape)
-        for i in tf.range(input_data.shape[0]):
-            step_mask = tf.cast(
-                tf.greater_equal(i, tf.shape(input_data)[0] - tf.cast(sequence_lens, tf.int32)), tf.float32)
-            step_mask_flat = step_mask
-            step_mask = tf.reshape(
-                step_mask, tf.concat([[tf.shape(input_data)[1]], [1, 1, 1]], axis=0)
+        num_steps = tf.shape(input_data)[0]
+        step_masks = tf.cast(tf.greater_equal(
+            tf.range(num_steps)[:, tf.newaxis],
+            num_steps - tf.cast(sequence_lens, tf.int32)[tf.newaxis, :]
+        ), tf.float32)
+        return input_data, step_masks, num_padded_steps
+
+    def evaluate_steps(self, input_steps, step_masks, interface_t_minus_1):
+        """
+        Evaluates the network up to the temporal products of consecutive timesteps, starting from
+        the interface state of the preceding timestep.
+
+        Args:
+            input_steps: Timesteps of shape ``[num_steps, num_batch, num_variables]``
+            step_masks: Float mask of timesteps within the sequences of shape
+                ``[num_steps, num_batch]``
+            interface_t_minus_1: Interface state of the timestep preceding the first timestep, which is zero for
+                sequences that start at the first timestep
+
+        Returns:
+            A tuple of the output of the interface network for t = t0 of shape
+            ``[num_steps, num_batch, 1, 1, num_nodes_t0]`` and the output of the temporal products
+            of shape ``[num_steps, num_batch, 1, 1, num_nodes_t_minus_1 * num_nodes_t0]``.
+        """
+        step_masks_nodes = self._step_masks_nodes(step_masks)
+        interface_t0 = self._evaluate_interface_t0(input_steps, step_masks_nodes)
+        num_steps = tf.shape(input_steps)[0]
+
+        # The interface state is reset for the first timestep of a sequence rather than taken from the interface
+        # of a padded timestep, so that the interface sums of padded timesteps do not receive statistics
+        interface_template_prods = tf.TensorArray(tf.float32, num_steps)
+        for i in tf.range(num_steps):
+            interface_template_prod = self.temporal_product(
+                [interface_t_minus_1 * step_masks_nodes[i], interface_t0[i]]) * step_masks_nodes[i]
+            interface_template_prods = interface_template_prods.write(i, interface_template_prod)
+            interface_t_minus_1 = self.interface_network_t_minus_1(interface_template_prod) * step_masks_nodes[i]
+
+        return interface_t0, interface_template_prods.stack()
+
+    def _evaluate_fused(self, input_data):
+        """
+        Evaluates the network for all timesteps without materializing the temporal products.
+
+        Args:
+            input_data: Pre-padded sequences and their lengths or a ``tf.RaggedTensor``, as for
+                ``call``
+
+        Returns:
+            A tuple of the float mask of timesteps within the sequences of shape
+            ``[num_steps, num_batch]``, the output of the top network of shape
+            ``[num_steps, num_batch, root_num_out]`` and the number of timesteps of the input
+            including the skipped ones.
+        """
+        input_steps, step_masks, num_padded_steps = self.time_major_steps(input_data)
+        step_masks_nodes = self._step_masks_nodes(step_masks)
+        interface_t0 = self._evaluate_interface_t0(input_steps, step_masks_nodes)
+        num_steps = tf.shape(input_steps)[0]
+
+        # Only the interface states are kept for all timesteps, from which the top network is
+        # evaluated for all steps at once
+        interface_t_minus_1 = self.initial_interface_state(tf.shape(step_masks)[1])
+        interfaces_t_minus_1 = tf.TensorArray(tf.float32, num_steps)
+        for i in tf.range(num_steps):
+            interface_t_minus_1 *= step_masks_nodes[i]
+            interfaces_t_minus_1 = interfaces_t_minus_1.write(i, interface_t_minus_1)
+            interface_t_minus_1 = self._apply_fused(
+                self._fused_interface_sum, self.interface_network_t_minus_1,
+                [interface_t_minus_1, interface_t0[i]]) * step_masks_nodes[i]
+
+        output = self._apply_to_all_steps(
+            lambda x: self._apply_fused(self._fused_top_sum, self.top_network, x),
+            [interfaces_t_minus_1.stack(), interface_t0])
+        return step_masks, output, num_padded_steps
+
+    @staticmethod
+    def _apply_fused(fused_sum, network, x):
+        # The fused sum replaces the first layer of the network
+        out = fused_sum(x)
+        for layer in network.layers[1:]:
+            out = layer(out)
+        return out
+
+    @staticmethod
+    def _step_masks_nodes(step_masks):
+        return tf.reshape(step_masks, tf.concat([tf.shape(step_masks), [1, 1, 1]], axis=0))
+
+    def _evaluate_interface_t0(self, input_steps, step_masks_nodes):
+        # The template and interface networks at t0 do not depend on previous steps, so they are
+        # evaluated for all steps at once by folding the time axis into the batch axis
+        template_out = self._apply_to_all_steps(self.template_network, input_steps)
+        interface_t0 = self._apply_to_all_steps(self.interface_network_t0, template_out * step_masks_nodes)
+        return interface_t0 * step_masks_nodes
+
+    def initial_interface_state(self, num_batch):
+        """
+        Creates the interface state that precedes the first timestep of a sequence.
+
+        Args:
+            num_batch: Number of sequences
+
+        Returns:
+            A ``Tensor`` of zeros of shape ``[num_batch, 1, 1, num_interface_nodes]``
+        """
+        return tf.zeros(tf.stack([num_batch, 1, 1, self.interface_network_t0.output_shape[-1]]))
+
+    def filter_step(self, x, interface_t_minus_1):
+        """
+        Advances a batch of sequences by a single timestep, so that sequences can be scored online
+        at a constant cost per timestep rather than re-evaluating them from the first timestep.
+
+        Args:
+            x: Input at the current timestep of shape ``[num_batch, num_variables]``
+            interface_t_minus_1: Interface state of the previous timestep, as returned by a previous
+                call or by ``initial_interface_state`` for the first timestep of a sequence.
+
+        Returns:
+            A tuple of the log likelihood of the sequences up to and including the current timestep
+            of shape ``[num_batch, root_num_out]`` and the interface state for the next timestep.
+        """
+        interface_t0 = self.interface_network_t0(self.template_network(x))
+        if self.fuse_temporal_sums:
+            inputs = [interface_t_minus_1, interface_t0]
+            return (
+                self._apply_fused(self._fused_top_sum, self.top_network, inputs),
+                self._apply_fused(self._fused_interface_sum, self.interface_network_t_minus_1, inputs)
             )
+        interface_template_prod = self.temporal_product([interface_t_minus_1, interface_t0])
+        return self.top_network(interface_template_prod), self.interface_network_t_minus_1(interface_template_prod)
 
-            template_out = self.template_network(input_data[i]) * step_mask
+    def most_probable_explanation(self, x, sequence_lens, evidence_mask=None, return_interface_states=False):
+        """
+        Computes the most probable explanation of the variables that are not part of the evidence
+        for each sequence by Viterbi decoding. See
+        ``libspn_keras.mpe.temporal_most_probable_explanation``.
 
-            interface_t_minus_1 = interface_t_minus_1 * step_mask
+        Args:
+            x: Pre-padded sequences of shape ``[num_batch, max_sequence_len, num_variables]``
+            sequence_lens: Length of each sequence of shape ``[num_batch]``
+            evidence_mask: Boolean ``Tensor`` of the same shape as ``x`` that is ``True`` for
+                variables that are part of the evidence. If ``None``, none of the variables are
+                observed.
+            return_interface_states: If ``True``, also returns the selected node of the temporal
+                product at each timestep.
 
-            interface_t0 = self.interface_network_t0(template_out) * step_mask
-            interface_template_prod = self.temporal_product([interface_t_minus_1, interface_t0]) * step_mask
+        Returns:
+            A ``Tensor`` of the same shape as ``x`` holding the MPE assignment, and optionally the
+            selected interface states of shape ``[num_batch, max_sequence_len]``.
+        """
+        return temporal_most_probable_explanation(
+            self, x, sequence_lens, evidence_mask, return_interface_states=return_interface_states)
 
-            output = self.top_network(interface_template_prod) * tf.expand_dims(step_mask_flat, axis=1)
-            outputs = outputs.write(i, output)
+    def smoothed_marginals(self, x, sequence_lens, return_interface_posteriors=False):
+        """
+        Computes the conditional log probability of the variables of every timestep given all other
+        timesteps with a single forward pass and a single backward pass. See
+        ``libspn_keras.queries.smoothed_marginals``.
 
-            interface_t_minus_1 = self.interface_network_t_minus_1(interface_template_prod)
+        Args:
+            x: Pre-padded sequences of shape ``[num_batch, max_sequence_len, num_variables]``
+            sequence_lens: Length of each sequence of shape ``[num_batch]``
+            return_interface_posteriors: If ``True``, also returns the posterior log probability of
+                each node of the temporal product at every timestep.
 
-        output = tf.transpose(outputs.stack(), [1, 0, 2])
-        if self.return_last_step:
-            output = output[:, -1, :]
-        return output
+        Returns:
+            A ``Tensor`` of shape ``[num_batch, max_sequence_len]`` holding the smoothed
+            conditional log probabilities, and optionally the interface posteriors.
+        """
+        return smoothed_marginals(self, x, sequence_lens, return_interface_posteriors=return_interface_posteriors)
+
+    @staticmethod
+    def _apply_to_all_steps(network, x):
+        # [num_steps, num_batch, ...] -> [num_steps * num_batch, ...] and back for one or more inputs
+        out = network(tf.nest.map_structure(
+            lambda step_x: tf.reshape(step_x, tf.concat([[-1], tf.shape(step_x)[2:]], axis=0)), x))
+        return tf.reshape(out, tf.concat([tf.shape(tf.nest.flatten(x)[0])[:2], tf.shape(out)[1:]], axis=0))
 
     def train_step(self, data):
         if self.unsupervised:
@@ -106,3 +327,23 @@ class DynamicSumProductNetwork(keras.Model):
         else:
             return super(DynamicSumProductNetwork, self).test_step(data)
 
+
+def _pre_pad(x):
+    """
+    Converts ragged sequences to a dense tensor in which sequences are padded at the start.
+
+    Args:
+        x: ``tf.RaggedTensor`` of shape ``[num_batch, (sequence_len), num_variables]``
+
+    Returns:
+        A ``Tensor`` of shape ``[num_batch, max_sequence_len, num_variables]``
+    """
+    sequence_lens = x.row_lengths()
+    max_sequence_len = tf.reduce_max(sequence_lens)
+    rows = x.value_rowids()
+    steps = tf.range(tf.shape(rows, out_type=tf.int64)[0]) - tf.gather(x.row_starts(), rows)
+    padded_steps = steps + tf.gather(max_sequence_len - sequence_lens, rows)
+    return tf.scatter_nd(
+        tf.stack([rows, padded_steps], axis=1), x.values,
+        tf.stack([x.nrows(), max_sequence_len, tf.cast(tf.shape(x.values)[1], tf.int64)])
+    )
@@ -3,7 +3,10 @@ from tensorflow import keras
 from tensorflow.python.keras.engine import data_adapter
 from tensorflow.python.keras.engine.sequential import _get_shape_tuple, SINGLE_LAYER_OUTPUT_ERROR_MSG
 from tensorflow.python.util import nest
-from libspn_keras.layers import LocationScaleLeafBase, NormalizeStandardScore
+from libspn_keras.layers import LocationScaleLeafBase, NormalizeStandardScore, DenseSum, RootSum, Conv2DSum, \
+    Local2DSum, DenseProduct, ReduceProduct, Conv2DProduct, LogDropout, BaseLeaf
+from libspn_keras.queries import all_conditionals, conditional_log_prob
+from libspn_keras.utils.batch_size import find_batch_size
 
 
 class SequentialSumProductNetwork(keras.Sequential):
@@ -18,15 +21,36 @@ class SequentialSumProductNetwork(keras.Sequential):
             from ``infer_no_evidence``.
         infer_no_evidence (bool): If ``True``, the model expects an evidence mask defined as a boolean tensor which is
             used to mask out variables that are not part of the evidence.
+        checkpoint_products (bool): If ``True``, only the outputs of leaf and sum layers are kept for the backward
+            pass (or the EM pass). Product layers, whose outputs are typically the widest in the network, are
+            recomputed together with the sum layer that consumes them when computing gradients. This saves memory
+            for deep stacks of layers of similar sizes, such as spatial SPNs, at the cost of a second forward pass.
+            It does not help much when a single product layer dominates, e.g. the lowest layer of a RAT-SPN in which
+            the number of scopes halves at every layer, since that layer is recomputed in full.
+        scope_chunk_size (int): If not ``None``, consecutive ``DenseProduct``, ``ReduceProduct`` and ``DenseSum``
+            layers are evaluated for chunks of this many of their input scopes at a time. Since these layers only
+            combine neighbouring scopes, each chunk is passed through as many of them as long as it covers whole
+            output scopes before the next chunk is evaluated, so that the widest intermediate outputs are never
+            materialized for all scopes at once. Layers after that have few scopes and are evaluated as usual.
+            This caps the peak memory of the forward pass independently of the number of scopes. To also cap the
+            memory of the backward pass, combine it with ``checkpoint_products``, in which case every chunk is
+            recomputed when computing gradients.
     """
 
-    def __init__(self, *args, infer_no_evidence=False, unsupervised=None, **kwargs):
+    def __init__(self, *args, infer_no_evidence=False, unsupervised=None, checkpoint_products=False,
+                 scope_chunk_size=None, **kwargs):
         if unsupervised is None:
             unsupervised = False if infer_no_evidence else True
         super().__init__(*args, **kwargs)
         self.unsupervised = unsupervised
         if infer_no_evidence and unsupervised:
             raise ValueError("Model cannot be unsupervised when evidence should be inferred")
+        if infer_no_evidence and (checkpoint_products or scope_chunk_size is not None):
+            raise ValueError("Products cannot be checkpointed or chunked when evidence should be inferred")
+        self.checkpoint_products = checkpoint_products
+        self.scope_chunk_size = scope_chunk_size
+        if checkpoint_products or scope_chunk_size is not None:
+            self.call = self._call_segmented
         if infer_no_evidence:
             self._normalize_index = self._normalize_layer = None
             for i, layer in enumerate(self.layers):
@@ -43,6 +67,61 @@ class SequentialSumProductNetwork(keras.Sequential):
             self.call = self._call_backprop_to_leaves
             self.train_step = self._train_step_masked_leaves
 
+    def conditional_log_prob(self, x, evidence_mask, query_mask):
+        """
+        Computes the conditional log probability of the query variables given the evidence
+        variables in a single forward pass that shares the leaf evaluation between the numerator
+        and the denominator. See ``libspn_keras.queries.conditional_log_prob``.
+
+        Args:
+            x: Input of the model
+            evidence_mask: Boolean ``Tensor`` of the same shape as ``x`` that is ``True`` for
+                variables that are part of the evidence
+            query_mask: Boolean ``Tensor`` of the same shape as ``x`` that is ``True`` for
+                variables that are part of the query
+
+        Returns:
+            A ``Tensor`` of the same shape as the output of the model holding
+            :math:`\\log p(x_q \\mid x_e)`.
+        """
+        return conditional_log_prob(self, x, evidence_mask, query_mask)
+
+    def all_conditionals(self, x):
+        """
+        Computes the conditional log probability of every variable given all other variables
+        with a single upward pass and a single derivative pass. See
+        ``libspn_keras.queries.all_conditionals``.
+
+        Args:
+            x: Input of the model
+
+        Returns:
+            A ``Tensor`` of shape ``[batch, num_vars]`` holding :math:`\\log p(x_i \\mid x_{-i})`.
+        """
+        return all_conditionals(self, x)
+
+    def fit(self, x=None, y=None, batch_size=None, *args, memory_budget=None, **kwargs):
+        """
+        Trains the model like ``keras.Model.fit``. If ``batch_size`` is ``'auto'``, the largest batch
+        size of which a training step fits in ``memory_budget`` is used, which is found by probing
+        training steps at several batch sizes. See ``libspn_keras.utils.find_batch_size``.
+
+        Args:
+            x: Input data
+            y: Targets, if the model is not unsupervised
+            batch_size: Number of samples per batch or ``'auto'``
+            *args: Positional arguments of ``keras.Model.fit``
+            memory_budget: Peak memory in bytes that a training step may use on top of the memory that is
+                in use before it when ``batch_size`` is ``'auto'``
+            **kwargs: Keyword arguments of ``keras.Model.fit``
+
+        Returns:
+            A ``History`` object.
+        """
+        if batch_size == 'auto':
+            batch_size = find_batch_size(self, x, y, memory_budget=memory_budget)
+        return super(SequentialSumProductNetwork, self).fit(x, y, batch_size, *args, **kwargs)
+
     def _train_step_masked_leaves(self, data):
         x, evidence_mask, sample_weight = data_adapter.unpack_x_y_sample_weight(data)
         with tf.GradientTape() as tape:
@@ -79,6 +158,7 @@ class SequentialSumProductNetwork(keras.Sequential):
 
                 if i == self._leaf_index:
                     leaf_inputs = inputs
+                    kwargs['marginalize_mask'] = tf.logical_not(evidence_mask)
 
                 if i == self._normalize_index:
                     kwargs['return_stats'] = True
@@ -87,7 +167,7 @@ class SequentialSumProductNetwork(keras.Sequential):
                     outputs = layer(inputs, **kwargs)
 
                 if i == self._leaf_index:
-                    outputs = leaf_out = tf.where(evidence_mask, outputs, tf.zeros_like(outputs))
+                    leaf_out = outputs
                     tape.watch(leaf_out)
 
                 if len(nest.flatten(outputs)) != 1:
@@ -104,6 +184,34 @@ class SequentialSumProductNetwork(keras.Sequential):
 
         return outputs
 
+    def _call_segmented(self, inputs, training=None, mask=None):  # pylint: disable=redefined-outer-name
+        if self._build_input_shape is None:
+            input_shapes = nest.map_structure(_get_shape_tuple, inputs)
+            self._build_input_shape = input_shapes
+
+        def apply_segment(segment, segment_inputs):
+            outputs = segment_inputs
+            for layer in segment:
+                kwargs = {}
+                if 'training' in self._layer_call_argspecs[layer].args:
+                    kwargs['training'] = training
+                outputs = layer(outputs, **kwargs)
+            return outputs
+
+        outputs = inputs
+        for segment, checkpoint, chunked in _execution_segments(
+                self.layers, self.checkpoint_products, self.scope_chunk_size):
+            if chunked:
+                outputs = _evaluate_scope_chunks(segment, outputs, self.scope_chunk_size, recompute=checkpoint)
+            elif checkpoint:
+                # Binds the segment as a default argument, since the closure is called again when computing
+                # gradients
+                outputs = tf.recompute_grad(
+                    lambda segment_inputs, segment=segment: apply_segment(segment, segment_inputs))(outputs)
+            else:
+                outputs = apply_segment(segment, outputs)
+        return outputs
+
     def _train_step_unsupervised(self, data):
         x, sample_weight, _ = data_adapter.unpack_x_y_sample_weight(data)
         with tf.GradientTape() as tape:
@@ -139,3 +247,170 @@ class SequentialSumProductNetwork(keras.Sequential):
             return self._test_step_unsupervised(data)
         else:
             return super(SequentialSumProductNetwork, self).test_step(data)
+
+
+def _checkpoint_segments(layers):
+    """
+    Splits a stack of layers into segments that each end with a leaf or a sum layer. Segments that contain a
+    product layer are recomputed when computing gradients, so that only the output of their sum
+    layer is kept. Segments with layers that are stochastic during training, such as
+    ``LogDropout``, are not recomputed, since recomputing them would not give the same output.
+
+    Args:
+        layers: List of layers
+
+    Returns:
+        A list of tuples of a list of layers and whether the segment is recomputed.
+    """
+    segments, segment = [], []
+    for layer in layers:
+        segment.append(layer)
+        if isinstance(layer, (BaseLeaf, DenseSum, RootSum, Conv2DSum, Local2DSum)):
+            segments.append(segment)
+            segment = []
+    if segment:
+        segments.append(segment)
+    return [
+        (segment, any(isinstance(layer, (DenseProduct, ReduceProduct, Conv2DProduct)) for layer in segment)
+         and not any(isinstance(layer, LogDropout) for layer in segment))
+        for segment in segments
+    ]
+
+
+def _execution_segments(layers, checkpoint_products, scope_chunk_size):
+    """
+    Splits a stack of layers into segments that are evaluated in chunks of scopes, recomputed when
+    computing gradients, or evaluated as usual.
+
+    Args:
+        layers: List of layers
+        checkpoint_products: Whether segments with product layers are recomputed
+        scope_chunk_size: Number of output scopes per chunk or ``None`` if scopes are not chunked
+
+    Returns:
+        A list of tuples of a list of layers, whether the segment is recomputed and whether it is
+        evaluated in chunks of scopes.
+    """
+    segments = []
+    for group, scope_aligned in _scope_aligned_groups(layers, scope_chunk_size):
+        if scope_aligned:
+            # Layers can be evaluated per chunk as long as chunks cover whole output scopes
+            num_chunked, num_scopes_in_per_scope_out = 0, 1
+            for layer in group:
+                if isinstance(layer, (DenseProduct, ReduceProduct)):
+                    num_scopes_in_per_scope_out *= layer.num_factors
+                    if scope_chunk_size % num_scopes_in_per_scope_out != 0:
+                        break
+                num_chunked += 1
+            if any(isinstance(layer, (DenseProduct, ReduceProduct)) for layer in group[:num_chunked]):
+                segments.append((group[:num_chunked], checkpoint_products, True))
+                group = group[num_chunked:]
+            if not group:
+                continue
+        if checkpoint_products:
+            segments.extend((segment, checkpoint, False) for segment, checkpoint in _checkpoint_segments(group))
+        else:
+            segments.append((group, False, False))
+    return segments
+
+
+def _scope_aligned_groups(layers, scope_chunk_size):
+    """
+    Groups consecutive layers by whether they can be evaluated in chunks of scopes.
+
+    Args:
+        layers: List of layers
+        scope_chunk_size: Number of output scopes per chunk or ``None`` if scopes are not chunked
+
+    Returns:
+        A list of tuples of a list of layers and whether the layers are ``DenseProduct``,
+        ``ReduceProduct`` or ``DenseSum`` layers that can be evaluated in chunks of scopes.
+    """
+    groups = []
+    for layer in layers:
+        scope_aligned = scope_chunk_size is not None and isinstance(layer, (DenseProduct, ReduceProduct, DenseSum))
+        if groups and groups[-1][1] == scope_aligned:
+            groups[-1][0].append(layer)
+        else:
+            groups.append(([layer], scope_aligned))
+    return groups
+
+
+def _evaluate_scope_chunks(layers, x, chunk_size, recompute=False):
+    """
+    Evaluates consecutive ``DenseProduct``, ``ReduceProduct`` and ``DenseSum`` layers for chunks of
+    their output scopes at a time. Output scope ``s`` of a product with ``num_factors`` factors
+    only depends on input scopes ``s * num_factors`` up to ``(s + 1) * num_factors``, so a chunk of
+    output scopes depends on a contiguous range of input scopes.
+
+    Args:
+        layers: List of built ``DenseProduct``, ``ReduceProduct`` and ``DenseSum`` layers
+        x: Input of the first layer of shape [num_batch, num_scopes, num_decomps, num_nodes]
+        chunk_size: Number of input scopes of the first layer per chunk, which is a multiple of the
+            number of input scopes per output scope of the final layer
+        recompute: Whether to recompute each chunk when computing gradients rather than keeping
+            its intermediate outputs
+
+    Returns:
+        The output of the final layer
+    """
+    # Number of input scopes of each layer per output scope of the final layer
+    scopes_per_output_scope = [1] * (len(layers) + 1)
+    for i in reversed(range(len(layers))):
+        num_factors = layers[i].num_factors if isinstance(layers[i], (DenseProduct, ReduceProduct)) else 1
+        scopes_per_output_scope[i] = scopes_per_output_scope[i + 1] * num_factors
+    num_scopes_out = x.shape[1] // scopes_per_output_scope[0]
+    chunk_size //= scopes_per_output_scope[0]
+    num_chunks = (num_scopes_out + chunk_size - 1) // chunk_size
+
+    def evaluate_chunk(chunk_start, chunk_x):
+        out = chunk_x
+        for layer, num_scopes in zip(layers, scopes_per_output_scope):
+            out = _evaluate_scopes(layer, out, chunk_start * num_scopes)
+        return out
+
+    # Chunks are concatenated along the scope axis, which is moved to the front since TensorArrays
+    # concatenate along the first axis
+    chunks = tf.TensorArray(x.dtype, size=num_chunks, infer_shape=False)
+    for i in tf.range(num_chunks):
+        chunk_start = i * chunk_size
+        chunk_end = tf.minimum(chunk_start + chunk_size, num_scopes_out)
+        chunk_x = x[:, chunk_start * scopes_per_output_scope[0]:chunk_end * scopes_per_output_scope[0]]
+        if recompute:
+            # Binds the chunk start as a default argument, since the closure is called again when
+            # computing gradients
+            chunk_out = tf.recompute_grad(
+                lambda inputs, chunk_start=chunk_start: evaluate_chunk(chunk_start, inputs))(chunk_x)
+        else:
+            chunk_out = evaluate_chunk(chunk_start, chunk_x)
+        chunks = chunks.write(i, tf.transpose(chunk_out, (1, 0, 2, 3)))
+    out = tf.transpose(chunks.concat(), (1, 0, 2, 3))
+    return tf.reshape(out, [-1] + list(layers[-1].output_shape[1:]))
+
+
+def _evaluate_scopes(layer, x, scope_start):
+    """
+    Evaluates a layer for a contiguous range of its output scopes.
+
+    Args:
+        layer: A built ``DenseProduct``, ``ReduceProduct`` or ``DenseSum`` layer
+        x: The input scopes that the range of output scopes depends on, of shape
+            [num_batch, num_scopes_in_range, num_decomps, num_nodes]
+        scope_start: Index of the first input scope in ``x``
+
+    Returns:
+        A ``Tensor`` of shape [num_batch, num_scopes_out_range, num_decomps, num_nodes_out]
+    """
+    if isinstance(layer, DenseSum):
+        return layer.call_with_accumulators(x, layer._accumulators[scope_start:scope_start + tf.shape(x)[1]])
+    num_batch, num_factors = tf.shape(x)[0], layer.num_factors
+    num_decomps, num_nodes_in = x.shape[2], x.shape[3]
+    factors = tf.reshape(x, [num_batch, -1, num_factors, num_decomps, num_nodes_in])
+    if isinstance(layer, ReduceProduct):
+        return tf.reduce_sum(factors, axis=2)
+    # Factor 0 varies slowest along the products, as in DenseProduct
+    outer_sum = 0.0
+    for f in range(num_factors):
+        outer_sum += tf.reshape(factors[:, :, f], [num_batch, -1, num_decomps] + [
+            num_nodes_in if j == f else 1 for j in range(num_factors)])
+    return tf.reshape(outer_sum, [num_batch, -1, num_decomps, num_nodes_in ** num_factors])
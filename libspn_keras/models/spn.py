@@ -1,6 +1,8 @@
 from tensorflow import keras
 from tensorflow.python.keras.engine import data_adapter
 import tensorflow as tf
+from libspn_keras.queries import all_conditionals, conditional_log_prob
+from libspn_keras.utils.batch_size import find_batch_size
 
 
 class SumProductNetwork(keras.Model):
@@ -17,6 +19,61 @@ class SumProductNetwork(keras.Model):
         super().__init__(*args, **kwargs)
         self.unsupervised = unsupervised
 
+    def conditional_log_prob(self, x, evidence_mask, query_mask):
+        """
+        Computes the conditional log probability of the query variables given the evidence
+        variables in a single forward pass that shares the leaf evaluation between the numerator
+        and the denominator. See ``libspn_keras.queries.conditional_log_prob``.
+
+        Args:
+            x: Input of the model
+            evidence_mask: Boolean ``Tensor`` of the same shape as ``x`` that is ``True`` for
+                variables that are part of the evidence
+            query_mask: Boolean ``Tensor`` of the same shape as ``x`` that is ``True`` for
+                variables that are part of the query
+
+        Returns:
+            A ``Tensor`` of the same shape as the output of the model holding
+            :math:`\\log p(x_q \\mid x_e)`.
+        """
+        return conditional_log_prob(self, x, evidence_mask, query_mask)
+
+    def all_conditionals(self, x):
+        """
+        Computes the conditional log probability of every variable given all other variables
+        with a single upward pass and a single derivative pass. See
+        ``libspn_keras.queries.all_conditionals``.
+
+        Args:
+            x: Input of the model
+
+        Returns:
+            A ``Tensor`` of shape ``[batch, num_vars]`` holding :math:`\\log p(x_i \\mid x_{-i})`.
+        """
+        return all_conditionals(self, x)
+
+    def fit(self, x=None, y=None, batch_size=None, *args, memory_budget=None, **kwargs):
+        """
+        Trains the model like ``keras.Model.fit``. If ``batch_size`` is ``'auto'``, the largest batch
+        size of which a training step fits in ``memory_budget`` is used, which is found by probing
+        training steps at several batch sizes. See ``libspn_keras.utils.find_batch_size``.
+
+        Args:
+            x: Input data
+            y: Targets, if the model is not unsupervised
+            batch_size: Number of samples per batch or ``'auto'``
+            *args: Positional arguments of ``keras.Model.fit``
+            memory_budget: Peak memory in bytes that a training step may use on top of the memory that is
+                in use before it when ``batch_size`` is ``'auto'``
+            **kwargs: Keyword arguments of ``keras.Model.fit``
+
+        Returns:
+            A ``History`` object.
+        """
+        if batch_size == 'auto':
+            batch_size = find_batch_size(self, x, y, memory_budget=memory_budget)
+        return super(SumProductNetwork, self).fit(x, y, batch_size, *args, **kwargs)
+
     def _train_step_unsupervised(self, data):
         x, sample_weight, _ = data_adapter.unpack_x_y_sample_weight(data)
         with tf.GradientTape() as tape:
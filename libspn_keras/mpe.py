@@ -0,0 +1,240 @@
+import tensorflow as tf
+
+from libspn_keras import topdown
+
+
+def most_probable_explanation(model, x, evidence_mask=None):
+    """
+    Computes the most probable explanation (MPE) of the variables that are not part of the
+    evidence. The SPN is evaluated with a max-product upward pass in which sums store the index
+    of their maximizing child. A top-down pass then follows the maximizing children from the root
+    to the leaves and fills in the modes of the selected leaf components.
+
+    Supports sequential SPNs that consist of an optional ``NormalizeStandardScore``, a
+    ``FlatToRegions`` layer, a leaf layer and ``PermuteAndPadScopes``, ``DenseProduct``,
+    ``ReduceProduct``, ``DenseSum``, ``Undecompose``, ``LogDropout`` and ``RootSum`` layers, such as
+    the ones built by ``region_graph_to_dense_spn``. Spatial SPNs (DGC-SPNs) that consist of a
+    leaf layer and ``Conv2DProduct``, ``Local2DSum``, ``Conv2DSum`` and ``SpatialToRegions`` layers
+    followed by dense layers are supported as well, which allows for inpainting images without
+    automatic differentiation.
+
+    Args:
+        model: A ``keras.Sequential`` SPN
+        x: Input of the model. Values of variables that are not part of the evidence are ignored.
+        evidence_mask: Boolean ``Tensor`` of the same shape as ``x`` that is ``True`` for variables
+            that are part of the evidence. If ``None``, none of the variables are observed.
+
+    Returns:
+        A ``Tensor`` of the same shape as ``x`` in which the variables that are not part of the
+        evidence are replaced by their MPE assignment.
+    """
+    x = tf.convert_to_tensor(x)
+    pre_leaf_layers, leaf, post_leaf_layers = topdown.split_at_leaf(model)
+    leaf_input, leaf_evidence_mask, to_input_space = topdown.to_leaf_inputs(
+        pre_leaf_layers, x, evidence_mask)
+
+    out = _max_product_leaf(leaf, leaf_input, leaf_evidence_mask)
+    out, child_indices_per_layer = _max_product_upward(post_leaf_layers, out)
+    selection = _select_downward(post_leaf_layers, child_indices_per_layer, topdown.select_top(out))
+
+    values = topdown.leaf_values_from_selection(
+        leaf, selection, leaf.get_modes(), decomposed=not topdown.is_spatial(post_leaf_layers))
+    values = to_input_space(tf.cast(values, x.dtype))
+    if evidence_mask is None:
+        return values
+    return tf.where(evidence_mask, x, values)
+
+
+def temporal_most_probable_explanation(
+        dynamic_spn, x, sequence_lens, evidence_mask=None, return_interface_states=False):
+    """
+    Computes the most probable explanation (MPE) of the variables that are not part of the
+    evidence for each sequence of a batch with a ``DynamicSumProductNetwork``, i.e. Viterbi
+    decoding. A max-product pass over the timesteps stores the index of the maximizing child of
+    each interface sum per timestep. A backward pass then follows the maximizing children from the
+    root at the last timestep through the temporal products and interface networks to the first
+    timestep. Finally, the selected nodes of the template network are followed to the leaves.
+
+    The template network and the interface network for t = t0 do not depend on other timesteps,
+    so they are evaluated for all timesteps at once. Only the back-pointers of the interface sums
+    are kept per timestep, so that the memory of the recursion is linear in the sequence length
+    times the width of the interface.
+
+    Args:
+        dynamic_spn: A ``DynamicSumProductNetwork`` whose template network is a sequential SPN
+            that is supported by ``most_probable_explanation``
+        x: Pre-padded sequences of shape ``[num_batch, max_sequence_len, num_variables]``. Values of
+            variables that are not part of the evidence are ignored.
+        sequence_lens: Length of each sequence of shape ``[num_batch]``
+        evidence_mask: Boolean ``Tensor`` of the same shape as ``x`` that is ``True`` for variables
+            that are part of the evidence. If ``None``, none of the variables are observed.
+        return_interface_states: If ``True``, also returns the selected node of the temporal
+            product at each timestep.
+
+    Returns:
+        A ``Tensor`` of the same shape as ``x`` in which the variables that are not part of the
+        evidence are replaced by their MPE assignment, leaving padded timesteps untouched. If
+        ``return_interface_states`` is ``True``, a tuple of that and an int32 ``Tensor`` of shape
+        ``[num_batch, max_sequence_len]`` holding the selected node of the temporal product at each
+        timestep, which is ``a * num_nodes_t0 + b`` for node ``a`` of the interface of the
+        previous timestep and node ``b`` of the interface network for t = t0. Padded timesteps
+        hold -1.
+    """
+    x = tf.convert_to_tensor(x)
+    sequence_lens = tf.cast(sequence_lens, tf.int32)
+    num_padded_steps, num_vars = tf.shape(x)[1], tf.shape(x)[2]
+    num_steps, num_batch = tf.reduce_max(sequence_lens), tf.shape(x)[0]
+
+    # [num_steps, num_batch, num_vars] skipping leading timesteps that are padding for all sequences
+    x_steps = tf.transpose(x[:, num_padded_steps - num_steps:], [1, 0, 2])
+    evidence_steps = None if evidence_mask is None else \
+        tf.transpose(tf.convert_to_tensor(evidence_mask)[:, num_padded_steps - num_steps:], [1, 0, 2])
+    step_masks = tf.greater_equal(tf.range(num_steps)[:, tf.newaxis], num_steps - sequence_lens[tf.newaxis, :])
+    step_masks_nodes = tf.reshape(tf.cast(step_masks, tf.float32), [num_steps, num_batch, 1, 1, 1])
+
+    # Max-product pass of the template network and the interface network for t = t0 for all
+    # timesteps at once, with the time axis folded into the batch axis
+    pre_leaf_layers, leaf, post_leaf_layers = topdown.split_at_leaf(dynamic_spn.template_network)
+    step_layers = post_leaf_layers + dynamic_spn.interface_network_t0.layers
+    leaf_input, leaf_evidence_mask, to_input_space = topdown.to_leaf_inputs(
+        pre_leaf_layers, tf.reshape(x_steps, [-1, num_vars]),
+        None if evidence_steps is None else tf.reshape(evidence_steps, [-1, num_vars]))
+    out = _max_product_leaf(leaf, leaf_input, leaf_evidence_mask)
+    interface_t0, step_child_indices = _max_product_upward(step_layers, out)
+    interface_t0 = tf.reshape(interface_t0, tf.concat([[num_steps, num_batch], tf.shape(interface_t0)[1:]], axis=0))
+    interface_t0 *= step_masks_nodes
+
+    # Max-product recursion over the timesteps. The interface of a padded timestep is reset to
+    # zeros as in the sum-product pass, in which the padded interface sums to zero anyway
+    interface_layers = dynamic_spn.interface_network_t_minus_1.layers
+    interface_sum_layers = [layer for layer in interface_layers if topdown.is_sum(layer)]
+    interface_child_indices = [
+        tf.TensorArray(topdown.compact_index_dtype(topdown.normalized_log_weights(layer).shape[2]), num_steps)
+        for layer in interface_sum_layers
+    ]
+    interface_t_minus_1 = dynamic_spn.initial_interface_state(num_batch)
+    interface_template_prod = dynamic_spn.temporal_product([interface_t_minus_1, interface_t0[0]])
+    for i in tf.range(num_steps):
+        interface_template_prod = dynamic_spn.temporal_product(
+            [interface_t_minus_1, interface_t0[i]]) * step_masks_nodes[i]
+        interface_t_minus_1, child_indices_per_layer = _max_product_upward(interface_layers, interface_template_prod)
+        interface_t_minus_1 *= step_masks_nodes[i]
+        interface_child_indices = [
+            array.write(i, child_indices) for array, child_indices in zip(
+                interface_child_indices, filter(lambda indices: indices is not None, child_indices_per_layer))
+        ]
+    interface_child_indices = iter([array.stack() for array in interface_child_indices])
+    interface_child_indices = [
+        next(interface_child_indices) if topdown.is_sum(layer) else None for layer in interface_layers]
+
+    # Backward pass from the root at the last timestep
+    top_layers = dynamic_spn.top_network.layers
+    out, top_child_indices = _max_product_upward(top_layers, interface_template_prod)
+    selection = _select_downward(top_layers, top_child_indices, topdown.select_top(out))
+    num_nodes_t0 = dynamic_spn.interface_network_t0.output_shape[-1]
+    selections = tf.TensorArray(tf.int32, num_steps)
+    for i in tf.range(num_steps - 1, -1, -1):
+        selections = selections.write(i, selection)
+        selection = _select_downward(
+            interface_layers, [None if indices is None else indices[i - 1] for indices in interface_child_indices],
+            selection // num_nodes_t0)
+    selections = selections.stack()
+
+    # Follow the selected nodes of the interface network for t = t0 to the leaves
+    selection = _select_downward(
+        step_layers, step_child_indices, tf.reshape(selections % num_nodes_t0, [-1, 1, 1]))
+    values = topdown.leaf_values_from_selection(leaf, selection, leaf.get_modes())
+    values = tf.reshape(to_input_space(tf.cast(values, x.dtype)), tf.shape(x_steps))
+    values = tf.where(step_masks[..., tf.newaxis], values, x_steps)
+    if evidence_steps is not None:
+        values = tf.where(evidence_steps, x_steps, values)
+
+    num_skipped_steps = num_padded_steps - num_steps
+    values = tf.concat([x[:, :num_skipped_steps], tf.transpose(values, [1, 0, 2])], axis=1)
+    if not return_interface_states:
+        return values
+    interface_states = tf.where(step_masks, tf.reshape(selections, [num_steps, num_batch]), topdown.UNSELECTED)
+    interface_states = tf.pad(
+        tf.transpose(interface_states), [[0, 0], [num_skipped_steps, 0]], constant_values=topdown.UNSELECTED)
+    return values, interface_states
+
+
+def _max_product_leaf(leaf, leaf_input, leaf_evidence_mask):
+    # Variables that are not part of the evidence are maximized out, so their leaf components
+    # take on the log probability at their modes
+    mode_log_probs = leaf.get_mode_log_probs()
+    if leaf_evidence_mask is None:
+        return tf.broadcast_to(
+            mode_log_probs, tf.concat([tf.shape(leaf_input)[:1], tf.shape(mode_log_probs)[1:]], axis=0))
+    marginalize_mask = tf.logical_not(leaf_evidence_mask)
+    out = leaf(leaf_input, marginalize_mask=marginalize_mask)
+    return out + tf.where(marginalize_mask, mode_log_probs, tf.zeros_like(out))
+
+
+def _max_product_upward(layers, x):
+    """
+    Evaluates layers with a max-product upward pass.
+
+    Args:
+        layers: Layers to evaluate
+        x: Input of the first layer
+
+    Returns:
+        A tuple of the output of the final layer and a list with the index of the maximizing
+        child of each sum per layer, which is ``None`` for layers without sums.
+    """
+    child_indices_per_layer = []
+    for layer in layers:
+        if topdown.is_sum(layer):
+            x, child_indices = _max_product_sum(x, topdown.normalized_log_weights(layer))
+        else:
+            x, child_indices = layer(x), None
+        child_indices_per_layer.append(child_indices)
+    return x, child_indices_per_layer
+
+
+def _select_downward(layers, child_indices_per_layer, selection):
+    """
+    Follows the maximizing children of a max-product upward pass from the output of the final
+    layer to the input of the first layer.
+
+    Args:
+        layers: Layers that were evaluated by ``_max_product_upward``
+        child_indices_per_layer: Maximizing children per layer as returned by
+            ``_max_product_upward``
+        selection: Selection of the output of the final layer
+
+    Returns:
+        Selection of the input of the first layer
+    """
+    for layer, child_indices in zip(reversed(layers), reversed(child_indices_per_layer)):
+        if child_indices is not None:
+            selection = topdown.select_children_of_sums(selection, child_indices)
+        else:
+            selection = topdown.route_to_children(layer, selection)
+    return selection
+
+
+def _max_product_sum(x, log_weights):
+    """
+    Computes the maximum of weighted children per sum.
+
+    Args:
+        x: Input of shape ``[batch, num_scopes, num_decomps, num_nodes_in]``
+        log_weights: Normalized log weights of shape ``[num_scopes, num_decomps, num_nodes_in,
+            num_sums]``
+
+    Returns:
+        A tuple of the maximum of shape ``[batch, num_scopes, num_decomps, num_sums]`` and the
+        index of the maximizing child of the same shape, stored as int8 or int16 when possible.
+    """
+    # Sums are evaluated one at a time, so that the weighted children never take more memory
+    # than the input itself
+    index_dtype = topdown.compact_index_dtype(log_weights.shape[2])
+    max_weighted_child, child_indices = [], []
+    for log_weights_of_sum in tf.unstack(log_weights, axis=-1):
+        weighted_children = x + log_weights_of_sum
+        indices = tf.argmax(weighted_children, axis=-1, output_type=tf.int32)
+        max_weighted_child.append(tf.gather(weighted_children, indices, batch_dims=3))
+        child_indices.append(tf.cast(indices, index_dtype))
+    return tf.stack(max_weighted_child, axis=-1), tf.stack(child_indices, axis=-1)
@@ -0,0 +1,305 @@
+import time
+from collections import namedtuple
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+from libspn_keras.backprop_mode import BackpropMode
+from libspn_keras.layers import DenseSum, Conv2DSum, Local2DSum, RootSum
+
+LayerProfile = namedtuple(
+    "LayerProfile", ["name", "output_shape", "forward_time", "backward_time", "neg_inf_fraction",
+                     "dynamic_range", "tie_fraction"])
+LayerProfile.__doc__ = """
+Timings and activation statistics of a single layer for a batch of inputs.
+
+Args:
+    name: Name of the layer
+    output_shape: Shape of the output of the layer, including the batch axis
+    forward_time: Median time in seconds of evaluating the layer, or ``None`` if timers are
+        disabled
+    backward_time: Median time in seconds of computing the gradients (or EM statistics) of the
+        layer with respect to its input and its weights given an upstream gradient, or ``None``
+        if timers are disabled or the layer has nothing to differentiate
+    neg_inf_fraction: Fraction of the outputs that are :math:`-\\infty`
+    dynamic_range: Difference between the largest and the smallest finite outputs, i.e. the
+        logarithm of the ratio of the largest and the smallest nonzero probabilities
+    tie_fraction: Fraction of the sums of which more than one child attains the maximum that
+        selects the winning child in the backward pass of hard EM, in which case a winner is
+        sampled among the tied children. ``None`` if the layer does not use hard EM.
+"""
+
+
+class ProfileSummary:
+    """
+    Per-layer timings and activation statistics of an SPN. See ``profile_layers``.
+
+    Args:
+        layer_profiles: List of ``LayerProfile`` per layer
+    """
+
+    def __init__(self, layer_profiles):
+        self.layer_profiles = layer_profiles
+
+    @property
+    def forward_time(self):
+        """ Total time in seconds of evaluating all layers, or ``None`` if timers are disabled """
+        return _total([profile.forward_time for profile in self.layer_profiles])
+
+    @property
+    def backward_time(self):
+        """ Total time in seconds of the backward passes of all layers, or ``None`` if timers are disabled """
+        return _total([profile.backward_time for profile in self.layer_profiles])
+
+    def __str__(self):
+        rows = [("Layer", "Output shape", "Forward", "Backward", "-inf", "Range", "Ties")]
+        for profile in self.layer_profiles:
+            rows.append((
+                profile.name, str(profile.output_shape), _format_time(profile.forward_time),
+                _format_time(profile.backward_time), _format_fraction(profile.neg_inf_fraction),
+                "{:.1f}".format(profile.dynamic_range), _format_fraction(profile.tie_fraction)
+            ))
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        lines = ["  ".join(value.ljust(width) for value, width in zip(row, widths)) for row in rows]
+        lines.insert(1, "-" * len(lines[0]))
+        lines += [
+            "-" * len(lines[0]),
+            "Forward time: {}".format(_format_time(self.forward_time)),
+            "Backward time: {}".format(_format_time(self.backward_time)),
+        ]
+        return "\n".join(lines)
+
+
+def profile_layers(model, x, timers=True, num_repeats=10):
+    """
+    Profiles each layer of a sequential SPN separately for a batch of inputs. Every layer is
+    evaluated in its own ``tf.function`` within a name scope named after the layer, so that
+    timings are attributed to single layers. The backward pass of each layer is timed with an
+    upstream gradient of ones, which accounts for the selection of winning children of sums that
+    use hard EM. Besides timings, statistics of the outputs of each layer are collected that
+    help to diagnose numerical issues, such as the fraction of :math:`-\\infty` outputs, the
+    dynamic range of the log probabilities and the fraction of ties among the children of sums
+    that use hard EM.
+
+    Args:
+        model: A built ``keras.Sequential`` SPN
+        x: A batch of inputs of the model
+        timers: If ``True``, the forward and backward passes of each layer are timed on the host
+        num_repeats: Number of times each pass is timed, of which the median is reported
+
+    Returns:
+        A ``ProfileSummary``, which can be printed as a table.
+
+    Raises:
+        NotImplementedError: If the model is not a ``keras.Sequential`` model.
+    """
+    if not isinstance(model, keras.Sequential):
+        raise NotImplementedError("Only sequential models can be profiled per layer")
+    layer_profiles = []
+    for layer in model.layers:
+        with tf.name_scope(layer.name):
+            out = layer(x)
+            forward_time = backward_time = None
+            if timers:
+                forward_time, backward_time = _time_layer(layer, x, num_repeats)
+            neg_inf_fraction, dynamic_range = _log_value_statistics(out)
+            tie_fraction = _tie_fraction(layer, x)
+        layer_profiles.append(LayerProfile(
+            name=layer.name, output_shape=tuple(out.shape), forward_time=forward_time, backward_time=backward_time,
+            neg_inf_fraction=neg_inf_fraction, dynamic_range=dynamic_range, tie_fraction=tie_fraction
+        ))
+        x = out
+    return ProfileSummary(layer_profiles)
+
+
+class LayerProfiler(keras.callbacks.Callback):
+    """
+    Callback that profiles the layers of a sequential SPN during training. Layers are profiled
+    on a fixed batch of inputs with ``profile_layers`` at the end of every epoch or every
+    ``profile_every_n_batches`` batches. If ``log_dir`` is given, the timings and activation
+    statistics of each layer are written to TensorBoard as scalars, and the training steps of
+    ``trace_batches`` are recorded with the TensorFlow profiler, in which the operations of the
+    forward and backward passes are grouped by the name scopes of the layers.
+
+    Args:
+        x: A batch of inputs to profile the layers with
+        log_dir: Directory to write TensorBoard summaries and profile traces to, or ``None``
+        profile_every_n_batches: If not ``None``, layers are profiled every this many batches
+            rather than at the end of every epoch
+        trace_batches: Tuple of the first and the last batch (counted from the start of training)
+            of which the training steps are traced with the TensorFlow profiler. Requires
+            ``log_dir``.
+        timers: If ``True``, the forward and backward passes of each layer are timed
+        num_repeats: Number of times each pass is timed, of which the median is reported
+        verbose: If ``True``, the last profile is printed at the end of training
+
+    Attributes:
+        summaries: List of tuples of the batch (counted from the start of training) and the
+            ``ProfileSummary`` of every time the layers were profiled
+    """
+
+    def __init__(self, x, log_dir=None, profile_every_n_batches=None, trace_batches=None, timers=True,
+                 num_repeats=10, verbose=True):
+        super(LayerProfiler, self).__init__()
+        if trace_batches is not None and log_dir is None:
+            raise ValueError("Tracing batches requires a log_dir")
+        self.x = x
+        self.log_dir = log_dir
+        self.profile_every_n_batches = profile_every_n_batches
+        self.trace_batches = trace_batches
+        self.timers = timers
+        self.num_repeats = num_repeats
+        self.verbose = verbose
+        self.summaries = []
+        self._writer = None
+        self._num_batches = 0
+
+    def on_train_begin(self, logs=None):
+        if self.log_dir is not None:
+            self._writer = tf.summary.create_file_writer(self.log_dir)
+
+    def on_train_batch_begin(self, batch, logs=None):
+        if self.trace_batches is not None and self._num_batches == self.trace_batches[0]:
+            tf.profiler.experimental.start(self.log_dir)
+
+    def on_train_batch_end(self, batch, logs=None):
+        if self.trace_batches is not None and self._num_batches == self.trace_batches[1]:
+            tf.profiler.experimental.stop()
+        self._num_batches += 1
+        if self.profile_every_n_batches is not None and self._num_batches % self.profile_every_n_batches == 0:
+            self._profile()
+
+    def on_epoch_end(self, epoch, logs=None):
+        if self.profile_every_n_batches is None:
+            self._profile()
+
+    def on_train_end(self, logs=None):
+        if self.trace_batches is not None and self.trace_batches[0] < self._num_batches <= self.trace_batches[1]:
+            tf.profiler.experimental.stop()
+        if self._writer is not None:
+            self._writer.close()
+        if self.verbose and self.summaries:
+            print(self.summaries[-1][1])
+
+    def _profile(self):
+        summary = profile_layers(self.model, self.x, timers=self.timers, num_repeats=self.num_repeats)
+        self.summaries.append((self._num_batches, summary))
+        if self._writer is None:
+            return
+        with self._writer.as_default():
+            for profile in summary.layer_profiles:
+                for statistic in ["forward_time", "backward_time", "neg_inf_fraction", "dynamic_range",
+                                  "tie_fraction"]:
+                    value = getattr(profile, statistic)
+                    if value is not None:
+                        tf.summary.scalar("{}/{}".format(profile.name, statistic), value, step=self._num_batches)
+        self._writer.flush()
+
+
+def _time_layer(layer, x, num_repeats):
+    x = tf.convert_to_tensor(x)
+    variables = layer.trainable_variables
+    differentiable_input = x.dtype.is_floating
+
+    @tf.function
+    def forward(x):
+        with tf.name_scope(layer.name):
+            return layer(x)
+
+    @tf.function
+    def backward(x):
+        with tf.name_scope(layer.name):
+            with tf.GradientTape() as tape:
+                if differentiable_input:
+                    tape.watch(x)
+                out = layer(x)
+            sources = ([x] if differentiable_input else []) + variables
+            return tape.gradient(
+                out, sources, output_gradients=tf.ones_like(out),
+                unconnected_gradients=tf.UnconnectedGradients.ZERO)
+
+    forward_time = _median_time(forward, x, num_repeats)
+    if not differentiable_input and not variables:
+        return forward_time, None
+    # The backward pass is timed together with the forward pass that it depends on
+    return forward_time, max(_median_time(backward, x, num_repeats) - forward_time, 0.0)
+
+
+def _median_time(fn, x, num_repeats):
+    # The first call traces the function
+    tf.nest.map_structure(lambda t: t.numpy(), fn(x))
+    times = []
+    for _ in range(num_repeats):
+        start = time.perf_counter()
+        tf.nest.map_structure(lambda t: t.numpy(), fn(x))
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def _log_value_statistics(out):
+    out = tf.convert_to_tensor(out)
+    if not out.dtype.is_floating:
+        return 0.0, 0.0
+    is_finite = tf.math.is_finite(out)
+    neg_inf_fraction = tf.reduce_mean(tf.cast(tf.equal(out, -np.inf), tf.float32))
+    if not tf.reduce_any(is_finite):
+        return float(neg_inf_fraction), 0.0
+    finite = tf.boolean_mask(out, is_finite)
+    return float(neg_inf_fraction), float(tf.reduce_max(finite) - tf.reduce_min(finite))
+
+
+def _tie_fraction(layer, x):
+    if not isinstance(layer, (DenseSum, Conv2DSum, Local2DSum, RootSum)) or layer.logspace_accumulators \
+            or layer.backprop_mode not in [BackpropMode.HARD_EM, BackpropMode.HARD_EM_UNWEIGHTED]:
+        return None
+    x = tf.convert_to_tensor(x)
+    num_in = x.shape[-1]
+    # Inputs of shape [num_positions, num_batch, num_in] and log weights of shape
+    # [num_positions, num_in, num_out], where positions are scopes and decompositions or pixels
+    if isinstance(layer, DenseSum):
+        accumulators = layer._accumulators
+        x = tf.reshape(tf.transpose(x, (1, 2, 0, 3)), [-1, tf.shape(x)[0], num_in])
+    elif isinstance(layer, Local2DSum):
+        accumulators = layer.accumulators
+        x = tf.reshape(tf.transpose(x, (1, 2, 0, 3)), [-1, tf.shape(x)[0], num_in])
+    elif isinstance(layer, Conv2DSum):
+        accumulators = layer.accumulators
+        x = tf.reshape(x, [1, -1, num_in])
+    else:
+        if layer.return_weighted_child_logits:
+            # Every child is weighted separately, so there is no winner to select
+            return None
+        accumulators = tf.expand_dims(layer.accumulators, axis=1)
+        x = tf.reshape(x, [1, -1, num_in])
+    log_weights = tf.reshape(
+        tf.nn.log_softmax(tf.math.log(accumulators), axis=-2), [-1, num_in, accumulators.shape[-1]])
+
+    if layer.backprop_mode == BackpropMode.HARD_EM_UNWEIGHTED:
+        # [num_positions, num_batch, num_in]
+        candidates = x
+    else:
+        # [num_positions, num_batch, num_out, num_in]
+        candidates = tf.expand_dims(x, axis=2) + tf.expand_dims(tf.linalg.matrix_transpose(log_weights), axis=1)
+    is_max = tf.equal(candidates, tf.reduce_max(candidates, axis=-1, keepdims=True))
+    return float(tf.reduce_mean(tf.cast(tf.reduce_sum(tf.cast(is_max, tf.int32), axis=-1) > 1, tf.float32)))
+
+
+def _total(times):
+    if all(t is None for t in times):
+        return None
+    return sum(t for t in times if t is not None)
+
+
+def _format_time(seconds):
+    if seconds is None:
+        return "-"
+    if seconds < 1e-3:
+        return "{:.1f} us".format(seconds * 1e6)
+    if seconds < 1:
+        return "{:.2f} ms".format(seconds * 1e3)
+    return "{:.2f} s".format(seconds)
+
+
+def _format_fraction(fraction):
+    return "-" if fraction is None else "{:.1%}".format(fraction)
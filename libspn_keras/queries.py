@@ -0,0 +1,319 @@
+import numpy as np
+import tensorflow as tf
+
+from libspn_keras import topdown
+from libspn_keras.layers import DenseProduct, ReduceProduct, PermuteAndPadScopes, Undecompose, \
+    LogDropout, RootSum, DenseSum
+from libspn_keras.math.logmatmul import logmatmul
+from libspn_keras.math.logutils import replace_infs_with_zeros
+
+
+def conditional_log_prob(model, x, evidence_mask, query_mask):
+    """
+    Computes the conditional log probability :math:`\\log p(x_q \\mid x_e)` of the query
+    variables given the evidence variables for each row of a batch. The conditional is the
+    difference of the log probability of the union of query and evidence variables and the log
+    probability of the evidence variables, with all other variables marginalized out.
+
+    The leaf layer is evaluated only once. The numerators and the denominator are obtained by
+    masking the leaf output in different ways and the layers above the leaf evaluate all of them
+    at once by stacking them along the batch axis. Multiple query sets per row can be passed by
+    adding a query axis to ``query_mask``. These share the denominator, so that ``num_queries``
+    queries cost ``num_queries + 1`` evaluations of the layers above the leaf.
+
+    Supports sequential SPNs that consist of an optional ``NormalizeStandardScore``, an optional
+    ``FlatToRegions`` layer, a leaf layer and any layers on top of that, such as the ones built by
+    ``region_graph_to_dense_spn``. Functional models are supported if their layers form a chain in
+    which each layer is applied once to the output of the previous layer.
+
+    Args:
+        model: An SPN model
+        x: Input of the model. Values of variables that are neither part of the evidence nor of the
+            query are ignored.
+        evidence_mask: Boolean ``Tensor`` of the same shape as ``x`` that is ``True`` for variables
+            that are part of the evidence
+        query_mask: Boolean ``Tensor`` that is ``True`` for variables that are part of the query.
+            Either of the same shape as ``x`` or of shape ``[batch, num_queries] + x.shape[1:]``
+            to evaluate multiple query sets per row.
+
+    Returns:
+        A ``Tensor`` of the same shape as the output of ``model`` holding the conditional log
+        probabilities, or of shape ``[batch, num_queries] + output_shape[1:]`` if ``query_mask``
+        has a query axis.
+
+    Raises:
+        ValueError: If ``model`` has no leaf layer or if the layers of a functional ``model`` do not
+            form a chain.
+    """
+    x = tf.convert_to_tensor(x)
+    evidence_mask = tf.convert_to_tensor(evidence_mask, dtype=tf.bool)
+    query_mask = tf.convert_to_tensor(query_mask, dtype=tf.bool)
+    has_query_axis = len(query_mask.shape) == len(x.shape) + 1
+    if not has_query_axis:
+        query_mask = tf.expand_dims(query_mask, axis=1)
+
+    # [num_queries + 1, batch, ...] masks of observed variables with the evidence first
+    query_mask = tf.transpose(query_mask, [1, 0] + list(range(2, len(query_mask.shape))))
+    masks = tf.concat([evidence_mask[tf.newaxis], tf.logical_or(evidence_mask, query_mask)], axis=0)
+    num_stacked = tf.shape(masks)[0]
+    masks = tf.reshape(masks, tf.concat([[-1], tf.shape(x)[1:]], axis=0))
+
+    pre_leaf_layers, leaf, post_leaf_layers = topdown.split_at_leaf(model)
+    leaf_input, masks, _ = topdown.to_leaf_inputs(pre_leaf_layers, x, masks)
+    leaf_out = tf.tile(leaf(leaf_input), [num_stacked, 1, 1, 1])
+    out = tf.where(
+        leaf._broadcast_marginalize_mask(masks, leaf_out)[..., tf.newaxis], leaf_out,
+        tf.zeros([], dtype=leaf_out.dtype)
+    )
+    for layer in post_leaf_layers:
+        out = layer(out)
+
+    out = tf.reshape(out, tf.concat([[num_stacked, -1], tf.shape(out)[1:]], axis=0))
+    conditional = out[1:] - out[:1]
+    if not has_query_axis:
+        return conditional[0]
+    return tf.transpose(conditional, [1, 0] + list(range(2, len(out.shape))))
+
+
+def all_conditionals(model, x):
+    """
+    Computes the conditional log probability :math:`\\log p(x_i \\mid x_{-i})` of every variable
+    given all other variables, for every row of a batch.
+
+    Since an SPN is multilinear in the leaf components of each variable, marginalizing out
+    variable :math:`i` amounts to summing the derivatives of the root with respect to its leaf
+    components. These are obtained for all variables at once by an upward pass followed by a
+    derivative pass from the root to the leaves, rather than by a marginalized forward pass per
+    variable. The derivative pass is carried out in log-space without dividing by the values of
+    the nodes, so that it remains exact for leaf components with (near) zero probability, such as
+    non-matching indicators.
+
+    Supports sequential SPNs that consist of an optional ``NormalizeStandardScore``, a
+    ``FlatToRegions`` layer, a leaf layer and ``PermuteAndPadScopes``, ``DenseProduct``,
+    ``ReduceProduct``, ``DenseSum``, ``Undecompose``, ``LogDropout`` and ``RootSum`` layers, such as
+    the ones built by ``region_graph_to_dense_spn``. The SPN must have a single root.
+
+    Args:
+        model: An SPN model
+        x: Input of the model
+
+    Returns:
+        A ``Tensor`` of shape ``[batch, num_scopes]`` holding the conditional log probability of the
+        variables of each leaf scope. After ``FlatToRegions``, this is ``[batch, num_vars]``.
+    """
+    x = tf.convert_to_tensor(x)
+    pre_leaf_layers, leaf, post_leaf_layers = topdown.split_at_leaf(model)
+    leaf_input, _, _ = topdown.to_leaf_inputs(pre_leaf_layers, x)
+
+    log_grad = _relative_log_derivative_of_input(post_leaf_layers, leaf(leaf_input))
+
+    # Marginalizing a variable sets the value of all its components to 1, which gives the sum of
+    # the derivatives over the components in all decompositions
+    return -tf.reduce_logsumexp(log_grad, axis=[2, 3])
+
+
+def smoothed_marginals(dynamic_spn, x, sequence_lens, return_interface_posteriors=False):
+    """
+    Computes the smoothed conditional log probability :math:`\\log p(x_t \\mid x_{1:t-1}, x_{t+1:T})`
+    of the variables of every timestep given all other timesteps of a sequence with a
+    ``DynamicSumProductNetwork``, e.g. to find anomalous timesteps in long recordings.
+
+    Rather than evaluating the model once per marginalized timestep, the temporal products of all
+    timesteps are evaluated once as in ``call`` (forward pass), after which a single derivative
+    pass goes from the root at the last timestep back to the first timestep (backward pass).
+    Marginalizing the variables of timestep :math:`t` sets the output of the interface network
+    for t = t0 at that timestep to 1, so the marginal follows from the sum of the derivatives with
+    respect to that output. The derivative pass is carried out in log-space.
+
+    Args:
+        dynamic_spn: A ``DynamicSumProductNetwork`` with a single root, of which the interface and
+            top networks consist of layers that are supported by ``all_conditionals``
+        x: Pre-padded sequences of shape ``[num_batch, max_sequence_len, num_variables]``
+        sequence_lens: Length of each sequence of shape ``[num_batch]``
+        return_interface_posteriors: If ``True``, also returns the posterior log probability of
+            each node of the temporal product at every timestep given the whole sequence. Each
+            node is the product of node ``a`` of the interface of the previous timestep and node
+            ``b`` of the interface network for t = t0 at index ``a * num_nodes_t0 + b``, as in
+            ``temporal_most_probable_explanation``.
+
+    Returns:
+        A ``Tensor`` of shape ``[num_batch, max_sequence_len]`` holding the smoothed conditional log
+        probabilities, which are 0 for padded timesteps. If ``return_interface_posteriors`` is
+        ``True``, a tuple of that and a ``Tensor`` of shape ``[num_batch, max_sequence_len,
+        num_nodes_t_minus_1 * num_nodes_t0]`` holding the log posteriors, which are ``-inf`` for
+        padded timesteps.
+    """
+    step_masks, interface_t0, interface_template_prods, num_padded_steps = dynamic_spn.evaluate_interfaces(
+        [x, sequence_lens])
+    num_steps, num_batch = tf.shape(step_masks)[0], tf.shape(step_masks)[1]
+    is_step = tf.cast(step_masks, tf.bool)
+    interface_layers = dynamic_spn.interface_network_t_minus_1.layers
+
+    # The interface of the previous timestep that enters the temporal product of each timestep,
+    # which is recomputed from the temporal products for all timesteps at once
+    interface_t_minus_1 = tf.concat([
+        dynamic_spn.initial_interface_state(num_batch)[tf.newaxis],
+        dynamic_spn._apply_to_all_steps(dynamic_spn.interface_network_t_minus_1, interface_template_prods[:-1])
+    ], axis=0) * tf.reshape(step_masks, [num_steps, num_batch, 1, 1, 1])
+    num_nodes_t_minus_1, num_nodes_t0 = interface_t_minus_1.shape[-1], interface_t0.shape[-1]
+
+    # Log derivatives relative to the root, i.e. log(d root / d node) - log(root)
+    log_grad = _relative_log_derivative_of_input(dynamic_spn.top_network.layers, interface_template_prods[-1])
+    log_grads_t0 = tf.TensorArray(tf.float32, num_steps)
+    log_grads_prods = tf.TensorArray(tf.float32, num_steps)
+    for i in tf.range(num_steps - 1, -1, -1):
+        log_grads_prods = log_grads_prods.write(i, log_grad)
+        # [num_batch, 1, 1, num_nodes_t_minus_1, num_nodes_t0]
+        log_grad_pairs = tf.reshape(log_grad, [-1, 1, 1, num_nodes_t_minus_1, num_nodes_t0])
+        log_grads_t0 = log_grads_t0.write(i, tf.reduce_logsumexp(
+            log_grad_pairs + tf.expand_dims(interface_t_minus_1[i], axis=-1), axis=-2))
+        log_grad_t_minus_1 = tf.reduce_logsumexp(
+            log_grad_pairs + tf.expand_dims(interface_t0[i], axis=-2), axis=-1)
+        log_grad = _log_derivative_of_inputs(
+            interface_layers, interface_template_prods[tf.maximum(i - 1, 0)], log_grad_t_minus_1)
+        # Temporal products of padded timesteps are constant
+        log_grad = tf.where(
+            tf.reshape(is_step[tf.maximum(i - 1, 0)], [-1, 1, 1, 1]), log_grad, tf.constant(-np.inf))
+
+    num_skipped_steps = num_padded_steps - num_steps
+    marginals = tf.where(is_step, -tf.reduce_logsumexp(log_grads_t0.stack(), axis=[2, 3, 4]), 0.0)
+    marginals = tf.pad(tf.transpose(marginals), [[0, 0], [num_skipped_steps, 0]])
+    if not return_interface_posteriors:
+        return marginals
+    posteriors = tf.where(
+        is_step[..., tf.newaxis], tf.reshape(log_grads_prods.stack() + interface_template_prods,
+                                             [num_steps, num_batch, -1]), -np.inf)
+    posteriors = tf.pad(
+        tf.transpose(posteriors, [1, 0, 2]), [[0, 0], [num_skipped_steps, 0], [0, 0]], constant_values=-np.inf)
+    return marginals, posteriors
+
+
+def _relative_log_derivative_of_input(layers, x):
+    """
+    Computes the log derivatives of the root with respect to the input of a stack of layers
+    relative to the value of the root, i.e. :math:`\\log(\\partial root / \\partial x) - \\log(root)`.
+
+    Args:
+        layers: Layers that end with a single root
+        x: Input of the first layer
+
+    Returns:
+        Relative log derivatives with respect to ``x``
+    """
+    inputs = []
+    out = x
+    for layer in layers:
+        inputs.append(out)
+        out = layer(out)
+
+    if isinstance(layers[-1], RootSum):
+        log_weights = tf.reshape(topdown.normalized_log_weights(layers[-1]), [1, -1])
+        log_prob = tf.reduce_logsumexp(tf.reshape(inputs[-1], [-1, log_weights.shape[1]]) + log_weights, axis=1)
+    else:
+        log_prob = tf.reshape(out, [-1])
+    log_grad = tf.reshape(-log_prob, [-1, 1, 1, 1])
+    for layer, layer_input in zip(reversed(layers), reversed(inputs)):
+        log_grad = _log_derivative_of_input(layer, layer_input, log_grad)
+    return log_grad
+
+
+def _log_derivative_of_inputs(layers, x, log_grad):
+    """
+    Computes the log derivatives with respect to the input of a stack of layers from the log
+    derivatives with respect to the output of the final layer.
+
+    Args:
+        layers: Layers
+        x: Input of the first layer
+        log_grad: Log derivatives with respect to the output of the final layer
+
+    Returns:
+        Log derivatives with respect to ``x``
+    """
+    inputs = []
+    for layer in layers:
+        inputs.append(x)
+        x = layer(x)
+    for layer, layer_input in zip(reversed(layers), reversed(inputs)):
+        log_grad = _log_derivative_of_input(layer, layer_input, log_grad)
+    return log_grad
+
+
+def _log_derivative_of_input(layer, x, log_grad):
+    """
+    Computes the log derivatives with respect to the input of a layer from the log derivatives with
+    respect to its output.
+
+    Args:
+        layer: A dense SPN layer
+        x: Input of ``layer``
+        log_grad: Log derivatives with respect to the output of ``layer``
+
+    Returns:
+        Log derivatives with respect to ``x``
+    """
+    if isinstance(layer, (DenseSum, RootSum)):
+        # The derivative of a child is the weighted sum of the derivatives of its parents
+        log_weights = topdown.normalized_log_weights(layer)
+        log_grad_scopes_first = tf.transpose(tf.reshape(log_grad, tf.concat(
+            [tf.shape(x)[:3], [log_weights.shape[-1]]], axis=0)), (1, 2, 0, 3))
+        out = logmatmul(log_grad_scopes_first, tf.transpose(log_weights, (0, 1, 3, 2)))
+        return tf.transpose(out, (2, 0, 1, 3))
+    if isinstance(layer, DenseProduct):
+        return _log_derivative_of_dense_product_input(layer, x, log_grad)
+    if isinstance(layer, ReduceProduct):
+        # The derivative of a factor is the product of the other factors, which are summed in
+        # log-space from both sides rather than subtracting the factor itself from the product
+        factors = tf.reshape(x, [-1, layer._num_scopes, layer.num_factors, layer._num_decomps, layer._num_nodes_in])
+        others = tf.math.cumsum(factors, axis=2, exclusive=True) + \
+            tf.math.cumsum(factors, axis=2, exclusive=True, reverse=True)
+        return tf.reshape(tf.expand_dims(log_grad, axis=2) + others, tf.shape(x))
+    if isinstance(layer, PermuteAndPadScopes):
+        return topdown.invert_permute_and_pad_scopes(layer, log_grad)
+    if isinstance(layer, Undecompose):
+        return tf.reshape(log_grad, tf.shape(x))
+    if isinstance(layer, LogDropout):
+        return log_grad
+    raise NotImplementedError(
+        "Derivative passes do not support {} layers".format(layer.__class__.__name__))
+
+
+def _log_derivative_of_dense_product_input(layer, x, log_grad):
+    # Product p is the outer product of its factors, so the derivative of node n of factor f is
+    # the sum over products that contain n of their derivative times the other factors. The sums
+    # are computed in linear space after subtracting the maximum per scope and decomposition, as
+    # in logmatmul. Factors are contracted from the right one at a time and the intermediate
+    # results are shared between factors, so that only the first contractions touch all products.
+    num_factors, num_nodes_in = layer.num_factors, layer._num_nodes_in
+    batch_shape = [-1, layer._num_scopes_out, layer._num_decomps]
+    factors = tf.unstack(tf.reshape(x, [-1, layer._num_scopes_out, num_factors, layer._num_decomps, num_nodes_in]), axis=2)
+    factor_maxes = [replace_infs_with_zeros(tf.reduce_max(factor, axis=-1, keepdims=True)) for factor in factors]
+    factors = [tf.exp(factor - factor_max) for factor, factor_max in zip(factors, factor_maxes)]
+    log_grad_max = replace_infs_with_zeros(tf.reduce_max(log_grad, axis=-1, keepdims=True))
+    grad = tf.exp(log_grad - log_grad_max)
+
+    # right_contracted[k] holds the derivatives with factors k, ..., num_factors - 1 contracted
+    right_contracted = {num_factors: grad}
+    for k in reversed(range(1, num_factors)):
+        right_contracted[k] = tf.reshape(tf.matmul(
+            tf.reshape(right_contracted[k + 1], batch_shape + [num_nodes_in ** k, num_nodes_in]),
+            tf.expand_dims(factors[k], axis=-1)
+        ), batch_shape + [num_nodes_in ** k])
+
+    grad_per_factor = []
+    left_outer_product = tf.ones_like(factors[0][..., :1])
+    for f in range(num_factors):
+        grad_per_factor.append(tf.squeeze(tf.matmul(
+            tf.expand_dims(left_outer_product, axis=-2),
+            tf.reshape(right_contracted[f + 1], batch_shape + [num_nodes_in ** f, num_nodes_in])
+        ), axis=-2))
+        left_outer_product = tf.reshape(
+            tf.expand_dims(left_outer_product, axis=-1) * tf.expand_dims(factors[f], axis=-2),
+            batch_shape + [num_nodes_in ** (f + 1)])
+
+    factor_max_sum = tf.add_n(factor_maxes)
+    log_grad_per_factor = [
+        tf.math.log(g) + log_grad_max + factor_max_sum - factor_max
+        for g, factor_max in zip(grad_per_factor, factor_maxes)
+    ]
+    return tf.reshape(tf.stack(log_grad_per_factor, axis=2), tf.shape(x))
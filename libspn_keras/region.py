@@ -5,13 +5,14 @@ import functools
 import numpy as np
 import typing
 
-from tensorflow.python import Initializer
-from tensorflow.python.keras.constraints import Constraint
+from tensorflow.keras.initializers import Initializer
+from tensorflow.keras.constraints import Constraint
 
 from libspn_keras import BackpropMode
 from libspn_keras.layers import DenseSum, DenseProduct, RootSum, BaseLeaf
 from libspn_keras.layers.flat_to_regions import FlatToRegions
 from libspn_keras.layers.permute_and_pad_scopes import PermuteAndPadScopes
+from libspn_keras.models.sequential_spn import SequentialSumProductNetwork
 import tensorflow as tf
 
 from typing import Iterable, Optional
@@ -75,7 +76,9 @@ def region_graph_to_dense_spn(
     product_first: bool = True,
     num_classes: Optional[int] = None,
     with_root: bool = True,
-    return_weighted_child_logits: Optional[bool] = None
+    return_weighted_child_logits: Optional[bool] = None,
+    checkpoint_products: bool = False,
+    scope_chunk_size: Optional[int] = None
 ):
     """
     Converts a region graph (built from :class:`RegionNode` and :class:`RegionVar`) to a dense SPN.
@@ -97,6 +100,12 @@ def region_graph_to_dense_spn(
             stack. This means if set to ``None`` the SPN cannot be used for classification.
         with_root: If ``True``, sets a ``RootSum`` as the final layer.
         return_weighted_child_logits: Whether to return weighted child logits. If ``
+        checkpoint_products: If ``True``, returns a ``SequentialSumProductNetwork`` that recomputes
+            product layers when computing gradients rather than keeping their outputs. See
+            :class:`libspn_keras.models.SequentialSumProductNetwork`.
+        scope_chunk_size: If not ``None``, returns a ``SequentialSumProductNetwork`` that evaluates
+            the dense stack for chunks of this many scopes at a time. See
+            :class:`libspn_keras.models.SequentialSumProductNetwork`.
 
     """
     permutation, num_factors_leaf_to_root = _region_graph_to_permutations_and_prods_per_depth(
@@ -138,6 +147,10 @@ def region_graph_to_dense_spn(
         PermuteAndPadScopes(permutations=np.asarray([permutation]))
     ]
 
+    if checkpoint_products or scope_chunk_size is not None:
+        return SequentialSumProductNetwork(
+            pre_stack + sum_product_stack, unsupervised=False, checkpoint_products=checkpoint_products,
+            scope_chunk_size=scope_chunk_size)
     return tf.keras.Sequential(pre_stack + sum_product_stack)
 
 
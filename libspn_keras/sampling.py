@@ -0,0 +1,77 @@
+import tensorflow as tf
+
+from libspn_keras import topdown
+from libspn_keras.layers import RootSum
+
+
+def sample(model, num_samples=None, evidence=None, evidence_mask=None):
+    """
+    Draws samples from an SPN by ancestral sampling. Starting at the root, each selected sum
+    samples one of its children, products select all of their children and finally the selected
+    leaf components are sampled. All samples are drawn at once, so each layer only takes a few
+    batched operations regardless of the number of samples.
+
+    If evidence is given, the variables that are not part of the evidence are sampled from
+    the conditional distribution given the evidence. In that case, the SPN is first evaluated with
+    the unobserved variables marginalized out and sums sample their children proportional to
+    the weighted probabilities of the children.
+
+    Supports the same layers as ``most_probable_explanation``.
+
+    Args:
+        model: A ``keras.Sequential`` SPN
+        num_samples: Number of samples to draw. Ignored if ``evidence`` is given.
+        evidence: Input of the model that holds the evidence. Values of variables that are not
+            part of the evidence are ignored.
+        evidence_mask: Boolean ``Tensor`` of the same shape as ``evidence`` that is ``True`` for
+            variables that are part of the evidence.
+
+    Returns:
+        A ``Tensor`` of shape ``[num_samples] + model.input_shape[1:]``, or the shape of
+        ``evidence`` if given. If the SPN normalizes its inputs with ``NormalizeStandardScore``,
+        unconditional samples are in the normalized space.
+
+    Raises:
+        ValueError: If neither ``num_samples`` nor ``evidence`` is given, or if only one of
+            ``evidence`` and ``evidence_mask`` is given.
+    """
+    if (evidence is None) != (evidence_mask is None):
+        raise ValueError("Evidence and evidence mask must be given together")
+    pre_leaf_layers, leaf, post_leaf_layers = topdown.split_at_leaf(model)
+
+    if evidence is None:
+        if num_samples is None:
+            raise ValueError("Either the number of samples or evidence must be given")
+        child_log_probs_per_layer = [None] * len(post_leaf_layers)
+        top_logits = tf.zeros([num_samples, 1, 1, model.output_shape[-1]])
+    else:
+        evidence = tf.convert_to_tensor(evidence)
+        leaf_input, leaf_evidence_mask, to_input_space = topdown.to_leaf_inputs(
+            pre_leaf_layers, evidence, evidence_mask)
+        out = leaf(leaf_input, marginalize_mask=tf.logical_not(leaf_evidence_mask))
+        child_log_probs_per_layer = []
+        for layer in post_leaf_layers:
+            child_log_probs_per_layer.append(out if topdown.is_sum(layer) else None)
+            out = layer(out)
+        top_logits = tf.reshape(out, [-1, 1, 1, out.shape[-1]])
+
+    if isinstance(post_leaf_layers[-1], RootSum):
+        selection = tf.zeros(tf.shape(top_logits)[:3], dtype=tf.int32)
+    else:
+        num_nodes = top_logits.shape[-1]
+        selection = tf.reshape(
+            tf.random.categorical(tf.reshape(top_logits, [-1, num_nodes]), 1, dtype=tf.int32), [-1, 1, 1])
+
+    for layer, child_log_probs in zip(reversed(post_leaf_layers), reversed(child_log_probs_per_layer)):
+        if topdown.is_sum(layer):
+            selection = topdown.sample_children_of_sums(
+                selection, topdown.normalized_log_weights(layer), child_log_probs)
+        else:
+            selection = topdown.route_to_children(layer, selection)
+
+    samples = topdown.sample_leaf_values(
+        leaf, selection, decomposed=not topdown.is_spatial(post_leaf_layers))
+    if evidence is None:
+        return tf.reshape(samples, [num_samples] + list(model.input_shape[1:]))
+    samples = to_input_space(tf.cast(samples, evidence.dtype))
+    return tf.where(evidence_mask, evidence, samples)
@@ -0,0 +1,86 @@
+import numpy as np
+import tensorflow as tf
+
+
+class StreamingFilter:
+    """
+    Scores many independent sequences online with a ``DynamicSumProductNetwork``, one timestep
+    per call. The interface state of each stream is kept on device between calls and looked up by
+    stream ID, so that the cost per timestep is constant rather than growing with the length of
+    the stream. Streams that are advanced in the same call are evaluated as a single batch.
+
+    Args:
+        dynamic_spn: A built ``DynamicSumProductNetwork``
+        initial_capacity: Number of streams to allocate interface states for. The capacity is
+            doubled whenever more streams are active.
+    """
+
+    def __init__(self, dynamic_spn, initial_capacity=64):
+        self.dynamic_spn = dynamic_spn
+        self._slots = {}
+        self._capacity = initial_capacity
+        self._free_slots = list(reversed(range(initial_capacity)))
+        self._states = tf.Variable(
+            dynamic_spn.initial_interface_state(initial_capacity),
+            shape=[None, 1, 1, dynamic_spn.interface_network_t0.output_shape[-1]], trainable=False)
+        self._step_fn = tf.function(self._step)
+
+    @property
+    def num_streams(self):
+        """ Number of active streams """
+        return len(self._slots)
+
+    def __call__(self, stream_ids, x):
+        """
+        Advances streams by a single timestep. Streams with IDs that have not been seen before (or
+        that have been reset) start at their first timestep.
+
+        Args:
+            stream_ids: Sequence of hashable stream IDs of length ``num_batch``. IDs must be unique
+                within a call, since a stream can only be advanced by one timestep at a time.
+            x: Input at the current timestep of shape ``[num_batch, num_variables]``
+
+        Returns:
+            The log likelihood of each stream up to and including the current timestep, of shape
+            ``[num_batch, root_num_out]``.
+
+        Raises:
+            ValueError: If ``stream_ids`` contains duplicates.
+        """
+        stream_ids = np.asarray(stream_ids).tolist()
+        if len(set(stream_ids)) != len(stream_ids):
+            raise ValueError("Stream IDs must be unique within a single step")
+        is_new = np.asarray([stream_id not in self._slots for stream_id in stream_ids])
+        slots = np.asarray([self._acquire_slot(stream_id) for stream_id in stream_ids], dtype=np.int32)
+        return self._step_fn(tf.convert_to_tensor(x), slots, is_new)
+
+    def reset(self, stream_ids=None):
+        """
+        Ends streams, so that their IDs start a new stream in a subsequent call.
+
+        Args:
+            stream_ids: Sequence of stream IDs to end. If ``None``, all streams are ended.
+        """
+        stream_ids = list(self._slots) if stream_ids is None else np.asarray(stream_ids).tolist()
+        for stream_id in stream_ids:
+            if stream_id in self._slots:
+                self._free_slots.append(self._slots.pop(stream_id))
+
+    def _acquire_slot(self, stream_id):
+        if stream_id in self._slots:
+            return self._slots[stream_id]
+        if not self._free_slots:
+            self._states.assign(tf.concat([self._states, tf.zeros_like(self._states)], axis=0))
+            self._free_slots = list(reversed(range(self._capacity, 2 * self._capacity)))
+            self._capacity *= 2
+        self._slots[stream_id] = slot = self._free_slots.pop()
+        return slot
+
+    def _step(self, x, slots, is_new):
+        # States of slots that start a new stream may be left over from a stream that was reset
+        interface_t_minus_1 = tf.where(
+            tf.reshape(is_new, [-1, 1, 1, 1]), tf.zeros([], dtype=self._states.dtype),
+            tf.gather(self._states, slots))
+        log_likelihood, interface_t_minus_1 = self.dynamic_spn.filter_step(x, interface_t_minus_1)
+        self._states.scatter_nd_update(tf.expand_dims(slots, axis=1), interface_t_minus_1)
+        return log_likelihood
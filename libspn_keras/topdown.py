@@ -0,0 +1,430 @@
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+from libspn_keras.layers import BaseLeaf, DenseSum, DenseProduct, RootSum, ReduceProduct, \
+    PermuteAndPadScopes, Undecompose, FlatToRegions, NormalizeStandardScore, LogDropout, \
+    Conv2DProduct, Conv2DSum, Local2DSum, SpatialToRegions
+
+# Selected node indices are stored as int32, where -1 means that a region is not part of the
+# selected tree. Argmax indices of sums are stored with the smallest type that can hold them.
+# Spatial layers are treated like region layers with rows as scopes and columns as
+# decompositions, so that their selections are of shape [batch, num_rows, num_cols].
+UNSELECTED = -1
+
+
+def split_at_leaf(model):
+    """
+    Splits the layers of a sequential SPN into layers preceding the leaf, the leaf and layers
+    succeeding the leaf.
+
+    Args:
+        model: A ``keras.Sequential`` SPN or a functional SPN of which the layers form a chain
+
+    Returns:
+        A tuple of the list of preceding layers, the leaf layer and the list of succeeding layers.
+
+    Raises:
+        ValueError: If there is no leaf layer or if the layers of a functional model do not form
+            a chain.
+    """
+    if not isinstance(model, keras.Sequential) and not _is_chain(model):
+        raise ValueError(
+            "Top-down passes require the layers of {} to form a chain in which each layer is applied once to the "
+            "output of the previous layer".format(model.name))
+    for i, layer in enumerate(model.layers):
+        if isinstance(layer, BaseLeaf):
+            return model.layers[:i], layer, model.layers[i + 1:]
+    raise ValueError("No leaf layer found in {}".format(model.name))
+
+
+def _is_chain(model):
+    inputs, outputs = getattr(model, "inputs", None), getattr(model, "outputs", None)
+    if not inputs or not outputs or len(inputs) != 1 or len(outputs) != 1:
+        return False
+    previous_output = inputs[0]
+    for layer in model.layers:
+        if isinstance(layer, keras.layers.InputLayer):
+            continue
+        try:
+            # Raises if the layer is applied more than once
+            layer_input = layer.input
+        except AttributeError:
+            return False
+        if layer_input is not previous_output:
+            return False
+        previous_output = layer.output
+    return outputs[0] is previous_output
+
+
+def to_leaf_inputs(pre_leaf_layers, x, evidence_mask=None):
+    """
+    Applies the layers preceding the leaf to the input and the evidence mask.
+
+    Args:
+        pre_leaf_layers: Layers preceding the leaf
+        x: Input of the model
+        evidence_mask: Optional boolean ``Tensor`` of the same shape as ``x``
+
+    Returns:
+        A tuple of the leaf input, the evidence mask in the same form as the leaf input (or
+        ``None``) and a function that maps leaf input values of shape
+        ``[batch, num_scopes, 1, multivariate_size]`` (or the shape of the leaf input for spatial
+        SPNs) back to the form of ``x``.
+    """
+    input_shape = tf.shape(x)
+    mean = stddev = None
+    for layer in pre_leaf_layers:
+        if isinstance(layer, keras.layers.InputLayer):
+            continue
+        if isinstance(layer, NormalizeStandardScore):
+            x, mean, stddev = layer(x, return_stats=True)
+        elif isinstance(layer, FlatToRegions):
+            x = layer(x)
+            if evidence_mask is not None:
+                evidence_mask = layer(evidence_mask)
+        else:
+            raise NotImplementedError(
+                "Top-down passes do not support a {} before the leaf".format(layer.__class__.__name__))
+
+    def to_input_space(values):
+        if mean is not None:
+            values = values * tf.reshape(stddev, [-1, 1, 1, 1]) + tf.reshape(mean, [-1, 1, 1, 1])
+        return tf.reshape(values, input_shape)
+
+    return x, evidence_mask, to_input_space
+
+
+def is_sum(layer):
+    """ Whether ``layer`` is a sum layer that top-down passes select children of """
+    return isinstance(layer, (DenseSum, RootSum, Conv2DSum, Local2DSum))
+
+
+def is_spatial(layers):
+    """ Whether ``layers`` contain spatial layers, which means that the leaf is not decomposed """
+    return any(
+        isinstance(layer, (Conv2DProduct, Conv2DSum, Local2DSum, SpatialToRegions)) for layer in layers)
+
+
+def normalized_log_weights(layer):
+    """
+    Computes the normalized log weights of a sum layer.
+
+    Args:
+        layer: A ``DenseSum``, ``RootSum``, ``Local2DSum`` or ``Conv2DSum`` layer
+
+    Returns:
+        A ``Tensor`` of shape ``[num_scopes, num_decomps, num_nodes_in, num_sums]``. For a
+        ``RootSum`` this is ``[1, 1, num_nodes_in, 1]``. For spatial sums this is
+        ``[num_rows, num_cols, num_channels_in, num_sums]``.
+    """
+    if isinstance(layer, RootSum):
+        accumulators = tf.reshape(layer.accumulators, [1, 1, -1, 1])
+    elif isinstance(layer, Conv2DSum):
+        # Weights are shared across the spatial axes
+        _, num_rows, num_cols, num_channels_in = layer.input_shape
+        accumulators = tf.broadcast_to(
+            layer.accumulators, [num_rows, num_cols, num_channels_in, layer.num_sums])
+    elif isinstance(layer, Local2DSum):
+        accumulators = layer.accumulators
+    else:
+        accumulators = layer._accumulators
+    if not layer.logspace_accumulators:
+        accumulators = tf.math.log(accumulators)
+    return tf.nn.log_softmax(accumulators, axis=2)
+
+
+def compact_index_dtype(num_indices):
+    """ Smallest integer dtype that can hold indices in ``[0, num_indices)`` """
+    if num_indices <= tf.int8.max + 1:
+        return tf.int8
+    if num_indices <= tf.int16.max + 1:
+        return tf.int16
+    return tf.int32
+
+
+def select_top(x):
+    """
+    Selects the node with the highest value at the top of the network.
+
+    Args:
+        x: Output of the final layer of shape ``[batch, 1, 1, num_nodes]``
+
+    Returns:
+        Selection of shape ``[batch, 1, 1]``
+    """
+    return tf.argmax(x, axis=-1, output_type=tf.int32)
+
+
+def select_children_of_sums(selection, child_indices):
+    """
+    Selects the children of the selected sums.
+
+    Args:
+        selection: Selected sums of shape ``[batch, num_scopes, num_decomps]``
+        child_indices: Child index per sum of shape ``[batch, num_scopes, num_decomps, num_sums]``
+
+    Returns:
+        Selected children of shape ``[batch, num_scopes, num_decomps]``
+    """
+    is_selected = selection >= 0
+    child_indices = tf.gather(
+        child_indices, tf.where(is_selected, selection, tf.zeros_like(selection)), batch_dims=3)
+    return tf.where(is_selected, tf.cast(child_indices, tf.int32), UNSELECTED)
+
+
+def route_to_children(layer, selection):
+    """
+    Routes the selection of a layer without sums to the selection of its input.
+
+    Args:
+        layer: A product, permutation or pass-through layer
+        selection: Selection of the output of ``layer`` of shape
+            ``[batch, num_scopes_out, num_decomps_out]``
+
+    Returns:
+        Selection of the input of ``layer`` of shape ``[batch, num_scopes_in, num_decomps_in]``
+    """
+    if isinstance(layer, DenseProduct):
+        return _route_dense_product(layer, selection)
+    if isinstance(layer, ReduceProduct):
+        return _route_reduce_product(layer, selection)
+    if isinstance(layer, PermuteAndPadScopes):
+        return _route_permute_and_pad_scopes(layer, selection)
+    if isinstance(layer, Undecompose):
+        return _route_undecompose(layer, selection)
+    if isinstance(layer, Conv2DProduct):
+        return _route_conv2d_product(layer, selection)
+    if isinstance(layer, SpatialToRegions):
+        return _route_spatial_to_regions(layer, selection)
+    if isinstance(layer, LogDropout):
+        return selection
+    raise NotImplementedError(
+        "Top-down passes do not support {} layers".format(layer.__class__.__name__))
+
+
+def _route_dense_product(layer, selection):
+    # Product p is the flattened index of the outer product of factors, so the child of
+    # factor f is digit f of p in base num_nodes_in
+    num_factors, num_nodes_in = layer.num_factors, layer._num_nodes_in
+    strides = num_nodes_in ** tf.range(num_factors - 1, -1, -1)
+    # [batch, scopes_out, 1, decomps]
+    selection_per_factor = tf.expand_dims(selection, axis=2)
+    child = selection_per_factor // tf.reshape(strides, [1, 1, -1, 1]) % num_nodes_in
+    child = tf.where(selection_per_factor >= 0, child, UNSELECTED)
+    return tf.reshape(child, [-1, layer._num_scopes_in, layer._num_decomps])
+
+
+def _route_reduce_product(layer, selection):
+    child = tf.tile(tf.expand_dims(selection, axis=2), [1, 1, layer.num_factors, 1])
+    return tf.reshape(child, [-1, layer._num_scopes_in, layer._num_decomps])
+
+
+def _route_permute_and_pad_scopes(layer, selection):
+    return invert_permute_and_pad_scopes(layer, selection)
+
+
+def invert_permute_and_pad_scopes(layer, x):
+    """
+    Maps a tensor in the form of the output of a ``PermuteAndPadScopes`` layer back to the form of
+    its input, dropping padded scopes.
+
+    Args:
+        layer: A ``PermuteAndPadScopes`` layer
+        x: ``Tensor`` of shape ``[batch, num_scopes_out, num_decomps, ...]``, such as a selection
+            or the derivatives with respect to the output of ``layer``
+
+    Returns:
+        A ``Tensor`` of shape ``[batch, num_scopes_in, num_decomps, ...]``
+    """
+    # Output scope j of decomposition d holds input scope permutations[d, j], or padding if
+    # that is -1. Since permutations are bijective on the non-padded scopes, the input is found
+    # by inverting them.
+    permutations = tf.convert_to_tensor(layer.permutations)
+    _, num_scopes_in, num_decomps, _ = layer.input_shape
+    decomp_and_scope_out = tf.cast(tf.where(permutations >= 0), tf.int32)
+    decomp_and_scope_in = tf.stack(
+        [decomp_and_scope_out[:, 0], tf.gather_nd(permutations, decomp_and_scope_out)], axis=1)
+    inverse_permutations = tf.scatter_nd(
+        decomp_and_scope_in, decomp_and_scope_out[:, 1], [num_decomps, num_scopes_in])
+    decomps_first_perm = [2, 1, 0] + list(range(3, len(x.shape)))
+    decomps_first = tf.transpose(x, decomps_first_perm)
+    out = tf.gather(decomps_first, inverse_permutations, axis=1, batch_dims=1)
+    return tf.transpose(out, decomps_first_perm)
+
+
+def _route_undecompose(layer, selection):
+    # Node n of output decomposition d is node n % num_nodes_in of input decomposition
+    # d * num_joined + n // num_nodes_in
+    _, num_scopes, num_decomps_in, num_nodes_in = layer.input_shape
+    num_joined = num_decomps_in // layer.num_decomps
+    selection = tf.expand_dims(selection, axis=-1)
+    child = tf.where(
+        tf.logical_and(selection >= 0, selection // num_nodes_in == tf.range(num_joined)),
+        selection % num_nodes_in, UNSELECTED
+    )
+    return tf.reshape(child, [-1, num_scopes, num_decomps_in])
+
+
+def _route_conv2d_product(layer, selection):
+    # Each selected product selects one input channel per kernel cell. The input cells are found
+    # by scattering along the (static) strided and dilated kernel positions. Within a selected
+    # tree every input cell has at most one selected parent, so scattered selections never
+    # collide and can simply be summed.
+    _, num_rows_in, num_cols_in, _ = layer.input_shape
+    _, num_rows_out, num_cols_out, _ = layer.output_shape
+    input_cells = _conv2d_product_connections(
+        layer, num_rows_in, num_cols_in, num_rows_out, num_cols_out)
+
+    is_selected = selection >= 0
+    selection = tf.where(is_selected, selection, tf.zeros_like(selection))
+    if layer.depthwise:
+        child = tf.tile(tf.expand_dims(selection, axis=1), [1, len(input_cells), 1, 1])
+    else:
+        # [kernel_cells, num_channels_out] input channel of each kernel cell
+        sparse_kernels = tf.reshape(
+            tf.argmax(layer._onehot_kernels, axis=2, output_type=tf.int32), [len(input_cells), -1])
+        child = tf.gather(sparse_kernels, selection, axis=1, batch_dims=0)
+        child = tf.transpose(child, (1, 0, 2, 3))
+    # [batch, kernel_cells, rows_out, cols_out] -> [kernel_cells * rows_out * cols_out, batch]
+    child = tf.where(tf.expand_dims(is_selected, axis=1), child + 1, 0)
+    child = tf.transpose(tf.reshape(child, [-1, len(input_cells) * num_rows_out * num_cols_out]))
+
+    valid = np.flatnonzero(input_cells >= 0)
+    child = tf.scatter_nd(
+        input_cells.reshape(-1, 1)[valid], tf.gather(child, valid),
+        [num_rows_in * num_cols_in, tf.shape(child)[1]]
+    ) - 1
+    return tf.reshape(tf.transpose(child), [-1, num_rows_in, num_cols_in])
+
+
+def _conv2d_product_connections(layer, num_rows_in, num_cols_in, num_rows_out, num_cols_out):
+    # Flat input cell index of shape [kernel_cells, rows_out * cols_out], which is -1 for padding
+    pad_left, _, pad_top, _ = layer._pad_sizes()
+    kernel_rows, kernel_cols = [
+        np.arange(kernel_size) * dilation for kernel_size, dilation in zip(layer.kernel_size, layer.dilations)]
+    strides_rows, strides_cols = layer.strides
+    rows_in, cols_in = np.broadcast_arrays(
+        kernel_rows.reshape(-1, 1, 1, 1) + np.arange(num_rows_out).reshape(1, 1, -1, 1) * strides_rows - pad_top,
+        kernel_cols.reshape(1, -1, 1, 1) + np.arange(num_cols_out).reshape(1, 1, 1, -1) * strides_cols - pad_left
+    )
+    in_bounds = (rows_in >= 0) & (rows_in < num_rows_in) & (cols_in >= 0) & (cols_in < num_cols_in)
+    input_cells = np.where(in_bounds, rows_in * num_cols_in + cols_in, -1)
+    return input_cells.reshape(len(kernel_rows) * len(kernel_cols), -1).astype(np.int32)
+
+
+def _route_spatial_to_regions(layer, selection):
+    # Node n of the output is channel n % num_channels of cell n // num_channels
+    _, num_rows, num_cols, num_channels = layer.input_shape
+    selection = tf.reshape(selection, [-1, 1, 1])
+    cells = tf.reshape(tf.range(num_rows * num_cols), [1, num_rows, num_cols])
+    return tf.where(
+        tf.logical_and(selection >= 0, selection // num_channels == cells),
+        selection % num_channels, UNSELECTED
+    )
+
+
+def leaf_values_from_selection(leaf, selection, component_values, decomposed=True):
+    """
+    Collects the values of the selected leaf components.
+
+    Args:
+        leaf: Leaf layer
+        selection: Selected components of shape ``[batch, num_scopes, num_decomps]``
+        component_values: Values per component of shape ``[1, num_scopes, num_decomps,
+            num_components, multivariate_size]``, such as the modes of the leaf
+        decomposed: Whether the decompositions of the leaf are copies of the same variables, as
+            is the case after ``FlatToRegions``. Otherwise, each cell of the leaf holds a
+            different variable, as is the case for spatial SPNs.
+
+    Returns:
+        Values of shape ``[batch, num_scopes, 1, multivariate_size]``, taken from the
+        decomposition in which each scope is selected, or ``[batch, num_scopes, num_decomps,
+        multivariate_size]`` if not ``decomposed``.
+    """
+    return tf.gather_nd(component_values[0], selected_leaf_components(selection, decomposed))
+
+
+def sample_leaf_values(leaf, selection, decomposed=True):
+    """
+    Samples from the selected leaf components.
+
+    Args:
+        leaf: Leaf layer
+        selection: Selected components of shape ``[batch, num_scopes, num_decomps]``
+        decomposed: Whether the decompositions of the leaf are copies of the same variables
+
+    Returns:
+        Samples of the same shape as returned by ``leaf_values_from_selection``.
+    """
+    return leaf.sample_components(selected_leaf_components(selection, decomposed))
+
+
+def selected_leaf_components(selection, decomposed=True):
+    """
+    Finds the selected leaf components. If ``decomposed``, every scope is selected in exactly one
+    decomposition, otherwise every cell is selected.
+
+    Args:
+        selection: Selected components of shape ``[batch, num_scopes, num_decomps]``
+        decomposed: Whether the decompositions of the leaf are copies of the same variables
+
+    Returns:
+        An int32 ``Tensor`` of shape ``[batch, num_scopes, 1, 3]`` (or ``[batch, num_scopes,
+        num_decomps, 3]`` if not ``decomposed``) holding the scope, decomposition and component
+        index of the selected components.
+    """
+    if decomposed:
+        decomps = tf.argmax(selection, axis=2, output_type=tf.int32)[..., tf.newaxis]
+        components = tf.reduce_max(selection, axis=2, keepdims=True)
+    else:
+        decomps = tf.broadcast_to(tf.range(tf.shape(selection)[2]), tf.shape(selection))
+        components = tf.maximum(selection, 0)
+    scopes = tf.broadcast_to(tf.range(tf.shape(selection)[1])[:, tf.newaxis], tf.shape(decomps))
+    return tf.stack([scopes, decomps, components], axis=-1)
+
+
+def sample_children_of_sums(selection, log_weights, child_log_probs=None):
+    """
+    Samples the children of the selected sums.
+
+    Args:
+        selection: Selected sums of shape ``[batch, num_scopes, num_decomps]``
+        log_weights: Normalized log weights of shape ``[num_scopes, num_decomps, num_nodes_in,
+            num_sums]``
+        child_log_probs: Optional log probabilities of the children of shape ``[batch,
+            num_scopes, num_decomps, num_nodes_in]``. If given, children are sampled from the
+            posterior given the evidence rather than from the weights.
+
+    Returns:
+        Selected children of shape ``[batch, num_scopes, num_decomps]``
+    """
+    num_scopes, num_decomps, num_nodes_in, num_sums = log_weights.shape
+    is_selected = selection >= 0
+    # Index the rows of the weights flattened to [scopes * decomps * sums, num_nodes_in]
+    offsets = tf.reshape(tf.range(num_scopes * num_decomps) * num_sums, [num_scopes, num_decomps])
+    rows = tf.where(is_selected, selection, tf.zeros_like(selection)) + offsets
+    log_weight_rows = tf.reshape(tf.transpose(log_weights, (0, 1, 3, 2)), [-1, num_nodes_in])
+    if child_log_probs is None:
+        children = _sample_rows_by_inverse_cdf(log_weight_rows, rows)
+    else:
+        logits = tf.gather(log_weight_rows, rows) + child_log_probs
+        children = tf.random.categorical(tf.reshape(logits, [-1, num_nodes_in]), 1, dtype=tf.int32)
+    return tf.where(is_selected, tf.reshape(children, tf.shape(selection)), UNSELECTED)
+
+
+def _sample_rows_by_inverse_cdf(log_weight_rows, rows):
+    # The CDF of row r is offset by r so that the CDFs of all rows form a single sorted sequence.
+    # A uniform sample u for row r is then located by a binary search for r + u, which avoids
+    # materializing a [batch, ..., num_nodes_in] tensor of logits per sample.
+    num_rows, num_nodes_in = log_weight_rows.shape
+    _, num_scopes, num_decomps = rows.shape
+    cdf = tf.math.cumsum(tf.exp(tf.cast(log_weight_rows, tf.float64)), axis=1, exclusive=True)
+    cdf += tf.cast(tf.range(num_rows), tf.float64)[:, tf.newaxis]
+    # Searching with the batch axis last keeps consecutive searches within the same rows, which is
+    # much more cache friendly than searching in batch-major order
+    rows = tf.reshape(tf.transpose(rows, (1, 2, 0)), [1, -1])
+    u = tf.cast(rows, tf.float64) + tf.random.uniform(tf.shape(rows), dtype=tf.float64)
+    children = tf.searchsorted(tf.reshape(cdf, [1, -1]), u, side='right', out_type=tf.int32) - 1
+    children = tf.reshape(children - rows * num_nodes_in, [num_scopes, num_decomps, -1])
+    return tf.transpose(children, (2, 0, 1))
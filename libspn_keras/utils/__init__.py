@@ -1,5 +1,13 @@
 from libspn_keras.utils.generative_learning_em import GenerativeLearningEM
+from libspn_keras.utils.sequences import bucket_sequences_by_length
+from libspn_keras.utils.cost_summary import cost_summary, CostSummary, LayerCost
+from libspn_keras.utils.batch_size import find_batch_size
 
 __all__ = [
-    "GenerativeLearningEM"
+    "GenerativeLearningEM",
+    "bucket_sequences_by_length",
+    "cost_summary",
+    "CostSummary",
+    "LayerCost",
+    "find_batch_size"
 ]
@@ -0,0 +1,235 @@
+import sys
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+from libspn_keras.utils.cost_summary import cost_summary
+
+# Probing stops once the largest batch size that fits is known up to this fraction
+_RELATIVE_TOLERANCE = 1 / 8
+# Batch size to probe first if the cost of a model cannot be estimated. Probing starts small, since exceeding the
+# memory of the host typically ends the process rather than raising an error
+_INITIAL_BATCH_SIZE = 32
+
+
+def find_batch_size(model, x, y=None, memory_budget=None, max_batch_size=None):
+    """
+    Finds the largest batch size of which a training step of a compiled model fits in a memory
+    budget by probing. A single training step is run at increasing batch sizes, after which the
+    search is narrowed down between the largest batch size that fit and the smallest one that did
+    not. The weights of the model and the state of its optimizer are restored afterwards.
+
+    Peak memory is read from ``tf.config.experimental.get_memory_info`` when training on a GPU
+    and from the peak resident set size of the process when training on a CPU. The latter is only
+    supported on Linux, where the peak can be reset between probes. Every step is traced before
+    it is measured, so that the memory of building its graph is not counted. On TensorFlow
+    versions without ``get_memory_info``, only batch sizes for which the GPU runs out of memory
+    are rejected. If the model is a ``keras.Sequential`` model, the search starts at the batch size
+    suggested by ``cost_summary``, and otherwise at a small batch size.
+
+    Args:
+        model: A compiled ``keras.Model``
+        x: Input data as an array, a ``Tensor`` or a (nested) structure of these, of which the first
+            axis indexes samples
+        y: Targets, if the model is trained with labels
+        memory_budget: Peak memory in bytes that a training step may use on top of the memory that
+            is in use before it, such as the memory of the weights. If ``None``, this is 90% of the
+            memory that is available on the host when training on a CPU, and the memory of the GPU
+            otherwise.
+        max_batch_size: Largest batch size to consider. If ``None``, this is the number of samples.
+
+    Returns:
+        The largest batch size that fits in the memory budget.
+
+    Raises:
+        ValueError: If not even a batch of one sample fits in the memory budget.
+        NotImplementedError: If training on a CPU on a platform other than Linux.
+    """
+    data = (x,) if y is None else (x, y)
+    num_samples = int(tf.nest.flatten(x)[0].shape[0])
+    max_batch_size = num_samples if max_batch_size is None else min(max_batch_size, num_samples)
+    optimizer = model.optimizer
+    # The state of the optimizer is created up front, so that it is restored after probing. State that existed
+    # before is restored to its value before it was built.
+    _ = optimizer.iterations
+    existing_variables = model.variables + _optimizer_variables(optimizer)
+    existing_values = [v.numpy() for v in existing_variables]
+    _build_optimizer(optimizer, model.trainable_variables)
+    train_step = tf.function(model.train_step)
+
+    def probe(batch_size):
+        batch = tf.nest.map_structure(lambda t: tf.convert_to_tensor(t[:batch_size]), data)
+        train_step.get_concrete_function(batch)
+        return lambda: train_step(batch)
+
+    try:
+        return probe_batch_sizes(
+            probe, model.variables + _optimizer_variables(optimizer), max_batch_size, memory_budget=memory_budget,
+            model=model)
+    finally:
+        for v, value in zip(existing_variables, existing_values):
+            v.assign(value)
+
+
+def probe_batch_sizes(probe, variables, max_batch_size, memory_budget=None, model=None):
+    """
+    Finds the largest batch size for which ``probe`` fits in a memory budget. See
+    ``find_batch_size``.
+
+    Args:
+        probe: Function that traces a training step for a given batch size and returns a function
+            without arguments that runs it
+        variables: Variables that are modified by ``probe``, which are restored afterwards
+        max_batch_size: Largest batch size to consider
+        memory_budget: Peak memory in bytes that ``probe`` may use. See ``find_batch_size``.
+        model: Model that is trained by ``probe``, of which the cost is estimated to find the batch
+            size to probe first
+
+    Returns:
+        The largest batch size that fits in the memory budget.
+
+    Raises:
+        ValueError: If not even a batch of one sample fits in the memory budget.
+        NotImplementedError: If probing on a CPU on a platform other than Linux.
+    """
+    device = _default_device()
+    if memory_budget is None and device is None:
+        memory_budget = 0.9 * _available_host_memory()
+    initial_values = [v.numpy() for v in variables]
+
+    # Largest batch size that fits and smallest batch size that does not
+    fitting, exceeding = 0, max_batch_size + 1
+    batch_size = int(np.clip(_estimate_batch_size(model, memory_budget), 1, max_batch_size))
+    try:
+        while True:
+            if _fits(probe, batch_size, memory_budget):
+                fitting = batch_size
+            else:
+                exceeding = batch_size
+            if exceeding - fitting <= max(1, int(fitting * _RELATIVE_TOLERANCE)):
+                break
+            if exceeding > max_batch_size:
+                batch_size = min(2 * fitting, max_batch_size)
+            else:
+                batch_size = (fitting + exceeding) // 2
+    finally:
+        for v, value in zip(variables, initial_values):
+            v.assign(value)
+    if fitting == 0:
+        raise ValueError("A training step does not fit in the memory budget even for a single sample")
+    return fitting
+
+
+def measure_peak_memory(fn):
+    """
+    Measures the peak memory of a function on top of the memory that is in use before it, in the
+    same way as ``find_batch_size``.
+
+    Args:
+        fn: Function without arguments that returns a (nested) structure of ``Tensor`` s, which are
+            fetched to wait for the function to finish
+
+    Returns:
+        The peak memory in bytes, which is 0 when training on a GPU with a TensorFlow version
+        without ``tf.config.experimental.get_memory_info``.
+
+    Raises:
+        NotImplementedError: If measuring on a CPU on a platform other than Linux.
+    """
+    device = _default_device()
+    _reset_peak_memory(device)
+    memory_in_use = _memory_in_use(device)
+    tf.nest.map_structure(lambda t: t.numpy(), fn())
+    return max(_peak_memory(device) - memory_in_use, 0)
+
+
+def _optimizer_variables(optimizer):
+    # ``variables`` is a method of ``OptimizerV2`` and a property of the Keras optimizers of TF >= 2.11
+    return list(optimizer.variables() if callable(optimizer.variables) else optimizer.variables)
+
+
+def _build_optimizer(optimizer, variables):
+    if hasattr(optimizer, "build"):
+        optimizer.build(variables)
+        return
+    # Optimizers without ``build`` create their state when gradients are first applied. Zero gradients leave the
+    # variables unchanged.
+    optimizer.apply_gradients([(tf.zeros_like(v), v) for v in variables])
+
+
+def _fits(probe, batch_size, memory_budget):
+    run_step = probe(batch_size)
+    try:
+        peak_memory = measure_peak_memory(run_step)
+    except tf.errors.ResourceExhaustedError:
+        return False
+    return memory_budget is None or peak_memory <= memory_budget
+
+
+def _default_device():
+    return "GPU:0" if tf.config.list_logical_devices("GPU") else None
+
+
+def _estimate_batch_size(model, memory_budget):
+    if not isinstance(model, keras.Sequential) or memory_budget is None:
+        return _INITIAL_BATCH_SIZE
+    return cost_summary(model, batch_size=1).max_batch_size(memory_budget)
+
+
+def _reset_peak_memory(device):
+    if device is not None:
+        if hasattr(tf.config.experimental, "reset_memory_stats"):
+            tf.config.experimental.reset_memory_stats(device)
+        return
+    # Resets the peak resident set size to the current one, which is only possible on Linux
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        _raise_unsupported_platform()
+
+
+def _memory_in_use(device):
+    if device is not None:
+        if not hasattr(tf.config.experimental, "get_memory_info"):
+            return 0
+        return tf.config.experimental.get_memory_info(device)["current"]
+    return _proc_status()["VmRSS"]
+
+
+def _peak_memory(device):
+    if device is not None:
+        if not hasattr(tf.config.experimental, "get_memory_info"):
+            return 0
+        return tf.config.experimental.get_memory_info(device)["peak"]
+    return _proc_status()["VmHWM"]
+
+
+def _available_host_memory():
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    _raise_unsupported_platform()
+
+
+def _proc_status():
+    try:
+        with open("/proc/self/status") as f:
+            lines = f.readlines()
+    except OSError:
+        _raise_unsupported_platform()
+    return {
+        key: int(value.split()[0]) * 1024
+        for key, value in (line.split(":", 1) for line in lines) if key in ("VmRSS", "VmHWM")
+    }
+
+
+def _raise_unsupported_platform():
+    raise NotImplementedError(
+        "Measuring the peak memory of the host requires the /proc filesystem of Linux, which is not available on "
+        "platform {}. Pass a batch size rather than 'auto' when training on a CPU.".format(sys.platform))
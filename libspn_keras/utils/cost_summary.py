@@ -0,0 +1,208 @@
+from collections import namedtuple
+
+import numpy as np
+
+from libspn_keras.backprop_mode import BackpropMode
+from libspn_keras.layers import BaseLeaf, DenseSum, DenseProduct, ReduceProduct, RootSum, Conv2DSum, \
+    Local2DSum, Conv2DProduct
+
+LayerCost = namedtuple(
+    "LayerCost", ["name", "output_shape", "flops", "parameter_bytes", "activation_bytes", "temporary_bytes"])
+LayerCost.__doc__ = """
+Estimated cost of a single layer for a single sample, except for ``parameter_bytes``.
+
+Args:
+    name: Name of the layer
+    output_shape: Output shape of the layer without the batch axis
+    flops: Floating point operations of the forward pass
+    parameter_bytes: Bytes of the weights of the layer, including non-trainable ones
+    activation_bytes: Bytes of the tensors that are kept for the backward pass, such as the
+        exponentiated inputs and the outputs of sums
+    temporary_bytes: Bytes of tensors that only exist while the layer or the next layer is
+        evaluated, such as the outputs of products, which only the next sum needs, and the pairwise
+        products of sums and their inputs that are used to find the winning child with hard EM
+"""
+
+
+class CostSummary:
+    """
+    Per-layer cost estimates of an SPN. See ``cost_summary``.
+
+    Args:
+        layer_costs: List of ``LayerCost`` per layer
+        batch_size: Batch size to report costs for
+        memory_budget: Memory budget in bytes to suggest a batch size for, or ``None``
+    """
+
+    def __init__(self, layer_costs, batch_size, memory_budget=None):
+        self.layer_costs = layer_costs
+        self.batch_size = batch_size
+        self.memory_budget = memory_budget
+
+    @property
+    def flops(self):
+        """ Floating point operations of the forward pass for a batch """
+        return self.batch_size * sum(cost.flops for cost in self.layer_costs)
+
+    @property
+    def parameter_bytes(self):
+        """ Bytes of the weights of all layers """
+        return sum(cost.parameter_bytes for cost in self.layer_costs)
+
+    @property
+    def bytes_per_sample(self):
+        """
+        Estimated bytes per sample of a training step, i.e. the activations that are kept for
+        the backward pass and the temporary tensors of the most expensive layer
+        """
+        return sum(cost.activation_bytes for cost in self.layer_costs) + \
+            max([cost.temporary_bytes for cost in self.layer_costs] + [0])
+
+    def training_step_bytes(self, batch_size=None):
+        """
+        Estimates the peak memory of a training step. The weights are counted twice to account
+        for their gradients. Optimizer state, such as the moments of Adam, is not included.
+
+        Args:
+            batch_size: Batch size. If ``None``, uses the batch size of the summary.
+
+        Returns:
+            Estimated number of bytes
+        """
+        batch_size = self.batch_size if batch_size is None else batch_size
+        return 2 * self.parameter_bytes + batch_size * self.bytes_per_sample
+
+    def max_batch_size(self, memory_budget=None):
+        """
+        Suggests the largest batch size of which a training step fits in a memory budget.
+
+        Args:
+            memory_budget: Memory budget in bytes. If ``None``, uses the budget of the summary.
+
+        Returns:
+            The largest batch size for which ``training_step_bytes`` does not exceed the budget,
+            which is 0 if not even the weights fit.
+        """
+        memory_budget = self.memory_budget if memory_budget is None else memory_budget
+        if memory_budget is None:
+            raise ValueError("No memory budget given")
+        return max(0, int((memory_budget - 2 * self.parameter_bytes) // max(self.bytes_per_sample, 1)))
+
+    def __str__(self):
+        rows = [("Layer", "Output shape", "FLOPs", "Params", "Activations", "Temporary")]
+        for cost in self.layer_costs:
+            rows.append((
+                cost.name, str(cost.output_shape), _format_count(self.batch_size * cost.flops),
+                _format_bytes(cost.parameter_bytes), _format_bytes(self.batch_size * cost.activation_bytes),
+                _format_bytes(self.batch_size * cost.temporary_bytes)
+            ))
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        lines = ["  ".join(value.ljust(width) for value, width in zip(row, widths)) for row in rows]
+        lines.insert(1, "-" * len(lines[0]))
+        lines += [
+            "-" * len(lines[0]),
+            "Batch size: {}".format(self.batch_size),
+            "Forward FLOPs: {}".format(_format_count(self.flops)),
+            "Training step memory: {}".format(_format_bytes(self.training_step_bytes())),
+        ]
+        if self.memory_budget is not None:
+            lines.append("Suggested batch size for {}: {}".format(
+                _format_bytes(self.memory_budget), self.max_batch_size()))
+        return "\n".join(lines)
+
+
+def cost_summary(model, batch_size, backprop_mode=None, memory_budget=None):
+    """
+    Estimates the FLOPs and memory of each layer of an SPN from the shapes of its layers, without
+    evaluating it. The sizes of dense products grow as ``num_nodes ** num_factors`` and those of
+    spatial products as ``num_channels_in ** prod(kernel_size)``, so this makes it possible to
+    check whether a model fits in memory before training it. The estimates are approximate, but
+    account for the tensors that dominate memory use, including the pairwise products of sums and
+    their inputs that are used by hard EM.
+
+    Args:
+        model: A built ``keras.Sequential`` SPN or functional model of which the layers have
+            known output shapes
+        batch_size: Batch size to report costs for
+        backprop_mode: ``BackpropMode`` to assume for all sum layers. If ``None``, the backprop
+            mode of each sum layer is used.
+        memory_budget: Memory budget in bytes for which to suggest the largest batch size. If
+            ``None``, no batch size is suggested.
+
+    Returns:
+        A ``CostSummary``, which can be printed as a table.
+    """
+    layer_costs = []
+    for layer in model.layers:
+        output_shape = tuple(layer.output_shape[1:])
+        input_shape = tuple(layer.input_shape[1:])
+        num_out = int(np.prod(output_shape))
+        num_in = int(np.prod(input_shape))
+        parameter_bytes = sum(
+            int(np.prod(weight.shape)) * weight.dtype.size for weight in layer.weights)
+        flops, kept, temporary = _layer_cost(
+            layer, input_shape, output_shape, num_in, num_out,
+            backprop_mode or getattr(layer, "backprop_mode", None))
+        layer_costs.append(LayerCost(
+            name="{} ({})".format(layer.name, type(layer).__name__), output_shape=output_shape, flops=flops,
+            parameter_bytes=parameter_bytes, activation_bytes=4 * kept, temporary_bytes=4 * temporary
+        ))
+    return CostSummary(layer_costs, batch_size, memory_budget=memory_budget)
+
+
+def _layer_cost(layer, input_shape, output_shape, num_in, num_out, backprop_mode):
+    """
+    Estimates the cost of a layer per sample.
+
+    Returns:
+        A tuple of the FLOPs, the number of values that are kept for the backward pass and the
+        number of values of temporary tensors.
+    """
+    if isinstance(layer, RootSum):
+        return 2 * num_in, num_in + num_out, num_in
+    if isinstance(layer, (DenseSum, Conv2DSum, Local2DSum)):
+        num_sums_in, num_sums_out = input_shape[-1], output_shape[-1]
+        # Number of scope and decomposition pairs or spatial positions
+        num_positions = num_out // num_sums_out
+        pairwise_products = num_positions * num_sums_in * num_sums_out
+        if backprop_mode == BackpropMode.HARD_EM and not layer.logspace_accumulators:
+            # Pairwise products are kept for finding the winning child in the backward pass, in
+            # which the winners are selected and one-hot encoded
+            return 3 * pairwise_products, pairwise_products + num_out, 2 * pairwise_products
+        if backprop_mode == BackpropMode.HARD_EM_UNWEIGHTED and not layer.logspace_accumulators:
+            # Winners are one-hot encoded per sum in the backward pass
+            return 2 * pairwise_products + num_in, num_in + num_out, 2 * pairwise_products
+        # The exponentiated input is kept for the gradient of the matrix multiplication and the
+        # output for the gradient of the logarithm
+        return 2 * pairwise_products + num_in + num_out, num_in + num_out, num_in
+    # The gradients of products and of layers that rearrange their input do not depend on their
+    # input or output, so their output is only needed until the next layer is evaluated
+    if isinstance(layer, DenseProduct):
+        return num_out * (layer.num_factors - 1), 0, num_out
+    if isinstance(layer, ReduceProduct):
+        return num_in, 0, num_out
+    if isinstance(layer, Conv2DProduct):
+        # Products are computed by convolutions with one-hot kernels
+        kernel_volume = int(np.prod(layer.kernel_size))
+        if layer.depthwise:
+            return 2 * num_out * kernel_volume, 0, num_in + num_out
+        return 2 * num_out * kernel_volume * input_shape[-1], 0, num_in + num_out
+    if isinstance(layer, BaseLeaf):
+        return num_out, num_out, num_in
+    return 0, 0, num_out
+
+
+def _format_count(count):
+    for unit in ["", "K", "M", "G"]:
+        if abs(count) < 1000:
+            return "{:.1f}{}".format(count, unit) if unit else str(int(count))
+        count /= 1000
+    return "{:.1f}T".format(count)
+
+
+def _format_bytes(num_bytes):
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if abs(num_bytes) < 1024:
+            return "{:.1f} {}".format(num_bytes, unit) if unit != "B" else "{} B".format(int(num_bytes))
+        num_bytes /= 1024
+    return "{:.1f} TiB".format(num_bytes)
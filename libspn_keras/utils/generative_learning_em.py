@@ -1,19 +1,34 @@
 from collections import namedtuple
 import tensorflow as tf
 
+from libspn_keras.utils.batch_size import probe_batch_sizes
+
 _AccumulatorTuple = namedtuple(
     "AccumulatorTuple", ['first_order_moment_denom_accum', 'first_order_moment_num_accum', 'second_order_moment_denom_accum', 'second_order_moment_num_accum'])
 
+# Largest batch size that is considered when the batch size is found automatically
+_MAX_AUTO_BATCH_SIZE = 8192
+
 
 class GenerativeLearningEM:
 
-    def __init__(self, spn, online=True, reset_per_epoch=False, with_labels=False, with_sequence_lens=False):
+    def __init__(self, spn, online=True, reset_per_epoch=False, with_labels=False, with_sequence_lens=False,
+                 window_size=None, truncate_windows=False):
         """
         Utility class for learning SPNs in generative settings. The inner loop does not apply to (x_i, y_i) pairs,
         but simply to x_i. Will use ``libspn_keras.optimizers.OnlineExpectationMaximization`` as the optimizer.
 
         Args:
             spn: An instance of ``tf.keras.Model`` representing the SPN to train
+            window_size: If not ``None``, a ``DynamicSumProductNetwork`` is trained on windows of this many
+                timesteps, so that only the activations of a single window are kept for computing the EM
+                statistics rather than those of all timesteps. By default, the activations of each window are
+                recomputed in a backward pass over the windows, which gives the same statistics as training on
+                whole sequences at the cost of evaluating the network twice. Requires ``with_sequence_lens``.
+            truncate_windows: If ``True``, the statistics of each window are computed from the root at the end of
+                that window, with the interface state carried over from the previous window but without
+                propagating statistics past it. This evaluates the network only once, but only approximates the
+                statistics of whole sequences.
         """
         self._spn = spn
         self._trainable_variable_copies = [_copy_variable(v) for v in self._spn.trainable_variables]
@@ -22,6 +37,10 @@ class GenerativeLearningEM:
         self._reset_per_epoch = reset_per_epoch
         self._with_labels = with_labels
         self._with_sequence_lens = with_sequence_lens
+        self._window_size = window_size
+        self._truncate_windows = truncate_windows
+        if window_size is not None and (with_labels or not with_sequence_lens):
+            raise ValueError("Training on windows requires sequence lengths and no labels")
 
     @tf.function
     def _train_one_step(self, train_batch):
@@ -34,6 +53,11 @@ class GenerativeLearningEM:
         Returns:
             The log marginal likelihood
         """
+        if self._window_size is not None:
+            log_likelihood, grads = self._windowed_gradients(*train_batch)
+            self._apply_grads(grads)
+            return log_likelihood
+
         with tf.GradientTape() as tape:
             if self._with_labels:
                 if self._with_sequence_lens:
@@ -50,22 +74,113 @@ class GenerativeLearningEM:
                 log_likelihood = self._spn(x)
 
         grads = tape.gradient(log_likelihood, self._spn.trainable_variables)
+        self._apply_grads(grads)
+        return log_likelihood
 
+    def _apply_grads(self, grads):
         vars_to_assign = self._spn.trainable_variables if self._online else self._trainable_variable_copies
 
         for v, g in zip(vars_to_assign, grads):
             v.assign(v + g)
 
-        return log_likelihood
+    def _windowed_gradients(self, x, sequence_lens):
+        """
+        Computes the EM statistics of a ``DynamicSumProductNetwork`` one window of timesteps at a time.
+
+        Args:
+            x: Pre-padded sequences of shape ``[num_batch, max_sequence_len, num_variables]``
+            sequence_lens: Length of each sequence of shape ``[num_batch]``
+
+        Returns:
+            A tuple of the log likelihood of the sequences and the gradients of the trainable variables.
+        """
+        spn, window_size = self._spn, self._window_size
+        input_steps, step_masks, _ = spn.time_major_steps([x, sequence_lens])
+
+        # Windows are aligned to the end of the sequences by padding the start, so that the final window ends
+        # at the root. [num_windows, window_size, num_batch, ...]
+        num_steps, num_batch = tf.shape(step_masks)[0], tf.shape(step_masks)[1]
+        num_windows = (num_steps + window_size - 1) // window_size
+        num_pad = num_windows * window_size - num_steps
+        input_windows = tf.reshape(
+            tf.pad(input_steps, [[num_pad, 0], [0, 0], [0, 0]]),
+            tf.concat([[num_windows, window_size], tf.shape(input_steps)[1:]], axis=0))
+        mask_windows = tf.reshape(tf.pad(step_masks, [[num_pad, 0], [0, 0]]), [num_windows, window_size, num_batch])
+        initial_state = spn.initial_interface_state(num_batch)
+        variables = spn.trainable_variables
+
+        def evaluate_window(i, last_prod):
+            # The interface state is recomputed from the final temporal product of the previous window, so that
+            # the statistics of the interface sums at window boundaries are kept
+            interface_t_minus_1 = tf.cond(
+                i > 0,
+                lambda: spn.interface_network_t_minus_1(last_prod) * tf.reshape(mask_windows[i - 1, -1], [-1, 1, 1, 1]),
+                lambda: initial_state)
+            _, prods = spn.evaluate_steps(input_windows[i], mask_windows[i], interface_t_minus_1)
+            return prods[-1]
+
+        def root(last_prod, i):
+            return spn.top_network(last_prod) * tf.expand_dims(mask_windows[i, -1], axis=1)
+
+        # Final temporal product of each window, of which only the final one of the previous window is needed to
+        # evaluate a window
+        last_prods = tf.TensorArray(tf.float32, num_windows, clear_after_read=False)
+        last_prod = tf.zeros_like(spn.temporal_product([initial_state, initial_state]))
+        grads = [tf.zeros_like(v) for v in variables]
+        for i in tf.range(num_windows):
+            if self._truncate_windows:
+                with tf.GradientTape() as tape:
+                    next_last_prod = evaluate_window(i, last_prod)
+                    log_likelihood = root(next_last_prod, i)
+                grads = _add_grads(grads, tape.gradient(
+                    log_likelihood, variables, unconnected_gradients=tf.UnconnectedGradients.ZERO))
+            else:
+                last_prods = last_prods.write(i, last_prod)
+                next_last_prod = evaluate_window(i, last_prod)
+            last_prod = next_last_prod
 
-    def fit(self, train_data: tf.data.Dataset, epochs, steps_per_epoch=None):
+        log_likelihood = root(last_prod, num_windows - 1)
+        if self._truncate_windows:
+            return log_likelihood, grads
+
+        # Backward pass over the windows in which each window is evaluated again, starting with the gradients
+        # with respect to its final temporal product that were obtained from the next window
+        with tf.GradientTape() as tape:
+            previous_last_prod = last_prods.read(num_windows - 1)
+            tape.watch(previous_last_prod)
+            log_likelihood = root(evaluate_window(num_windows - 1, previous_last_prod), num_windows - 1)
+        *grads, grad_last_prod = tape.gradient(
+            log_likelihood, variables + [previous_last_prod], unconnected_gradients=tf.UnconnectedGradients.ZERO)
+        grads = _add_grads([tf.zeros_like(v) for v in variables], grads)
+        for i in tf.range(num_windows - 2, -1, -1):
+            with tf.GradientTape() as tape:
+                previous_last_prod = last_prods.read(i)
+                tape.watch(previous_last_prod)
+                window_last_prod = evaluate_window(i, previous_last_prod)
+            *window_grads, grad_last_prod = tape.gradient(
+                window_last_prod, variables + [previous_last_prod], output_gradients=grad_last_prod,
+                unconnected_gradients=tf.UnconnectedGradients.ZERO)
+            grads = _add_grads(grads, window_grads)
+        return log_likelihood, grads
+
+    def fit(self, train_data: tf.data.Dataset, epochs, steps_per_epoch=None, batch_size=None, memory_budget=None):
         """
         Fits the parameters of the SPN
 
         Args:
             train_data: An instance of ``tf.data.Dataset`` from which we get batches of :math:`x_i`
             steps_per_epoch: Steps per epoch
+            batch_size: If not ``None``, ``train_data`` holds single samples rather than batches, which are
+                batched with this batch size. If ``'auto'``, the largest batch size of which a training step fits
+                in ``memory_budget`` is used, which is found by probing training steps on the first samples. See
+                ``libspn_keras.utils.find_batch_size``. Samples must have the same shape to be batched.
+            memory_budget: Peak memory in bytes that a training step may use on top of the memory that is in use
+                before it when ``batch_size`` is ``'auto'``
         """
+        if batch_size == 'auto':
+            batch_size = self.find_batch_size(train_data, memory_budget=memory_budget)
+        if batch_size is not None:
+            train_data = train_data.batch(batch_size)
         for epoch in range(epochs):
             log_probability_x = 0.0
             samples = 0
@@ -88,6 +203,31 @@ class GenerativeLearningEM:
             log_probability_x /= tf.cast(samples, tf.float32)
             tf.print('Epoch', epoch, ': mean log(p(X)) =', log_probability_x)
 
+    def find_batch_size(self, train_data, memory_budget=None):
+        """
+        Finds the largest batch size of which a training step fits in a memory budget by probing training steps
+        on the first samples of ``train_data``. The parameters of the SPN are restored afterwards. See
+        ``libspn_keras.utils.find_batch_size``.
+
+        Args:
+            train_data: An instance of ``tf.data.Dataset`` of single samples
+            memory_budget: Peak memory in bytes that a training step may use on top of the memory that is in use
+                before it
+
+        Returns:
+            The largest batch size that fits in the memory budget.
+        """
+        probe_batch = next(iter(train_data.batch(_MAX_AUTO_BATCH_SIZE)))
+
+        def probe(batch_size):
+            batch = tf.nest.map_structure(lambda t: t[:batch_size], probe_batch)
+            self._train_one_step.get_concrete_function(batch)
+            return lambda: self._train_one_step(batch)
+
+        return probe_batch_sizes(
+            probe, self._spn.variables + self._trainable_variable_copies,
+            max_batch_size=int(tf.shape(probe_batch[0])[0]), memory_budget=memory_budget, model=self._spn)
+
     def evaluate(self, test_dataset):
         log_marginal_likelihood = 0.0
         samples = 0
@@ -105,3 +245,6 @@ def _copy_variable(v):
         initial_value=tf.identity(v)
     )
 
+
+def _add_grads(grads, other_grads):
+    return [g + tf.convert_to_tensor(other) for g, other in zip(grads, other_grads)]
@@ -0,0 +1,45 @@
+import numpy as np
+import tensorflow as tf
+
+
+def bucket_sequences_by_length(sequences, batch_size, shuffle=True, seed=None):
+    """
+    Groups sequences of similar lengths into batches for a ``DynamicSumProductNetwork``. Sequences
+    are sorted by length and split into batches of consecutive sequences, which are padded at the
+    start to the length of the longest sequence in their batch. Since a ``DynamicSumProductNetwork``
+    only evaluates the timesteps of the longest sequence in a batch, a few long sequences do not
+    make all other batches pay for their length.
+
+    Args:
+        sequences: List of arrays of shape ``[sequence_len, num_variables]``
+        batch_size: Maximum number of sequences per batch
+        shuffle: If ``True``, the order of the batches and the order of sequences of equal length
+            are shuffled for every pass over the dataset.
+        seed: Seed for shuffling
+
+    Returns:
+        A ``tf.data.Dataset`` of ``(x, sequence_lens)`` tuples in which ``x`` has shape
+        ``[num_batch, max_sequence_len, num_variables]``, which can be passed to ``fit`` directly.
+    """
+    sequences = [np.asarray(sequence) for sequence in sequences]
+    sequence_lens = np.asarray([len(sequence) for sequence in sequences])
+    num_vars, dtype = sequences[0].shape[1], sequences[0].dtype
+    rng = np.random.RandomState(seed)
+
+    def generate_batches():
+        order = rng.permutation(len(sequences)) if shuffle else np.arange(len(sequences))
+        order = order[np.argsort(sequence_lens[order], kind='stable')]
+        batches = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+        if shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        for batch in batches:
+            max_sequence_len = sequence_lens[batch].max()
+            x = np.zeros([len(batch), max_sequence_len, num_vars], dtype=dtype)
+            for row, i in enumerate(batch):
+                x[row, max_sequence_len - sequence_lens[i]:] = sequences[i]
+            yield x, sequence_lens[batch].astype(np.int32)
+
+    return tf.data.Dataset.from_generator(
+        generate_batches, output_types=(tf.as_dtype(dtype), tf.int32),
+        output_shapes=([None, None, num_vars], [None])
+    )
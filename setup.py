@@ -136,7 +136,7 @@ setup(
     #
     #   py_modules=["my_module"],
     #
-    packages=find_packages(exclude='./examples'),  # Required
+    packages=find_packages(exclude=['examples', 'examples.*', 'benchmarks', 'benchmarks.*', 'tests', 'tests.*']),  # Required
 
     # Specify which Python versions you support. In contrast to the
     # 'Programming Language' classifiers above, 'pip install' will check this
@@ -0,0 +1,64 @@
+import numpy as np
+from tensorflow import keras
+from tensorflow import test as tftest
+
+from benchmarks import datasets
+from benchmarks.compare import compare
+from benchmarks.run import run
+from benchmarks.training import SIZES, CASES, train
+
+
+class TestBenchmarks(tftest.TestCase):
+
+    def test_run_and_compare(self):
+        grid = dict(num_batch=[4], num_scopes=[4], num_nodes=[2])
+        results = run(grid, case_names=["DenseSum", "IndicatorLeaf"], backprop_modes=["gradient", "hard_em"],
+                      num_repeats=1)
+        self.assertEqual(
+            [(result["name"], result["backprop_mode"]) for result in results],
+            [("DenseSum", "gradient"), ("DenseSum", "hard_em"), ("IndicatorLeaf", None)])
+        self.assertIsNone(results[0]["em_step"])
+        self.assertGreater(results[1]["em_step"]["samples_per_second"], 0.0)
+        # Indicators have neither weights nor a differentiable input
+        self.assertIsNone(results[2]["backward"])
+
+        rows = compare(dict(results=results), dict(results=results))
+        self.assertEqual(len(rows), 3)
+        for _, throughput_ratios, _, mark in rows:
+            for ratio in throughput_ratios:
+                if ratio is not None:
+                    self.assertAllClose(ratio, 1.0)
+            self.assertEqual(mark, "")
+
+    def test_datasets_are_deterministic(self):
+        generators = [
+            lambda seed: datasets.binary(8, 5, seed=seed),
+            lambda seed: datasets.categorical(8, 5, num_values=3, seed=seed),
+            lambda seed: datasets.continuous(8, 5, seed=seed),
+            lambda seed: datasets.images(8, 4, 6, num_channels=2, seed=seed),
+        ]
+        shapes = [(8, 5), (8, 5), (8, 5), (8, 4, 6, 2)]
+        for generate, shape in zip(generators, shapes):
+            self.assertEqual(generate(0).shape, shape)
+            self.assertAllEqual(generate(0), generate(0))
+            self.assertNotAllClose(generate(0), generate(1))
+        self.assertAllInSet(datasets.categorical(8, 5, num_values=3), [0, 1, 2])
+
+        sequences = datasets.sequences(8, 3, min_len=2, max_len=5, seed=0)
+        for sequence, other in zip(sequences, datasets.sequences(8, 3, min_len=2, max_len=5, seed=0)):
+            self.assertAllEqual(sequence, other)
+        x, sequence_lens = datasets.pre_pad(sequences)
+        self.assertEqual(x.shape, (8, sequence_lens.max(), 3))
+        self.assertAllInRange(sequence_lens, 2, 5)
+        self.assertAllEqual(x[0, -sequence_lens[0]:], sequences[0])
+
+    def test_train_reaches_target(self):
+        # Other tests look up layers by their default names
+        self.addCleanup(keras.backend.clear_session)
+        size = dict(SIZES["small"], num_samples=64)
+        case = next(case for case in CASES if case.name == "dense/binary")
+        result = train(case, size, "em", "em", batch_size=16, epochs=3, target=-np.inf)
+        # The target is reached after the first epoch
+        self.assertEqual(len(result["history"]), 2)
+        self.assertEqual(result["time_to_target"], result["history"][-1]["seconds"])
+        self.assertGreater(result["history"][-1]["log_likelihood"], result["history"][0]["log_likelihood"])
@@ -1,6 +1,12 @@
+import sys
+import unittest
+
+import numpy as np
 import tensorflow as tf
 from tensorflow import test as tftest
 
+import libspn_keras as spnk
+
 from libspn_keras.losses import NegativeLogLikelihood
 from libspn_keras.metrics import LogLikelihood
 from libspn_keras.optimizers import OnlineExpectationMaximization
@@ -57,3 +63,104 @@ class TestDiscreteSPN(tftest.TestCase):
         expected = root_out(product1_out(sum0_out(product0_out(indicators(self.data)))))
         self.assertAllClose(got, expected)
 
+    def test_checkpoint_products_gradients(self):
+        self._assert_same_outputs_and_gradients(dict(checkpoint_products=True))
+
+    def test_scope_chunks_match_full_evaluation(self):
+        self._assert_same_outputs_and_gradients(dict(scope_chunk_size=4))
+        self._assert_same_outputs_and_gradients(dict(scope_chunk_size=2, checkpoint_products=True))
+
+    def test_cost_summary(self):
+        spn = get_discrete_model()
+        summaries = {
+            backprop_mode: spnk.utils.cost_summary(spn, batch_size=32, backprop_mode=backprop_mode)
+            for backprop_mode in [spnk.BackpropMode.GRADIENT, spnk.BackpropMode.HARD_EM]
+        }
+        summary = summaries[spnk.BackpropMode.GRADIENT]
+        self.assertEqual([cost.output_shape for cost in summary.layer_costs], [
+            tuple(layer.output_shape[1:]) for layer in spn.layers])
+        self.assertGreater(
+            summaries[spnk.BackpropMode.HARD_EM].bytes_per_sample, summary.bytes_per_sample)
+
+        budget = summary.training_step_bytes(batch_size=100)
+        self.assertEqual(summary.max_batch_size(budget), 100)
+        with self.assertRaises(ValueError):
+            summary.max_batch_size()
+        self.assertIn("Suggested batch size", str(spnk.utils.cost_summary(spn, 32, memory_budget=budget)))
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "Peak host memory is only measured on Linux")
+    def test_find_batch_size(self):
+        spn = get_discrete_model()
+        spn.compile(optimizer=OnlineExpectationMaximization(), loss=NegativeLogLikelihood())
+        weights = spn.get_weights()
+
+        self.assertEqual(spnk.utils.find_batch_size(spn, self.data, memory_budget=2 ** 40), len(self.data))
+        self.assertEqual(spnk.utils.find_batch_size(spn, self.data, memory_budget=2 ** 40, max_batch_size=2), 2)
+        with self.assertRaises(ValueError):
+            spnk.utils.find_batch_size(spn, self.data, memory_budget=-1)
+        for weight, probed_weight in zip(weights, spn.get_weights()):
+            self.assertAllEqual(probed_weight, weight)
+        self.assertEqual(int(spn.optimizer.iterations), 0)
+
+        spn.fit(self.data, batch_size='auto', memory_budget=2 ** 40, epochs=1)
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "Peak host memory is only measured on Linux")
+    def test_generative_learning_em_auto_batch_size(self):
+        em = spnk.GenerativeLearningEM(get_discrete_model())
+        dataset = tf.data.Dataset.from_tensor_slices((self.data,))
+        self.assertEqual(em.find_batch_size(dataset, memory_budget=2 ** 40), len(self.data))
+        em.fit(dataset, epochs=1, batch_size='auto', memory_budget=2 ** 40)
+
+    def test_profile_layers(self):
+        spn = get_discrete_model()
+        summary = spnk.profile_layers(spn, self.data, num_repeats=2)
+        profiles = {profile.name: profile for profile in summary.layer_profiles}
+        # Layer names are generated by Keras and depend on the layers that were created before
+        layer_names = [layer.name for layer in spn.layers]
+        self.assertEqual(list(profiles), layer_names)
+        _, leaf_name, _, product_name, sum_name, _, root_name = layer_names
+
+        # Indicators of a binary variable are -inf for the value that the variable does not take
+        self.assertAllClose(profiles[leaf_name].neg_inf_fraction, 0.5)
+        self.assertIsNone(profiles[product_name].tie_fraction)
+        self.assertBetween(profiles[sum_name].tie_fraction, 0.0, 1.0)
+        self.assertBetween(profiles[root_name].tie_fraction, 0.0, 1.0)
+        self.assertGreater(profiles[sum_name].backward_time, 0.0)
+        self.assertIn("Backward time", str(summary))
+
+    def test_layer_profiler(self):
+        spn = get_discrete_model()
+        spn.compile(optimizer=OnlineExpectationMaximization(), loss=NegativeLogLikelihood())
+        log_dir = self.get_temp_dir()
+        profiler = spnk.LayerProfiler(self.data, log_dir=log_dir, timers=False, verbose=False)
+        spn.fit(self.data, batch_size=4, epochs=2, callbacks=[profiler])
+
+        self.assertEqual([num_batches for num_batches, _ in profiler.summaries], [4, 8])
+        self.assertIsNone(profiler.summaries[-1][1].forward_time)
+        self.assertNotEmpty(tf.io.gfile.glob(log_dir + "/events.out.tfevents.*"))
+
+    def _assert_same_outputs_and_gradients(self, execution_kwargs):
+        variables = [spnk.RegionVariable(i) for i in range(8)]
+        region_graph = spnk.RegionNode([
+            spnk.RegionNode([spnk.RegionNode(variables[:2]), spnk.RegionNode(variables[2:4])]),
+            spnk.RegionNode([spnk.RegionNode(variables[4:6]), spnk.RegionNode(variables[6:])])
+        ])
+        spns = [
+            spnk.region_graph_to_dense_spn(
+                region_graph, spnk.layers.NormalLeaf(num_components=3), num_sums_iterable=iter([4, 4]),
+                return_weighted_child_logits=False, **kwargs)
+            for kwargs in [{}, execution_kwargs]
+        ]
+        spns[0].set_weights([np.random.uniform(0.5, 2.0, size=w.shape) for w in spns[0].get_weights()])
+        spns[1].set_weights(spns[0].get_weights())
+        x = np.random.randn(16, 8).astype(np.float32)
+
+        outputs, grads = [], []
+        for spn in spns:
+            with tf.GradientTape() as tape:
+                outputs.append(spn(x))
+            grads.append(tape.gradient(outputs[-1], spn.trainable_variables))
+
+        self.assertAllClose(outputs[1], outputs[0])
+        for other_grad, grad in zip(grads[1], grads[0]):
+            self.assertAllClose(other_grad, grad)
@@ -1,6 +1,8 @@
+import numpy as np
 import tensorflow as tf
 from tensorflow import test as tftest
 
+import libspn_keras as spnk
 from tests.utils import NUM_VARS, get_discrete_data, get_dynamic_model
 
 tf.config.experimental_run_functions_eagerly(True)
@@ -39,3 +41,190 @@ class TestDynamicSPN(tftest.TestCase):
         self.assertEqual(tf.reduce_logsumexp(log_values_1_padded), 0.0)
         self.assertEqual(tf.reduce_logsumexp(log_values_2_padded), 0.0)
         self.assertAllClose(tf.exp(tf.reduce_logsumexp(log_values_concat)), 2.0)
+
+    def test_streaming_filter_matches_full_sequences(self):
+        streaming_filter = spnk.StreamingFilter(self.dynamic_spn, initial_capacity=2)
+        num_streams = self.data_2_steps.shape[0]
+        stream_ids = np.arange(num_streams)
+
+        # Streams are advanced in different orders and batch compositions
+        first_steps = [streaming_filter(ids, self.data_2_steps[ids, 0]) for ids in np.split(stream_ids, 2)]
+        second_step = streaming_filter(stream_ids[::-1], self.data_2_steps[::-1, 1])[::-1]
+
+        self.assertAllClose(
+            tf.concat(first_steps, axis=0), self.dynamic_spn([self.data_2_steps[:, :1], [1] * num_streams]))
+        self.assertAllClose(second_step, self.dynamic_spn([self.data_2_steps, [2] * num_streams]))
+
+        streaming_filter.reset(stream_ids[:1])
+        restarted = streaming_filter(stream_ids[:1], self.data_2_steps[:1, 1])
+        self.assertAllClose(restarted, self.dynamic_spn([self.data_2_steps[:1, 1:], [1]]))
+        self.assertEqual(streaming_filter.num_streams, num_streams)
+
+    def test_ragged_matches_pre_padded(self):
+        data_1_padded = tf.pad(self.data_1_steps, [[0, 0], [1, 0], [0, 0]])
+        sequence_lens = [1] * self.data_1_steps.shape[0] + [2] * self.data_2_steps.shape[0]
+        ragged = tf.RaggedTensor.from_row_lengths(
+            np.concatenate([self.data_1_steps.reshape(-1, NUM_VARS), self.data_2_steps.reshape(-1, NUM_VARS)]),
+            sequence_lens)
+
+        self.assertAllClose(
+            self.dynamic_spn(ragged),
+            self.dynamic_spn([tf.concat([data_1_padded, self.data_2_steps], axis=0), sequence_lens]))
+
+    def test_bucket_sequences_by_length(self):
+        sequences = [np.full([sequence_len, NUM_VARS], sequence_len) for sequence_len in [3, 1, 2, 1, 3]]
+
+        batches = list(spnk.utils.bucket_sequences_by_length(sequences, batch_size=2, shuffle=False))
+
+        self.assertEqual([sequence_lens.numpy().tolist() for _, sequence_lens in batches], [[1, 1], [2, 3], [3]])
+        x, sequence_lens = batches[1]
+        self.assertAllEqual(x[0, :, 0], [0, 2, 2])
+        self.assertAllEqual(x[1, :, 0], [3, 3, 3])
+
+    def test_most_probable_explanation_maximizes_max_product_value(self):
+        dynamic_spn = get_dynamic_model()
+        for network in [dynamic_spn.interface_network_t0, dynamic_spn.interface_network_t_minus_1]:
+            accumulators = network.layers[0].weights[0]
+            accumulators.assign(np.random.uniform(0.1, 1.0, size=accumulators.shape))
+        data_1_padded = np.pad(self.data_1_steps, [[0, 0], [1, 0], [0, 0]])
+        x = np.concatenate([data_1_padded, self.data_2_steps[::4]])
+        sequence_lens = np.asarray([1] * len(data_1_padded) + [2] * len(self.data_2_steps[::4]))
+        evidence_mask = np.random.rand(*x.shape) < 0.5
+
+        mpe, interface_states = dynamic_spn.most_probable_explanation(
+            x, sequence_lens, evidence_mask, return_interface_states=True)
+        mpe = mpe.numpy()
+
+        self.assertAllEqual(mpe[evidence_mask], x[evidence_mask])
+        self.assertAllEqual(mpe[:, 0][sequence_lens == 1], x[:, 0][sequence_lens == 1])
+        self.assertAllEqual(interface_states.numpy()[:, 0] == -1, sequence_lens == 1)
+        for row, mask, sequence_len, completion in zip(x, evidence_mask, sequence_lens, mpe):
+            candidates = np.where(mask, row, self.data_2_steps if sequence_len == 2 else data_1_padded)
+            best = np.max(_dynamic_max_product(dynamic_spn, candidates, [sequence_len] * len(candidates)))
+            self.assertAllClose(_dynamic_max_product(dynamic_spn, completion[np.newaxis], [sequence_len])[0], best)
+
+    def test_smoothed_marginals(self):
+        dynamic_spn = get_dynamic_model()
+        for network in [dynamic_spn.interface_network_t0, dynamic_spn.interface_network_t_minus_1]:
+            accumulators = network.layers[0].weights[0]
+            accumulators.assign(np.random.uniform(0.1, 1.0, size=accumulators.shape))
+        num_steps, step_values = 3, get_discrete_data(num_vars=NUM_VARS)
+        sequence_lens = np.asarray([3, 2, 1, 3])
+        x = np.random.randint(2, size=(len(sequence_lens), num_steps, NUM_VARS))
+        x[np.arange(num_steps) < num_steps - sequence_lens[:, np.newaxis]] = 0
+
+        marginals, posteriors = dynamic_spn.smoothed_marginals(x, sequence_lens, return_interface_posteriors=True)
+
+        log_prob = dynamic_spn([x, sequence_lens])[:, 0]
+        for i, sequence_len in enumerate(sequence_lens):
+            for t in range(num_steps - sequence_len):
+                self.assertEqual(marginals[i, t], 0.0)
+            for t in range(num_steps - sequence_len, num_steps):
+                # Marginalize timestep t by summing over all of its values
+                others = np.repeat(x[i:i + 1], len(step_values), axis=0)
+                others[:, t] = step_values
+                marginal = tf.reduce_logsumexp(dynamic_spn([others, [sequence_len] * len(others)]))
+                self.assertAllClose(marginals[i, t], log_prob[i] - marginal)
+                self.assertAllClose(tf.reduce_logsumexp(posteriors[i, t]), 0.0, atol=1e-6)
+
+    def test_windowed_em_statistics(self):
+        dynamic_spn = get_dynamic_model(backprop_mode=spnk.BackpropMode.EM)
+        for network in [dynamic_spn.interface_network_t0, dynamic_spn.interface_network_t_minus_1]:
+            accumulators = network.layers[0].weights[0]
+            accumulators.assign(np.random.uniform(0.1, 1.0, size=accumulators.shape))
+        sequence_lens = np.asarray([7, 3, 1, 6, 7])
+        x = np.random.randint(2, size=(len(sequence_lens), 7, NUM_VARS))
+        with tf.GradientTape() as tape:
+            log_likelihood = dynamic_spn([x, sequence_lens])
+        grads = tape.gradient(log_likelihood, dynamic_spn.trainable_variables)
+
+        for window_size in [1, 3, 10]:
+            em = spnk.GenerativeLearningEM(dynamic_spn, with_sequence_lens=True, window_size=window_size)
+            windowed_log_likelihood, windowed_grads = em._windowed_gradients(x, sequence_lens)
+            self.assertAllClose(windowed_log_likelihood, log_likelihood)
+            for windowed_grad, grad in zip(windowed_grads, grads):
+                self.assertAllClose(windowed_grad, tf.convert_to_tensor(grad), atol=1e-5)
+
+        em = spnk.GenerativeLearningEM(
+            dynamic_spn, with_sequence_lens=True, window_size=3, truncate_windows=True)
+        truncated_log_likelihood, _ = em._windowed_gradients(x, sequence_lens)
+        self.assertAllClose(truncated_log_likelihood, log_likelihood)
+        em.fit(tf.data.Dataset.from_tensors((x, sequence_lens)), epochs=1)
+
+    def test_fused_temporal_sums_match_explicit_products(self):
+        for backprop_mode in [spnk.BackpropMode.EM, spnk.BackpropMode.HARD_EM_UNWEIGHTED]:
+            self._assert_fused_temporal_sums_match_explicit_products(backprop_mode)
+
+    def _assert_fused_temporal_sums_match_explicit_products(self, backprop_mode):
+        dynamic_spn = get_dynamic_model(backprop_mode=backprop_mode)
+        for network in [dynamic_spn.interface_network_t_minus_1, dynamic_spn.top_network]:
+            accumulators = network.layers[0].weights[0]
+            accumulators.assign(np.random.uniform(0.1, 1.0, size=accumulators.shape))
+        fused_spn = spnk.models.DynamicSumProductNetwork(
+            template_network=dynamic_spn.template_network, interface_network_t0=dynamic_spn.interface_network_t0,
+            interface_network_t_minus_1=dynamic_spn.interface_network_t_minus_1,
+            top_network=dynamic_spn.top_network, fuse_temporal_sums=True)
+        sequence_lens = np.asarray([5, 2, 1, 5])
+        x = np.random.randint(2, size=(len(sequence_lens), 5, NUM_VARS))
+
+        with tf.GradientTape(persistent=True) as tape:
+            log_likelihood = dynamic_spn([x, sequence_lens])
+            fused_log_likelihood = fused_spn([x, sequence_lens])
+
+        self.assertAllClose(fused_log_likelihood, log_likelihood)
+        self.assertEqual(len(fused_spn.trainable_variables), len(dynamic_spn.trainable_variables))
+        grads = tape.gradient(log_likelihood, dynamic_spn.trainable_variables)
+        fused_grads = tape.gradient(fused_log_likelihood, fused_spn.trainable_variables)
+        for fused_grad, grad in zip(fused_grads, grads):
+            fused_grad, grad = tf.convert_to_tensor(fused_grad), tf.convert_to_tensor(grad)
+            if backprop_mode == spnk.BackpropMode.EM:
+                self.assertAllClose(fused_grad, grad)
+            else:
+                # Hard EM breaks ties between the equal interface states of the first timestep at random, so
+                # only the total counts of each layer are deterministic
+                self.assertAllClose(tf.reduce_sum(fused_grad), tf.reduce_sum(grad))
+
+    def test_temporal_dense_product_sum(self):
+        a, b = np.random.randn(3, 1, 1, 5).astype(np.float32), np.random.randn(3, 1, 1, 2).astype(np.float32)
+        dense_sum = spnk.layers.DenseSum(
+            num_sums=4, accumulator_initializer=tf.keras.initializers.RandomUniform(0.1, 1.0))
+        product_sum = spnk.layers.TemporalDenseProductSum(dense_sum)
+
+        self.assertAllClose(product_sum([a, b]), dense_sum(spnk.layers.TemporalDenseProduct()([a, b])))
+        self.assertAllClose(product_sum([b, a]), dense_sum(spnk.layers.TemporalDenseProduct()([b, a])))
+
+    def test_temporal_dense_product_sum_hard_em(self):
+        a, b = np.random.randn(3, 1, 1, 5).astype(np.float32), np.random.randn(3, 1, 1, 2).astype(np.float32)
+        dense_sum = spnk.layers.DenseSum(
+            num_sums=4, backprop_mode=spnk.BackpropMode.HARD_EM,
+            accumulator_initializer=tf.keras.initializers.RandomUniform(0.1, 1.0))
+        product_sum = spnk.layers.TemporalDenseProductSum(dense_sum)
+
+        with tf.GradientTape(persistent=True) as tape:
+            out = product_sum([a, b])
+            expected = dense_sum(spnk.layers.TemporalDenseProduct()([a, b]))
+        self.assertAllClose(out, expected)
+        self.assertAllClose(
+            tape.gradient(out, dense_sum.trainable_variables), tape.gradient(expected, dense_sum.trainable_variables))
+
+
+def _max_product(layers, x):
+    for layer in layers:
+        if spnk.topdown.is_sum(layer):
+            x = tf.reduce_max(tf.expand_dims(x, axis=-1) + spnk.topdown.normalized_log_weights(layer), axis=-2)
+        else:
+            x = layer(x)
+    return x
+
+
+def _dynamic_max_product(dynamic_spn, x, sequence_lens):
+    num_batch, num_steps, _ = x.shape
+    interface_t_minus_1 = dynamic_spn.initial_interface_state(num_batch)
+    for t in range(num_steps):
+        step_mask = tf.reshape(tf.cast(t >= num_steps - np.asarray(sequence_lens), tf.float32), [-1, 1, 1, 1])
+        template_out = _max_product(dynamic_spn.template_network.layers, x[:, t])
+        interface_t0 = _max_product(dynamic_spn.interface_network_t0.layers, template_out) * step_mask
+        interface_template_prod = dynamic_spn.temporal_product([interface_t_minus_1, interface_t0]) * step_mask
+        interface_t_minus_1 = _max_product(
+            dynamic_spn.interface_network_t_minus_1.layers, interface_template_prod) * step_mask
+    return _max_product(dynamic_spn.top_network.layers, interface_template_prod).numpy().ravel()
@@ -0,0 +1,306 @@
+import itertools
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import test as tftest
+
+import libspn_keras as spnk
+from tests.utils import indicators, product0_out, product1_out, max_sum0_out, max_root_out, \
+    get_discrete_model, get_discrete_layers, get_continuous_model, get_discrete_data, NUM_VARS
+
+tf.config.experimental_run_functions_eagerly(True)
+
+
+def max_product(x):
+    return max_root_out(product1_out(max_sum0_out(product0_out(indicators(x)))))
+
+
+class TestMostProbableExplanation(tftest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.discrete_spn = get_discrete_model()
+
+    def test_maximizes_max_product_value(self):
+        data = get_discrete_data()
+        evidence_mask = np.random.rand(*data.shape) < 0.5
+
+        mpe = spnk.most_probable_explanation(self.discrete_spn, data, evidence_mask).numpy()
+
+        self.assertAllEqual(mpe[evidence_mask], data[evidence_mask])
+        for row, mask, completion in zip(data, evidence_mask, mpe):
+            best = max(
+                max_product(np.where(mask, row, np.asarray(candidate)).reshape(1, NUM_VARS))[0, 0]
+                for candidate in itertools.product(range(2), repeat=NUM_VARS)
+            )
+            self.assertAllClose(max_product(completion.reshape(1, NUM_VARS))[0, 0], best)
+
+    def test_continuous_leaf_modes(self):
+        spn = get_continuous_model()
+        x = np.random.normal(size=(8, NUM_VARS)).astype(np.float32)
+        evidence_mask = np.random.rand(8, NUM_VARS) < 0.5
+
+        mpe = spnk.most_probable_explanation(spn, x, evidence_mask).numpy()
+
+        self.assertAllEqual(mpe[evidence_mask], x[evidence_mask])
+        # Unobserved variables are set to the location of one of the components
+        self.assertTrue(np.all(np.isin(mpe[~evidence_mask], [0.0, 1.0])))
+
+
+class TestSampling(tftest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.discrete_spn = get_discrete_model()
+        cls.data = get_discrete_data()
+        cls.num_samples = 20000
+
+    def _frequencies(self, samples):
+        # Samples as row indices of get_discrete_data, in which variable i is digit i
+        indices = np.sum(samples * 2 ** np.arange(NUM_VARS), axis=1)
+        return np.bincount(indices, minlength=len(self.data)) / len(samples)
+
+    def test_unconditional(self):
+        samples = spnk.sample(self.discrete_spn, num_samples=self.num_samples).numpy()
+        expected = np.exp(self.discrete_spn(self.data).numpy().ravel())
+        self.assertAllClose(self._frequencies(samples), expected, atol=0.02)
+
+    def test_conditional(self):
+        evidence = np.tile([[1, 0, 0, 0]], [self.num_samples, 1])
+        evidence_mask = np.tile([[True, False, False, True]], [self.num_samples, 1])
+        samples = spnk.sample(self.discrete_spn, evidence=evidence, evidence_mask=evidence_mask).numpy()
+
+        consistent = np.logical_and(self.data[:, 0] == 1, self.data[:, 3] == 0)
+        joint = np.where(consistent, np.exp(self.discrete_spn(self.data).numpy().ravel()), 0.0)
+        self.assertAllClose(self._frequencies(samples), joint / joint.sum(), atol=0.02)
+
+
+def _spatial_model():
+    sum_kwargs = dict(accumulator_initializer=tf.keras.initializers.RandomUniform(0.1, 2.0, seed=1234))
+    spn = tf.keras.Sequential([
+        spnk.layers.BernoulliLeaf(
+            num_components=2, input_shape=(2, 2, 1),
+            logits_initializer=tf.keras.initializers.RandomNormal(stddev=2.0, seed=1234)),
+        spnk.layers.Conv2DProduct(
+            strides=[1, 1], dilations=[1, 1], kernel_size=[2, 2], padding='full', num_channels=4),
+        spnk.layers.Conv2DSum(num_sums=3, **sum_kwargs),
+        spnk.layers.Conv2DProduct(
+            depthwise=True, strides=[1, 1], dilations=[2, 2], kernel_size=[2, 2], padding='final'),
+        spnk.layers.Local2DSum(num_sums=2, **sum_kwargs),
+        spnk.layers.SpatialToRegions(),
+        spnk.layers.RootSum(return_weighted_child_logits=False, **sum_kwargs)
+    ])
+    images = np.asarray(list(itertools.product(range(2), repeat=4))).reshape(-1, 2, 2, 1)
+    return spn, images
+
+
+def _spatial_max_product(spn, x):
+    out = spn.layers[0](x)
+    for layer in spn.layers[1:]:
+        if spnk.topdown.is_sum(layer):
+            out = tf.reshape(out, [-1] + list(layer.input_shape[1:3]) + [layer.input_shape[-1], 1])
+            out = tf.reduce_max(out + spnk.topdown.normalized_log_weights(layer), axis=3)
+        else:
+            out = layer(out)
+    return tf.reshape(out, [-1]).numpy()
+
+
+class TestSpatialTopDown(tftest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.spn, cls.images = _spatial_model()
+
+    def test_mpe(self):
+        evidence_mask = np.random.rand(*self.images.shape) < 0.5
+
+        mpe = spnk.most_probable_explanation(self.spn, self.images, evidence_mask).numpy()
+
+        self.assertAllEqual(mpe[evidence_mask], self.images[evidence_mask])
+        max_product = _spatial_max_product(self.spn, self.images)
+        for image, mask, completion in zip(self.images, evidence_mask, mpe):
+            consistent = np.all(np.logical_or(~mask, self.images == image), axis=(1, 2, 3))
+            self.assertAllClose(
+                _spatial_max_product(self.spn, completion[np.newaxis])[0], max_product[consistent].max())
+
+    def test_sample(self):
+        probs = np.exp(self.spn(self.images).numpy().ravel())
+        self.assertAllClose(probs.sum(), 1.0)
+
+        samples = spnk.sample(self.spn, num_samples=20000).numpy()
+
+        indices = np.sum(samples.reshape(-1, 4).astype(np.int64) * 2 ** np.arange(3, -1, -1), axis=1)
+        self.assertAllClose(np.bincount(indices, minlength=16) / len(samples), probs, atol=0.02)
+
+
+class TestCheckpointProducts(tftest.TestCase):
+
+    def test_spatial_gradients(self):
+        # Gradients of dilated convolutions are not supported on all CPU builds
+        sum_kwargs = dict(accumulator_initializer=tf.keras.initializers.RandomUniform(0.1, 2.0, seed=1234))
+        spn = tf.keras.Sequential([
+            spnk.layers.BernoulliLeaf(num_components=2, input_shape=(4, 4, 1)),
+            spnk.layers.Conv2DProduct(strides=[2, 2], dilations=[1, 1], kernel_size=[2, 2], num_channels=4),
+            spnk.layers.Conv2DSum(num_sums=3, **sum_kwargs),
+            spnk.layers.Conv2DProduct(depthwise=True, strides=[2, 2], dilations=[1, 1], kernel_size=[2, 2]),
+            spnk.layers.Local2DSum(num_sums=2, **sum_kwargs),
+            spnk.layers.SpatialToRegions(),
+            spnk.layers.RootSum(return_weighted_child_logits=False, **sum_kwargs)
+        ])
+        checkpointed_spn = spnk.models.SequentialSumProductNetwork(spn.layers, checkpoint_products=True)
+        images = np.random.randint(2, size=(8, 4, 4, 1))
+
+        outputs, grads = [], []
+        for model in [spn, checkpointed_spn]:
+            with tf.GradientTape() as tape:
+                outputs.append(model(images))
+            grads.append(tape.gradient(outputs[-1], model.trainable_variables))
+
+        self.assertAllClose(outputs[1], outputs[0])
+        for checkpointed_grad, grad in zip(grads[1], grads[0]):
+            self.assertAllClose(checkpointed_grad, grad)
+
+
+class TestConditionalQueries(tftest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.discrete_spn = get_discrete_model()
+        cls.data = get_discrete_data()
+
+    def test_discrete_conditionals(self):
+        evidence_mask = np.random.rand(*self.data.shape) < 0.5
+        query_mask = np.logical_and(np.random.rand(*self.data.shape) < 0.5, ~evidence_mask)
+
+        got = self.discrete_spn.conditional_log_prob(self.data, evidence_mask, query_mask).numpy()
+
+        joint = np.exp(self.discrete_spn(self.data).numpy().ravel())
+
+        def marginal(row, mask):
+            return joint[np.all(np.logical_or(~mask, self.data == row), axis=1)].sum()
+
+        for row, e, q, conditional in zip(self.data, evidence_mask, query_mask, got):
+            self.assertAllClose(conditional[0], np.log(marginal(row, e | q) / marginal(row, e)), atol=1e-5)
+
+    def test_continuous_matches_marginalized_forward_passes(self):
+        spn = get_continuous_model()
+        x = np.random.normal(size=(8, NUM_VARS)).astype(np.float32)
+        evidence_mask = np.random.rand(8, NUM_VARS) < 0.5
+        query_mask = ~evidence_mask
+
+        got = spn.conditional_log_prob(x, evidence_mask, query_mask)
+
+        joint_log_prob = spn(x)
+        evidence_log_prob = _marginalized_forward_pass(spn, x, evidence_mask)
+        self.assertAllClose(got, joint_log_prob - evidence_log_prob, rtol=1e-5)
+
+    def test_multiple_queries_share_evidence(self):
+        evidence_mask = np.random.rand(*self.data.shape) < 0.5
+        query_masks = np.random.rand(self.data.shape[0], 3, NUM_VARS) < 0.5
+
+        got = self.discrete_spn.conditional_log_prob(self.data, evidence_mask, query_masks)
+
+        self.assertEqual(got.shape, [len(self.data), 3, 1])
+        for i in range(3):
+            self.assertAllClose(
+                got[:, i], self.discrete_spn.conditional_log_prob(self.data, evidence_mask, query_masks[:, i]))
+
+    def test_functional_chain(self):
+        x = tf.keras.Input(shape=(NUM_VARS,), dtype=tf.int32)
+        out = x
+        for layer in get_discrete_layers():
+            out = layer(out)
+        spn = spnk.models.SumProductNetwork(inputs=x, outputs=out)
+        evidence_mask = np.random.rand(*self.data.shape) < 0.5
+        query_mask = ~evidence_mask
+
+        self.assertAllClose(
+            spn.conditional_log_prob(self.data, evidence_mask, query_mask),
+            self.discrete_spn.conditional_log_prob(self.data, evidence_mask, query_mask))
+
+    def test_functional_branches_rejected(self):
+        x = tf.keras.Input(shape=(NUM_VARS,), dtype=tf.int32)
+        leaf_out = spnk.layers.IndicatorLeaf(num_components=2)(spnk.layers.FlatToRegions(num_decomps=1)(x))
+        products = spnk.layers.DenseProduct(num_factors=NUM_VARS)(leaf_out)
+        branches = [spnk.layers.DenseSum(num_sums=1)(products) for _ in range(2)]
+        out = spnk.layers.RootSum()(tf.keras.layers.Concatenate(axis=-1)(branches))
+        spn = spnk.models.SumProductNetwork(inputs=x, outputs=out)
+        evidence_mask = np.random.rand(*self.data.shape) < 0.5
+
+        with self.assertRaisesRegex(ValueError, "chain"):
+            spn.conditional_log_prob(self.data, evidence_mask, ~evidence_mask)
+
+
+class TestAllConditionals(tftest.TestCase):
+
+    def test_discrete(self):
+        spn = get_discrete_model()
+        data = get_discrete_data()
+
+        got = spn.all_conditionals(data).numpy()
+
+        joint = np.exp(spn(data).numpy().ravel())
+        for row, conditionals in zip(data, got):
+            for i in range(NUM_VARS):
+                others = np.all(np.delete(data == row, i, axis=1), axis=1)
+                self.assertAllClose(
+                    conditionals[i], np.log(joint[np.all(data == row, axis=1)].sum() / joint[others].sum()))
+
+    def test_continuous_matches_marginalized_forward_passes(self):
+        spn = get_continuous_model()
+        # Values far from the component locations make the naive derivatives underflow
+        x = np.random.normal(scale=10.0, size=(8, NUM_VARS)).astype(np.float32)
+
+        got = spn.all_conditionals(x)
+
+        for i in range(NUM_VARS):
+            evidence_mask = np.arange(NUM_VARS) != i
+            expected = spn(x) - _marginalized_forward_pass(spn, x, np.tile(evidence_mask, [8, 1]))
+            self.assertAllClose(got[:, i], expected[:, 0], rtol=1e-4)
+
+
+def _marginalized_forward_pass(spn, x, evidence_mask):
+    pre_leaf_layers, leaf, post_leaf_layers = spnk.topdown.split_at_leaf(spn)
+    out = x
+    for layer in pre_leaf_layers:
+        out, evidence_mask = layer(out), layer(evidence_mask)
+    out = leaf(out, marginalize_mask=np.logical_not(evidence_mask))
+    for layer in post_leaf_layers:
+        out = layer(out)
+    return out
+
+
+class TestIncrementalEvaluator(tftest.TestCase):
+
+    def _assert_updates_match_full_evaluation(self, spn, x, new_x):
+        evaluator = spnk.IncrementalEvaluator(spn)
+        self.assertAllClose(evaluator(x), spn(x))
+        for changed_vars in [[0], [1, 3]]:
+            x = x.copy()
+            x[:, changed_vars] = new_x[:, changed_vars]
+            self.assertAllClose(evaluator.update(x, changed_vars), spn(x), rtol=1e-5)
+
+    def test_discrete(self):
+        data = get_discrete_data()
+        self._assert_updates_match_full_evaluation(get_discrete_model(), data, data[::-1].copy())
+
+    def test_continuous(self):
+        x, new_x = np.random.normal(size=(2, 8, NUM_VARS)).astype(np.float32)
+        self._assert_updates_match_full_evaluation(get_continuous_model(), x, new_x)
+
+    def test_padded_scopes_and_decompositions(self):
+        spn = spnk.models.SequentialSumProductNetwork([
+            spnk.layers.FlatToRegions(num_decomps=2, input_shape=[6]),
+            spnk.layers.NormalLeaf(num_components=2),
+            spnk.layers.PermuteAndPadScopesRandom(factors=[2, 2, 2]),
+            spnk.layers.DenseProduct(num_factors=2),
+            spnk.layers.DenseSum(num_sums=2),
+            spnk.layers.DenseProduct(num_factors=2),
+            spnk.layers.DenseSum(num_sums=2),
+            spnk.layers.DenseProduct(num_factors=2),
+            spnk.layers.Undecompose(),
+            spnk.layers.RootSum(return_weighted_child_logits=False),
+        ])
+        spn.set_weights([np.random.uniform(0.5, 2.0, size=w.shape) for w in spn.get_weights()])
+        x, new_x = np.random.normal(size=(2, 8, 6)).astype(np.float32)
+        self._assert_updates_match_full_evaluation(spn, x, new_x)
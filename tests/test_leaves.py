@@ -0,0 +1,218 @@
+import numpy as np
+import tensorflow as tf
+import tensorflow_probability as tfp
+from tensorflow import test as tftest
+from tensorflow.keras import initializers
+
+import libspn_keras as spnk
+from libspn_keras.math import location_scale
+
+tf.config.experimental_run_functions_eagerly(True)
+
+
+def _leaf_output(leaf, x, num_decomps=2):
+    flat_to_regions = spnk.layers.FlatToRegions(num_decomps=num_decomps)
+    return leaf(flat_to_regions(x))
+
+
+class TestQuantizedLeaf(tftest.TestCase):
+
+    def setUp(self):
+        self.data = np.random.randint(256, size=(8, 5))
+        self.location_initializer = initializers.RandomUniform(0.0, 255.0, seed=1234)
+        self.scale_initializer = initializers.Constant(30.0)
+
+    def _leaf_pair(self, leaf_class, **kwargs):
+        leaf_kwargs = dict(
+            num_components=3, location_initializer=self.location_initializer,
+            scale_initializer=self.scale_initializer, **kwargs)
+        return leaf_class(**leaf_kwargs), leaf_class(num_quantized_levels=256, **leaf_kwargs)
+
+    def test_matches_direct_evaluation(self):
+        for leaf_class in [spnk.layers.NormalLeaf, spnk.layers.LaplaceLeaf, spnk.layers.CauchyLeaf]:
+            direct, quantized = self._leaf_pair(leaf_class)
+            expected = _leaf_output(direct, self.data.astype(np.float32))
+            got = _leaf_output(quantized, self.data.astype(np.uint8))
+            self.assertAllClose(got, expected, rtol=1e-5)
+
+    def test_em_statistics_match_direct_evaluation(self):
+        direct, quantized = self._leaf_pair(
+            spnk.layers.NormalLeaf, use_accumulators=True, scale_trainable=True)
+        grads = []
+        for leaf, x in [(direct, self.data.astype(np.float32)), (quantized, self.data)]:
+            with tf.GradientTape() as tape:
+                out = _leaf_output(leaf, x)
+            grads.append(tape.gradient(out, leaf.trainable_variables))
+
+        for expected, got in zip(*grads):
+            self.assertAllClose(got, expected, rtol=1e-4)
+
+    def test_rejects_out_of_range_levels(self):
+        _, quantized = self._leaf_pair(spnk.layers.NormalLeaf)
+        for out_of_range in [-1, 256]:
+            x = np.copy(self.data)
+            x[3, 2] = out_of_range
+            with self.assertRaises(tf.errors.InvalidArgumentError):
+                _leaf_output(quantized, x)
+            # Evaluation of only the observed entries
+            with self.assertRaises(tf.errors.InvalidArgumentError):
+                quantized(spnk.layers.FlatToRegions(num_decomps=2)(x), marginalize_mask=np.tile(np.arange(5) != 2, [8, 1]))
+
+
+class TestLocationScaleKernels(tftest.TestCase):
+
+    def test_matches_tfp(self):
+        x = np.linspace(-40.0, 40.0, num=161).astype(np.float32).reshape(-1, 1)
+        loc = np.asarray([[-1.0, 0.0, 2.5]], dtype=np.float32)
+        scale = np.asarray([[0.5, 1.0, 3.0]], dtype=np.float32)
+        log_scale = np.log(scale)
+        families = [
+            (tfp.distributions.Normal, location_scale.normal_log_prob, location_scale.normal_log_cdf),
+            (tfp.distributions.Laplace, location_scale.laplace_log_prob, location_scale.laplace_log_cdf),
+            (tfp.distributions.Cauchy, location_scale.cauchy_log_prob, location_scale.cauchy_log_cdf),
+        ]
+        for distribution_class, log_prob_fn, log_cdf_fn in families:
+            distribution = distribution_class(loc=loc, scale=scale)
+            self.assertAllClose(log_prob_fn(x, loc, log_scale), distribution.log_prob(x), rtol=1e-5)
+            self.assertAllClose(log_cdf_fn(x, loc, log_scale), distribution.log_cdf(x), rtol=1e-5)
+
+    def test_samples_keep_dtype(self):
+        loc = tf.zeros([1000], dtype=tf.float64)
+        for sample_fn in [location_scale.normal_sample, location_scale.laplace_sample, location_scale.cauchy_sample]:
+            samples = sample_fn(loc, loc)
+            self.assertEqual(samples.dtype, tf.float64)
+            self.assertTrue(np.all(np.isfinite(samples)))
+
+
+class TestCategoricalLeaf(tftest.TestCase):
+
+    def setUp(self):
+        self.num_values = 7
+        self.data = np.random.randint(self.num_values, size=(16, 5))
+
+    def test_gathers_normalized_probabilities(self):
+        leaf = spnk.layers.CategoricalLeaf(num_components=3, num_values=self.num_values)
+        out = _leaf_output(leaf, self.data)
+
+        log_probs = leaf._log_prob_table().numpy()
+        self.assertAllClose(np.exp(log_probs).sum(axis=3), np.ones([5, 2, 1, 3]))
+        # The first decomposition is the identity permutation of the variables
+        expected = log_probs[np.arange(5), 0, 0, self.data].reshape(16, 5, 3)
+        self.assertAllClose(out[:, :, 0], expected)
+
+    def test_em_grads_are_counts(self):
+        leaf = spnk.layers.CategoricalLeaf(
+            num_components=3, num_values=self.num_values, backprop_mode=spnk.BackpropMode.EM)
+        with tf.GradientTape() as tape:
+            out = _leaf_output(leaf, self.data, num_decomps=1)
+        counts = tape.gradient(out, leaf.trainable_variables)[0]
+
+        expected = np.zeros([5, 1, 1, self.num_values, 3])
+        for scope in range(5):
+            expected[scope, 0, 0] = np.bincount(
+                self.data[:, scope], minlength=self.num_values)[:, np.newaxis]
+        self.assertAllClose(counts, expected)
+
+    def test_rejects_out_of_range_values(self):
+        leaf = spnk.layers.CategoricalLeaf(num_components=3, num_values=self.num_values)
+        x = np.copy(self.data)
+        x[0, 0] = self.num_values
+        with self.assertRaises(tf.errors.InvalidArgumentError):
+            _leaf_output(leaf, x)
+
+
+class TestBernoulliLeaf(tftest.TestCase):
+
+    def setUp(self):
+        self.data = np.random.randint(2, size=(16, 21))
+
+    def test_bit_packed_matches_unpacked(self):
+        logits_initializer = initializers.RandomNormal(seed=1234)
+        leaf = spnk.layers.BernoulliLeaf(num_components=3, logits_initializer=logits_initializer)
+        packed_leaf = spnk.layers.BernoulliLeaf(
+            num_components=3, bit_packed=True, num_vars=21, logits_initializer=logits_initializer)
+
+        expected = _leaf_output(leaf, self.data)
+        got = _leaf_output(packed_leaf, np.packbits(self.data, axis=1))
+        self.assertAllClose(got, expected)
+
+        # [scopes, decomps, multivariate_size, 1, num_components] -> [1, scopes, decomps,
+        # num_components, multivariate_size]
+        logits = tf.transpose(leaf.logits, (3, 0, 1, 4, 2))
+        distribution = tfp.distributions.Bernoulli(logits=logits)
+        log_prob = distribution.log_prob(self.data.reshape(16, 21, 1, 1, 1).astype(np.float32))
+        self.assertAllClose(expected, tf.reduce_sum(log_prob, axis=-1))
+
+    def test_em_statistics(self):
+        leaf = spnk.layers.BernoulliLeaf(
+            num_components=3, use_accumulators=True, backprop_mode=spnk.BackpropMode.EM)
+        with tf.GradientTape() as tape:
+            out = _leaf_output(leaf, self.data, num_decomps=1)
+        counts = tape.gradient(out, leaf.accumulators)
+
+        num_ones = self.data.sum(axis=0).reshape(21, 1, 1, 1, 1)
+        expected = np.tile(np.concatenate([16 - num_ones, num_ones], axis=3), [1, 1, 1, 1, 3])
+        self.assertAllClose(counts, expected)
+
+    def test_accumulators_with_gradient_backprop(self):
+        leaf = spnk.layers.BernoulliLeaf(num_components=3, use_accumulators=True)
+        with tf.GradientTape() as tape:
+            out = _leaf_output(leaf, self.data, num_decomps=1)
+        grads = tape.gradient(out, leaf.accumulators)
+
+        # The probabilities are invariant to scaling the counts of a component
+        self.assertAllClose(tf.reduce_sum(grads * leaf.accumulators, axis=3), tf.zeros([21, 1, 1, 3]), atol=1e-4)
+
+    def test_em_requires_accumulators(self):
+        with self.assertRaises(ValueError):
+            spnk.layers.BernoulliLeaf(num_components=3, backprop_mode=spnk.BackpropMode.EM)
+
+
+class TestMarginalization(tftest.TestCase):
+
+    def setUp(self):
+        self.marginalize_mask = np.random.rand(16, 5, 2) < 0.8
+
+    def _leaves(self, leaf_class, **kwargs):
+        # A threshold of 0 never uses sparse evaluation, a threshold of 1 always does
+        return leaf_class(sparse_evaluation_threshold=0.0, **kwargs), \
+            leaf_class(sparse_evaluation_threshold=1.1, **kwargs)
+
+    def _assert_sparse_matches_dense(self, dense, sparse, x):
+        outputs, grads = [], []
+        for leaf in [dense, sparse]:
+            with tf.GradientTape() as tape:
+                out = leaf(spnk.layers.FlatToRegions(num_decomps=2)(x), marginalize_mask=self.marginalize_mask)
+            outputs.append(out)
+            grads.append(tape.gradient(out, leaf.trainable_variables))
+
+        self.assertAllEqual(tf.equal(outputs[0], 0.0)[..., 0], self.marginalize_mask)
+        self.assertAllClose(outputs[1], outputs[0])
+        for expected, got in zip(*grads):
+            self.assertAllClose(got, expected)
+
+    def test_location_scale_leaves(self):
+        location_initializer = initializers.RandomNormal(seed=1234)
+        x = np.random.normal(size=(16, 5)).astype(np.float32)
+        for kwargs in [dict(), dict(use_accumulators=True, scale_trainable=True),
+                       dict(use_accumulators=True, scale_trainable=False)]:
+            dense, sparse = self._leaves(
+                spnk.layers.NormalLeaf, num_components=3, location_initializer=location_initializer, **kwargs)
+            self._assert_sparse_matches_dense(dense, sparse, x)
+
+    def test_quantized_leaf(self):
+        dense, sparse = self._leaves(
+            spnk.layers.LaplaceLeaf, num_components=3, num_quantized_levels=8,
+            location_initializer=initializers.RandomUniform(0.0, 8.0, seed=1234))
+        self._assert_sparse_matches_dense(dense, sparse, np.random.randint(8, size=(16, 5)))
+
+    def test_discrete_leaves(self):
+        self._assert_sparse_matches_dense(
+            *self._leaves(spnk.layers.CategoricalLeaf, num_components=3, num_values=4,
+                          accumulator_initializer=initializers.Constant(1.0),
+                          backprop_mode=spnk.BackpropMode.EM),
+            np.random.randint(4, size=(16, 5)))
+        self._assert_sparse_matches_dense(
+            *self._leaves(spnk.layers.BernoulliLeaf, num_components=3, use_accumulators=True,
+                          logits_initializer=initializers.Zeros(), backprop_mode=spnk.BackpropMode.EM),
+            np.random.randint(2, size=(16, 5)))
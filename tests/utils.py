@@ -67,6 +67,17 @@ def root_out(x):
     return out
 
 
+def max_sum0_out(x):
+    x = np.transpose(x, (1, 2, 0, 3))
+    out = np.max(np.expand_dims(x, -1) * np.expand_dims(FIRST_SUM_WEIGHTS, 2), axis=3)
+    return np.transpose(out, (2, 0, 1, 3))
+
+
+def max_root_out(x):
+    x = np.reshape(x, (-1, 4))
+    return np.max(x * SECOND_SUM_WEIGHTS, axis=1, keepdims=True)
+
+
 def get_discrete_data(num_vars=None):
     num_vars = num_vars or NUM_VARS
     var_assignments = np.arange(NUM_COMPONENTS ** num_vars)
@@ -120,8 +131,8 @@ def get_continuous_model(infer_no_evidence=False):
     return spn
 
 
-def get_dynamic_model():
-    sum_kwargs = dict(logspace_accumulators=False, backprop_mode=BackpropMode.HARD_EM_UNWEIGHTED)
+def get_dynamic_model(backprop_mode=BackpropMode.HARD_EM_UNWEIGHTED):
+    sum_kwargs = dict(logspace_accumulators=False, backprop_mode=backprop_mode)
     template = keras.models.Sequential([
         spnk.layers.FlatToRegions(num_decomps=1, input_shape=(NUM_VARS,), dtype=tf.int32),
         spnk.layers.IndicatorLeaf(num_components=NUM_COMPONENTS),
@@ -153,7 +164,13 @@ def get_dynamic_model():
 
 
 def get_discrete_model():
-    spn = SequentialSumProductNetwork([
+    spn = SequentialSumProductNetwork(get_discrete_layers())
+    spn.summary()
+    return spn
+
+
+def get_discrete_layers():
+    return [
         spnk.layers.FlatToRegions(num_decomps=1, input_shape=(NUM_VARS,), dtype=tf.int32),
         spnk.layers.IndicatorLeaf(num_components=NUM_COMPONENTS),
         spnk.layers.PermuteAndPadScopes([[0, 1, 2, 3]]),
@@ -172,6 +189,4 @@ def get_discrete_model():
             accumulator_initializer=initializers.Constant(SECOND_SUM_WEIGHTS),
             return_weighted_child_logits=False
         ),
-    ])
-    spn.summary()
-    return spn
+    ]